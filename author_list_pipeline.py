@@ -0,0 +1,171 @@
+# Build an author list once and render it in any number of formats in the same
+# process, without writing and re-reading authors.json in between. The
+# functions here can also be used as a library, e.g.
+#
+#   paper = author_list_pipeline.build_xwiki('cta_authors.json')
+#   with open('authors.tex','w') as fp:
+#       author_list_pipeline.render(paper, 'aa', fp)
+#
+# Formats are "json", "csv", "xml" (XWiki author lists only) and the LaTeX
+# styles of render_authors_latex.py ("sapo", "mnras", "aa", "aa-astroph").
+
+import io
+import sys
+import argparse
+import concurrent.futures
+import encoding_cache
+import json_backend
+import profiler
+import build_json_author_list as sapo
+import xwiki_json_author_list as xwiki
+import render_authors_latex
+import render_authors_xml
+import render_authors_csv
+
+latex_styles = [ 'sapo', 'mnras', 'aa', 'aa-astroph' ]
+formats = [ 'json', 'csv', 'xml' ] + latex_styles
+
+def build_sapo_csv(csv_base='SAPO Author List', opt_in_sheet='Opt in', corresponding=[],
+        people_sheet='People', places_sheet='Places', alt_email_sheet='Alternative email'):
+    def csv_name(sheet):
+        return csv_base + ' - ' + sheet + '.csv'
+    return sapo.make_author_list(sapo.load_alt_email_csv(csv_name(alt_email_sheet)),
+        sapo.load_places_csv(csv_name(places_sheet)), sapo.load_people_csv(csv_name(people_sheet)),
+        sapo.load_signers_csv(csv_name(opt_in_sheet)), corresponding)
+
+def build_sapo_google(uploader, google_base, opt_in_sheet='Opt in', corresponding=[],
+        people_sheet='People', places_sheet='Places', alt_email_sheet='Alternative email'):
+    def sheet_name(sheet):
+        return google_base + '#' + sheet
+    alt_email, places, people, signers = sapo.load_all_google(uploader,
+        sheet_name(alt_email_sheet), sheet_name(places_sheet),
+        sheet_name(people_sheet), sheet_name(opt_in_sheet))
+    return sapo.make_author_list(alt_email, places, people, signers, corresponding)
+
+def build_xwiki(paper):
+    # "paper" is the XWiki export, or the name of a file containing it
+    if(isinstance(paper, str)):
+        with open(paper,'r') as fp:
+            paper = json_backend.load(fp)
+    return xwiki.make_author_list(paper)
+
+def render(paper, format, fp, title='', orcid=False, suppress_summary=False, publication_reference=''):
+    if(format == 'json'):
+        sapo.dump_author_list(paper, fp)
+    elif(format == 'csv'):
+        render_authors_csv.render_author_list(paper, fp)
+    elif(format == 'xml'):
+        render_authors_xml.render_author_list(paper, fp, publication_reference)
+    elif(format in latex_styles):
+        render_authors_latex.render_author_list(paper,
+            render_authors_latex.make_renderer(format, orcid, fp), title, suppress_summary)
+    else:
+        raise RuntimeError('Unknown author list format : '+format)
+
+def render_all(paper, formats, title='', orcid=False, suppress_summary=False, publication_reference='', workers=1):
+    # Render "paper" in each of "formats", returning a dict of the text of each.
+    # The LaTeX styles are written together in a single walk over the authors
+    # and affiliations. With more than one worker the formats are instead
+    # spread over a pool of processes, each rendering one format.
+    if(workers > 1 and len(formats) > 1):
+        with concurrent.futures.ProcessPoolExecutor(min(workers, len(formats)),
+                initializer=render_worker_init, initargs=(paper, title, orcid,
+                    suppress_summary, publication_reference)) as pool:
+            return dict(zip(formats, pool.map(render_worker, formats)))
+
+    outputs = { format: io.StringIO() for format in formats }
+    styles = [ format for format in formats if format in latex_styles ]
+    if(styles):
+        render_authors_latex.render_author_list(paper, render_authors_latex.MultiLatexRenderer(
+            [ render_authors_latex.make_renderer(style, orcid, outputs[style]) for style in styles ]),
+            title, suppress_summary)
+    for format in formats:
+        if(format not in latex_styles):
+            render(paper, format, outputs[format], title, orcid, suppress_summary, publication_reference)
+    return { format: outputs[format].getvalue() for format in formats }
+
+# Author list and options of the worker processes of render_all
+render_worker_args = None
+
+def render_worker_init(*args):
+    global render_worker_args
+    render_worker_args = args
+
+def render_worker(format):
+    paper, title, orcid, suppress_summary, publication_reference = render_worker_args
+    fp = io.StringIO()
+    render(paper, format, fp, title, orcid, suppress_summary, publication_reference)
+    return fp.getvalue()
+
+def write_all(outputs, base):
+    for format in outputs:
+        filename = output_filename(base, format)
+        with open(filename,'w') as fp:
+            fp.write(outputs[format])
+        print("Info wrote :",filename)
+
+def output_filename(base, format):
+    if(format in latex_styles):
+        return base + '_' + format + '.tex'
+    return base + '.' + format
+
+# ================ #
+# Main entry point #
+# ================ #
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--xwiki_input', default=None, help='Build from this XWiki export rather than from the SAPO sheets')
+    parser.add_argument('--opt_in_sheet', default='Opt in', help='Name of author opt-in sheet in Google or as CSV file (default: "%(default)s")')
+    parser.add_argument('--csv_base', default='SAPO Author List', help='Base name of CSV files (default: "%(default)s")')
+    parser.add_argument('--google_base', default=None, help='Base address of SAPO Authorship sheet. If not set, then read data from CSV files rather than Google')
+    parser.add_argument('--google_token', default='token.pickle', help='Google authentication token (default: "%(default)s")')
+    parser.add_argument('--snapshot_dir', default='~/.cache/sapo_authorlist/sheets', help='Directory in which to keep snapshots of the Google sheets, or empty to disable (default: "%(default)s")')
+    parser.add_argument('--email_authors', default=None, help='IDs of people whose email addresses should be added. Should be given as a list of People IDs')
+    parser.add_argument('--formats', default='json,sapo', help='Comma separated list of formats to write, from %s (default: "%%(default)s")'%', '.join(formats))
+    parser.add_argument('--output_base', '-o', default='authors', help='Base name of output files, e.g. "authors" gives authors.json and authors_sapo.tex (default: "%(default)s")')
+    parser.add_argument('--title', '-t', default='', help='Title for LaTeX document')
+    parser.add_argument('--suppress_summary', action='store_true', help='Suppress SAPO summary information in LaTeX')
+    parser.add_argument('--orcid', action='store_true', help='Output ORCID identities for authors where they are available and supported by the LaTeX style')
+    parser.add_argument('--publication_reference', '-r', default='', help='Publication reference for XML document')
+    parser.add_argument('--render_workers', type=int, default=1, help='Number of processes over which to spread the formats, or 1 to write all LaTeX styles in a single pass (default: %(default)s)')
+    parser.add_argument('--encoding_cache', default=encoding_cache.default_filename, help='File in which to cache LaTeX, HTML and ASCII encodings between runs, or empty to disable (default: "%(default)s")')
+    parser.add_argument('--encoding_cache_size', type=int, default=100000, help='Maximum number of entries in the encoding cache (default: %(default)s)')
+    profiler.add_arguments(parser)
+
+    args = parser.parse_args()
+
+    prof = profiler.from_args(args)
+
+    requested = [ x.strip() for x in args.formats.split(',') if x.strip() ]
+    for format in requested:
+        if(format not in formats):
+            print("ERROR unknown format :",format)
+            sys.exit(1)
+
+    builder = xwiki if args.xwiki_input else sapo
+    with prof.stage('encoding_cache_load'):
+        builder.cache.open(args.encoding_cache, args.encoding_cache_size)
+
+    corresponding = args.email_authors.split(',') if args.email_authors else []
+    with prof.stage('build'):
+        if(args.xwiki_input):
+            paper = build_xwiki(args.xwiki_input)
+        elif(args.google_base):
+            google_uploader = sapo.uploader.GoogleDriveUploader(args.google_token, None, loud=True,
+                snapshot_directory=args.snapshot_dir)
+            paper = build_sapo_google(google_uploader, args.google_base, args.opt_in_sheet, corresponding)
+        else:
+            paper = build_sapo_csv(args.csv_base, args.opt_in_sheet, corresponding)
+
+    with prof.stage('render'):
+        outputs = render_all(paper, requested, args.title, args.orcid, args.suppress_summary,
+            args.publication_reference, args.render_workers)
+
+    with prof.stage('write'):
+        write_all(outputs, args.output_base)
+
+    with prof.stage('encoding_cache_save'):
+        builder.cache.save()
+
+    prof.finish()
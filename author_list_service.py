@@ -0,0 +1,298 @@
+# Long-running author list service. The People, Places and Alternative email
+# tabs, the opt-in tabs that have been asked for, and the encoded names and
+# addresses are kept in memory and refreshed on a schedule, so that author
+# lists can be served over a local HTTP API without the cost of starting a
+# script, authenticating with Google and re-encoding everything.
+#
+# GET  /status                     : what is loaded and when
+# GET  /authors.json?opt_in=TAB    : author list for an opt-in tab, as written
+#                                    by build_json_author_list.py
+# GET  /authors.tex?opt_in=TAB     : LaTeX for an opt-in tab
+# POST /xwiki/authors.json         : author list for the XWiki export in the
+#                                    body, as written by xwiki_json_author_list.py
+# POST /xwiki/authors.tex          : LaTeX for the XWiki export in the body
+# POST /xwiki/authors.xml          : XML for the XWiki export in the body
+# POST /refresh                    : reload the tabs now
+#
+# Other query parameters are "email_authors" (comma separated People IDs),
+# "render" (LaTeX style), "title", "orcid", "suppress_summary" and
+# "publication_reference", with the same meaning as the script options.
+#
+# Without --google_base the tabs are read from CSV files, which serves as a
+# local stand-in for Google when testing.
+
+import io
+import sys
+import json
+import time
+import signal
+import argparse
+import threading
+import urllib.parse
+import http.server
+import encoding_cache
+import uploader
+import build_json_author_list as sapo
+import xwiki_json_author_list as xwiki
+import author_list_pipeline
+
+def save_encoding_cache():
+    # The XWiki builder adds its encodings to the entries of the SAPO builder's
+    # cache, see main, so only that one is saved
+    if(xwiki.cache.modified):
+        sapo.cache.modified = True
+        xwiki.cache.modified = False
+    sapo.cache.save()
+
+class SAPOData:
+    # One load of the tabs. It is not changed once built, other than to add
+    # opt-in tabs and cached results, so requests can keep using it while a
+    # refresh builds the next one.
+    def __init__(self, alt_email, places, people, signers, previous=None):
+        # Keep the records, and so the fields already encoded, of all people
+        # and places whose rows have not changed since the previous load
+        if(previous is not None):
+            for pid in people:
+                if(pid in previous.people and previous.people[pid].fingerprint == people[pid].fingerprint):
+                    people[pid] = previous.people[pid]
+            for pid in places:
+                if(pid in previous.places and previous.places[pid].fingerprint == places[pid].fingerprint):
+                    places[pid] = previous.places[pid]
+        self.alt_email = alt_email
+        self.places = places
+        self.people = people
+        self.signers = signers
+        self.main_emails, self.cta_emails = sapo.check_people(people, places)
+        self.loaded = time.time()
+        self.results = dict()
+
+class AuthorListService:
+    def __init__(self, args, uploader=None):
+        self.args = args
+        self.uploader = uploader
+        self.opt_in_sheets = [ args.opt_in_sheet ]
+        self.data = None
+        self.refresh_lock = threading.Lock()
+        self.stop = threading.Event()
+        self.nrefresh = 0
+        self.last_error = None
+
+    def sheet_name(self, sheet):
+        return self.args.google_base + '#' + sheet
+
+    def csv_name(self, sheet):
+        return self.args.csv_base + ' - ' + sheet + '.csv'
+
+    def load_tabs(self, opt_in_sheets):
+        if(self.uploader is not None):
+            alt_email, places, people, signers = sapo.load_all_google_batch(self.uploader,
+                self.sheet_name(self.args.alt_email_sheet), self.sheet_name(self.args.places_sheet),
+                self.sheet_name(self.args.people_sheet), [ self.sheet_name(x) for x in opt_in_sheets ])
+        else:
+            alt_email = sapo.load_alt_email_csv(self.csv_name(self.args.alt_email_sheet))
+            places = sapo.load_places_csv(self.csv_name(self.args.places_sheet))
+            people = sapo.load_people_csv(self.csv_name(self.args.people_sheet))
+            signers = [ sapo.load_signers_csv(self.csv_name(x)) for x in opt_in_sheets ]
+        return alt_email, places, people, dict(zip(opt_in_sheets, signers))
+
+    def load_signers(self, opt_in):
+        if(self.uploader is not None):
+            rows, = self.uploader.retrieve_sheets([ self.sheet_name(opt_in) ], row_starts=1)
+            return sapo.load_signers_rows(rows)
+        return sapo.load_signers_csv(self.csv_name(opt_in))
+
+    def refresh(self):
+        with self.refresh_lock:
+            start = time.perf_counter()
+            self.data = SAPOData(*self.load_tabs(list(self.opt_in_sheets)), previous=self.data)
+            self.nrefresh += 1
+            save_encoding_cache()
+            print("Info refreshed SAPO data in %.3f s"%(time.perf_counter() - start))
+
+    def refresh_loop(self):
+        while(not self.stop.wait(self.args.refresh_interval)):
+            try:
+                self.refresh()
+                self.last_error = None
+            except Exception as e:
+                # Keep serving the last data that was loaded
+                self.last_error = str(e)
+                print("WARNING refresh failed :",e)
+
+    def signers(self, data, opt_in):
+        if(opt_in not in data.signers):
+            with self.refresh_lock:
+                if(opt_in not in data.signers):
+                    data.signers[opt_in] = self.load_signers(opt_in)
+                    if(opt_in not in self.opt_in_sheets):
+                        self.opt_in_sheets.append(opt_in)
+        return data.signers[opt_in]
+
+    def author_list(self, opt_in, corresponding):
+        data = self.data
+        key = ('json', opt_in, tuple(corresponding))
+        if(key not in data.results):
+            authors = sapo.resolve_signers(self.signers(data, opt_in), data.alt_email,
+                data.people, data.main_emails, data.cta_emails)
+            data.results[key] = sapo.build_author_list(data.people, data.places, authors, corresponding)
+        return data.results[key]
+
+    def render(self, paper, format, query):
+        output = io.StringIO()
+        author_list_pipeline.render(paper, format, output, query.get('title', ''),
+            query.get('orcid', '') not in ('', '0'), query.get('suppress_summary', '') not in ('', '0'),
+            query.get('publication_reference', ''))
+        return output.getvalue()
+
+    def xwiki_author_list(self, body):
+        return author_list_pipeline.build_xwiki(json.loads(body))
+
+    def status(self):
+        data = self.data
+        return dict(
+            loaded          = time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(data.loaded)),
+            refreshes       = self.nrefresh,
+            last_error      = self.last_error,
+            people          = len(data.people),
+            places          = len(data.places),
+            opt_in_sheets   = sorted(data.signers),
+            cached_results  = len(data.results),
+            encoding_cache  = sapo.cache.stats())
+
+class RequestError(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+def latex_style(query):
+    style = query.get('render', 'sapo')
+    if(style not in author_list_pipeline.latex_styles):
+        raise RequestError(400, 'Unknown LaTeX style "%s"'%style)
+    return style
+
+class AuthorListRequestHandler(http.server.BaseHTTPRequestHandler):
+    def reply(self, code, body, content_type='text/plain; charset=utf-8'):
+        body = body.encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_request(self, method):
+        start = time.perf_counter()
+        service = self.server.service
+        url = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        corresponding = [ x for x in query.get('email_authors', '').split(',') if x ]
+        try:
+            if(method == 'GET' and url.path == '/status'):
+                self.reply(200, json.dumps(service.status(), indent=4), 'application/json')
+            elif(method == 'POST' and url.path == '/refresh'):
+                service.refresh()
+                self.reply(200, json.dumps(service.status(), indent=4), 'application/json')
+            elif(method == 'GET' and url.path in ('/authors.json', '/authors.tex')):
+                if(not query.get('opt_in')):
+                    raise RequestError(400, 'Parameter "opt_in" not given')
+                # In Google mode an unknown tab is reported by the API as an
+                # HttpError, the class of which is only known once it is imported
+                not_found = (OSError, RuntimeError)
+                if(uploader.googleapiclient is not None):
+                    not_found += (uploader.googleapiclient.errors.HttpError, )
+                try:
+                    paper = service.author_list(query['opt_in'], corresponding)
+                except not_found as e:
+                    raise RequestError(404, 'Could not load opt-in sheet "%s" : %s'%(query['opt_in'], e))
+                if(url.path == '/authors.json'):
+                    self.reply(200, service.render(paper, 'json', query), 'application/json')
+                else:
+                    self.reply(200, service.render(paper, latex_style(query), query),
+                        'application/x-latex; charset=utf-8')
+            elif(method == 'POST' and url.path in ('/xwiki/authors.json', '/xwiki/authors.tex', '/xwiki/authors.xml')):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                try:
+                    paper = service.xwiki_author_list(body)
+                except (ValueError, KeyError) as e:
+                    raise RequestError(400, 'Invalid XWiki export : %s'%e)
+                if(url.path == '/xwiki/authors.json'):
+                    self.reply(200, service.render(paper, 'json', query), 'application/json')
+                elif(url.path == '/xwiki/authors.tex'):
+                    self.reply(200, service.render(paper, latex_style(query), query),
+                        'application/x-latex; charset=utf-8')
+                else:
+                    self.reply(200, service.render(paper, 'xml', query), 'application/xml; charset=utf-8')
+            else:
+                raise RequestError(404, 'Unknown request : %s %s'%(method, url.path))
+        except RequestError as e:
+            self.reply(e.code, str(e) + '\n')
+        except Exception as e:
+            self.reply(500, 'Error : %s\n'%e)
+        if(not self.server.quiet):
+            print("Info %s %s : %.1f ms"%(method, self.path, (time.perf_counter() - start)*1000))
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def log_message(self, format, *args):
+        pass
+
+# ================ #
+# Main entry point #
+# ================ #
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--people_sheet', default='People', help='Name of SAPO "People" sheet in Google or as CSV file (default: "%(default)s")')
+    parser.add_argument('--places_sheet', default='Places', help='Name of SAPO "Places" sheet in Google or as CSV file (default: "%(default)s")')
+    parser.add_argument('--alt_email_sheet', default='Alternative email', help='Name of SAPO "Alternative email" sheet in Google or as CSV file (default: "%(default)s")')
+    parser.add_argument('--opt_in_sheet', default='Opt in', help='Name of author opt-in sheet loaded at start up (default: "%(default)s")')
+    parser.add_argument('--csv_base', default='SAPO Author List', help='Base name of CSV files (default: "%(default)s")')
+    parser.add_argument('--google_base', default=None, help='Base address of SAPO Authorship sheet. If not set, then read data from CSV files rather than Google')
+    parser.add_argument('--google_token', default='token.pickle', help='Google authentication token (default: "%(default)s")')
+    parser.add_argument('--snapshot_dir', default='~/.cache/sapo_authorlist/sheets', help='Directory in which to keep snapshots of the Google sheets, or empty to disable (default: "%(default)s")')
+    parser.add_argument('--encoding_cache', default=encoding_cache.default_filename, help='File in which to cache LaTeX, HTML and ASCII encodings between runs, or empty to disable (default: "%(default)s")')
+    parser.add_argument('--encoding_cache_size', type=int, default=100000, help='Maximum number of entries in the encoding cache (default: %(default)s)')
+    parser.add_argument('--refresh_interval', type=float, default=300, help='Time between reloads of the sheets in seconds (default: %(default)s)')
+    parser.add_argument('--host', default='127.0.0.1', help='Address on which to listen (default: "%(default)s")')
+    parser.add_argument('--port', type=int, default=8765, help='Port on which to listen (default: %(default)s)')
+    parser.add_argument('--quiet', action='store_true', help='Do not log each request')
+
+    args = parser.parse_args()
+
+    # Both builders encode through the same cache entries, which are saved
+    # after each refresh and at exit
+    sapo.cache.open(args.encoding_cache, args.encoding_cache_size)
+    xwiki.cache.entries = sapo.cache.entries
+    xwiki.cache.max_entries = sapo.cache.max_entries
+    xwiki.cache.lock = sapo.cache.lock
+
+    google_uploader = None
+    if(args.google_base):
+        google_uploader = uploader.GoogleDriveUploader(args.google_token, None, loud=True,
+            snapshot_directory=args.snapshot_dir)
+
+    service = AuthorListService(args, google_uploader)
+    service.refresh()
+
+    server = http.server.ThreadingHTTPServer((args.host, args.port), AuthorListRequestHandler)
+    server.service = service
+    server.quiet = args.quiet
+    server.daemon_threads = True
+
+    refresher = threading.Thread(target=service.refresh_loop, daemon=True)
+    refresher.start()
+
+    print("Info serving author lists on http://%s:%d"%(args.host, server.server_address[1]))
+    # Stop cleanly, saving the encoding cache, on SIGTERM as well as Ctrl-C
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.stop.set()
+        server.server_close()
+        save_encoding_cache()
@@ -0,0 +1,112 @@
+# Compact records for the people, places and signers read from the SAPO
+# sheets (or from an xwiki export), used in place of positional lists.
+#
+# Records only hold the fields that the builders use. Derived fields are
+# declared with the "memoized" decorator, which computes them the first time
+# they are accessed and stores them on the record. The builders subclass
+# these records to add the derived fields that depend on their own encoding
+# functions.
+
+import json
+import hashlib
+
+class memoized:
+    def __init__(self, function):
+        self.function = function
+        self.name = function.__name__
+        self.__doc__ = function.__doc__
+
+    def __get__(self, record, owner=None):
+        if record is None:
+            return self
+        memo = record._memo
+        if memo is None:
+            memo = record._memo = dict()
+        if self.name not in memo:
+            memo[self.name] = self.function(record)
+        return memo[self.name]
+
+class Record:
+    __slots__ = ('_memo',)
+    fields = ()
+
+    def __init__(self, *args, **kwargs):
+        self._memo = None
+        for field, value in zip(self.fields, args):
+            setattr(self, field, value)
+        for field in self.fields[len(args):]:
+            setattr(self, field, kwargs.get(field, ''))
+
+    def as_list(self):
+        return [ getattr(self, field) for field in self.fields ]
+
+    @memoized
+    def fingerprint(self):
+        return hashlib.sha1(json.dumps(self.as_list()).encode('utf-8')).hexdigest()
+
+    def __repr__(self):
+        return '%s(%s)'%(type(self).__name__,
+            ', '.join('%s=%r'%(field, getattr(self, field)) for field in self.fields))
+
+class Person(Record):
+    # "signature" is the name of the person as it appears in the sorted author
+    # list, in format "Lastname, F. I.", "affiliation_ids" is the tuple of
+    # place ids, which may contain empty strings, and "paper_name" is the name
+    # as it should appear on papers, in format "F. I. Lastname", if known.
+    fields = ('id', 'lastname', 'firstname', 'email', 'cta_email', 'signature',
+        'affiliation_ids', 'orcid', 'paper_name')
+    __slots__ = fields
+
+    @classmethod
+    def from_sapo_row(cls, row):
+        # Google omits empty cells from the end of rows, so pad them out
+        row = [ row[0] ] + [ x.strip() for x in row[1:] ] + [ '' ] * (16 - len(row))
+        return cls(row[0], row[1], row[2], row[3], row[4], row[8],
+            tuple(row[9:12]), row[15])
+
+    @classmethod
+    def from_xwiki(cls, author, signature):
+        return cls(author['user'], author['lastName'], author['firstName'], author['email'],
+            '', signature, tuple(author['affiliations']), author['orcid'], author['signature'])
+
+    def as_list(self):
+        return [ self.id, self.lastname, self.firstname, self.email, self.cta_email,
+            self.signature, list(self.affiliation_ids), self.orcid, self.paper_name ]
+
+    @memoized
+    def main_email_key(self):
+        return self.email.lower()
+
+    @memoized
+    def cta_email_key(self):
+        return self.cta_email.lower()
+
+    @memoized
+    def place_ids(self):
+        return tuple(place_id for place_id in self.affiliation_ids if place_id)
+
+class Place(Record):
+    # "key" is the unique text key of the place, derived from its short name
+    fields = ('id', 'key', 'short_name', 'country', 'address')
+    __slots__ = fields
+
+    @classmethod
+    def from_sapo_row(cls, row, key):
+        return cls(row[0], key, row[1], row[2], row[3])
+
+    @classmethod
+    def from_xwiki(cls, place_id, place, key):
+        return cls(place_id, key, place['shortName'], place['country'], place['address'])
+
+class Signer(Record):
+    fields = ('email', 'firstname', 'lastname', 'agreement')
+    __slots__ = fields
+
+    @classmethod
+    def from_sapo_row(cls, row):
+        row = list(row) + [ '' ] * (6 - len(row))
+        return cls(row[1], row[2], row[3], row[5])
+
+    @memoized
+    def email_key(self):
+        return self.email.lower().strip()
@@ -0,0 +1,99 @@
+# Summary statistics of an author list : the number of authors per country,
+# counted both fractionally (an author with N affiliations counts 1/N for the
+# country of each) and as the number of authors with at least one affiliation
+# in the country, the authors of each affiliation, and the histogram of the
+# number of affiliations per author.
+#
+# The builders can store these in the "statistics" section of authors.json, in
+# which case the renderers use them rather than recomputing them. They are
+# computed with numpy if it is installed, and with plain loops otherwise, with
+# identical results.
+
+numpy = None
+
+def import_numpy():
+    # numpy is only imported when statistics are first computed, as it is slow
+    # to load and most runs do not need it
+    global numpy
+    if(numpy is None):
+        try:
+            import numpy
+        except ImportError:
+            numpy = False
+    return numpy
+
+def compute(author_affil_nums, affiliations):
+    # "author_affil_nums" is the list of affiliation numbers of each author, in
+    # author order, and "affiliations" the list of affiliations
+    if(import_numpy()):
+        return compute_numpy(author_affil_nums, affiliations)
+    return compute_python(author_affil_nums, affiliations)
+
+def compute_python(author_affil_nums, affiliations):
+    country_count = dict()
+    country_authors = dict()
+    place_authors = [ [] for affiliation in affiliations ]
+    histogram = [ 0 ]
+    for iauthor, affil_nums in enumerate(author_affil_nums):
+        for id in affil_nums:
+            country = affiliations[id]['country']
+            country_count[country] = country_count.get(country, 0) + 1/len(affil_nums)
+            place_authors[id].append(iauthor)
+        for country in set(affiliations[id]['country'] for id in affil_nums):
+            country_authors[country] = country_authors.get(country, 0) + 1
+        while(len(histogram) <= len(affil_nums)):
+            histogram.append(0)
+        histogram[len(affil_nums)] += 1
+    return make_statistics(len(author_affil_nums), len(affiliations),
+        [ (country, country_count[country], country_authors[country]) for country in country_count ],
+        place_authors, histogram)
+
+def compute_numpy(author_affil_nums, affiliations):
+    num_affil = numpy.array([ len(x) for x in author_affil_nums ], dtype=int)
+    if(num_affil.sum() == 0):
+        return compute_python(author_affil_nums, affiliations)
+
+    # One entry per (author, affiliation) pair, in author order
+    pair_author = numpy.repeat(numpy.arange(len(author_affil_nums)), num_affil)
+    pair_affil = numpy.fromiter((id for x in author_affil_nums for id in x), dtype=int,
+        count=int(num_affil.sum()))
+    pair_weight = 1/num_affil[pair_author]
+
+    countries, affil_country = numpy.unique([ a['country'] for a in affiliations ], return_inverse=True)
+    pair_country = affil_country[pair_affil]
+
+    # bincount adds the weights in the order of the pairs, so the fractional
+    # counts are the same, bit for bit, as those summed in the loop
+    country_count = numpy.bincount(pair_country, weights=pair_weight, minlength=len(countries))
+    author_country = numpy.unique(pair_author*len(countries) + pair_country)
+    country_authors = numpy.bincount(author_country % len(countries), minlength=len(countries))
+
+    # Countries in the order in which they are first seen
+    seen, first = numpy.unique(pair_country, return_index=True)
+    order = seen[numpy.argsort(first)]
+
+    by_affil = numpy.argsort(pair_affil, kind='stable')
+    bounds = numpy.cumsum(numpy.bincount(pair_affil, minlength=len(affiliations)))[:-1]
+    place_authors = [ x.tolist() for x in numpy.split(pair_author[by_affil], bounds) ]
+
+    return make_statistics(len(author_affil_nums), len(affiliations),
+        [ (str(countries[i]), float(country_count[i]), int(country_authors[i])) for i in order ],
+        place_authors, numpy.bincount(num_affil).tolist())
+
+def make_statistics(num_authors, num_affiliations, countries, place_authors, histogram):
+    return dict(
+        num_authors             = num_authors,
+        num_affiliations        = num_affiliations,
+        countries               = [ dict(country = country, authors_fractional = fractional,
+                                        authors = authors) for country, fractional, authors in countries ],
+        place_authors           = place_authors,
+        authors_per_place       = [ len(x) for x in place_authors ],
+        affiliations_per_author = histogram,
+    )
+
+def from_paper(paper):
+    # The statistics stored in the author list "paper", or computed from it if
+    # it has none
+    if('statistics' in paper):
+        return paper['statistics']
+    return compute([ author['affil_nums'] for author in paper['authors'] ], paper['affiliations'])
@@ -0,0 +1,139 @@
+# Rule based validation of the People and Places tabs of the SAPO database.
+#
+# All people are checked in a single pass, with email addresses and place ids
+# looked up in dicts, followed by a pass over the places, so the cost grows
+# linearly with the size of the database. Each problem found is an "issue" with
+# the id of the rule that found it and its severity, which can be printed in
+# the usual "WARNING ..." form and written to a JSON or CSV report.
+
+import re
+import csv
+import json
+import unicodedata
+
+# Rule id : (severity, description)
+rules = {
+    'duplicate_email':          ('warning', 'Email address used by more than one person'),
+    'duplicate_cta_email':      ('warning', 'CTA email address used by more than one person'),
+    'missing_email':            ('warning', 'Person has no email address, so cannot be matched to signers'),
+    'malformed_signature':      ('error',   'Signature is not in the format "Lastname, F. I."'),
+    'signature_mismatch':       ('warning', 'Signature differs from the one formed from the first and last names'),
+    'no_affiliation':           ('warning', 'Person has no affiliation'),
+    'affiliation_gap':          ('warning', 'Affiliation columns are not filled in order'),
+    'unknown_affiliation':      ('error',   'Affiliation is not in the Places tab'),
+    'unused_place':             ('info',    'Place is not the affiliation of any person'),
+    'invisible_character':      ('warning', 'Field contains an invisible or control character'),
+}
+
+severities = [ 'error', 'warning', 'info' ]
+
+# Zero-width and bidirectional formatting characters, soft hyphens, byte order
+# marks and control characters, none of which belong in names or addresses
+invisible_characters = re.compile(r'[\x00-\x1f\x7f-\x9f\u00ad\u200b-\u200f\u202a-\u202e\u2060-\u2064\ufeff]')
+
+def issue(rule, kind, id, field, message):
+    return dict(rule = rule, severity = rules[rule][0], kind = kind, id = id,
+        field = field, message = message)
+
+def check_invisible_characters(record, kind, issues):
+    for field in record.fields:
+        value = getattr(record, field)
+        for x in (value if isinstance(value, tuple) else (value,)):
+            if(isinstance(x, str)):
+                match = invisible_characters.search(x)
+                if(match):
+                    c = match.group(0)
+                    issues.append(issue('invisible_character', kind, record.id, field,
+                        '%s contains character U%04X %s : %s'%(field, ord(c),
+                            unicodedata.name(c, 'control'), x)))
+
+def validate(people, places, format_author_name=None):
+    # Returns the list of issues, together with the maps from main and CTA
+    # email addresses to person id that are used to resolve signers. Where an
+    # address is duplicated the last person to use it is kept.
+    issues = []
+    main_emails = dict()
+    cta_emails = dict()
+    place_used = set()
+
+    for pid in people:
+        p = people[pid]
+        main_email = p.main_email_key
+        cta_email = p.cta_email_key
+
+        if(p.signature.count(',') != 1):
+            issues.append(issue('malformed_signature', 'person', pid, 'signature',
+                'signature name malformed : %s'%p.signature))
+        elif(format_author_name is not None):
+            signature = format_author_name(p.firstname,p.lastname)
+            if(p.signature != signature):
+                issues.append(issue('signature_mismatch', 'person', pid, 'signature',
+                    'signature name differs : %s != %s'%(p.signature,signature)))
+
+        if(main_email):
+            if(main_email in main_emails):
+                issues.append(issue('duplicate_email', 'person', pid, 'email',
+                    'duplicate email address : %s (ids : %s and %s)'%(main_email,pid,main_emails[main_email])))
+            main_emails[main_email] = pid
+        elif(not cta_email):
+            issues.append(issue('missing_email', 'person', pid, 'email',
+                'person has no email address : %s'%p.signature))
+
+        if(cta_email):
+            if(cta_email in cta_emails):
+                issues.append(issue('duplicate_cta_email', 'person', pid, 'cta_email',
+                    'duplicate CTA email address : %s (ids : %s and %s)'%(cta_email,pid,cta_emails[cta_email])))
+            cta_emails[cta_email] = pid
+
+        if(not p.place_ids):
+            issues.append(issue('no_affiliation', 'person', pid, 'affiliation_ids',
+                'author has no affiliation : %s'%p.email))
+        elif(p.affiliation_ids[:len(p.place_ids)] != p.place_ids):
+            issues.append(issue('affiliation_gap', 'person', pid, 'affiliation_ids',
+                'author affiliations not in order : %s (%s)'%(p.email,', '.join(p.affiliation_ids))))
+        for place_id in p.place_ids:
+            if(place_id in places):
+                place_used.add(place_id)
+            else:
+                issues.append(issue('unknown_affiliation', 'person', pid, 'affiliation_ids',
+                    'author affiliation not found : %s (place id %s)'%(p.email,place_id)))
+
+        check_invisible_characters(p, 'person', issues)
+
+    for place_id in places:
+        place = places[place_id]
+        if(place_id not in place_used):
+            issues.append(issue('unused_place', 'place', place_id, 'id',
+                'place has no authors : %s'%place.short_name))
+        check_invisible_characters(place, 'place', issues)
+
+    return issues, main_emails, cta_emails
+
+def count_issues(issues):
+    counts = { severity: 0 for severity in severities }
+    for i in issues:
+        counts[i['severity']] += 1
+    return counts
+
+def print_issues(issues, min_severity='warning'):
+    # Info issues are not printed by default, as there can be many of them
+    shown = severities[:severities.index(min_severity)+1]
+    for i in issues:
+        if(i['severity'] in shown):
+            print(i['severity'].upper(), i['message'])
+
+def write_report(issues, filename):
+    # JSON or CSV, depending on the extension of the file name
+    if(filename.lower().endswith('.csv')):
+        with open(filename,'w',newline='') as fp:
+            writer = csv.writer(fp)
+            writer.writerow([ 'rule', 'severity', 'kind', 'id', 'field', 'message' ])
+            for i in issues:
+                writer.writerow([ i['rule'], i['severity'], i['kind'], i['id'], i['field'], i['message'] ])
+    else:
+        report = dict(
+            rules  = { rule: dict(severity = rules[rule][0], description = rules[rule][1]) for rule in rules },
+            counts = count_issues(issues),
+            issues = issues)
+        with open(filename,'w') as fp:
+            json.dump(report,fp,indent=4)
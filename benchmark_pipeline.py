@@ -0,0 +1,166 @@
+# Benchmark the author list pipeline on synthetic collaborations of increasing
+# size. For each size the inputs are generated with
+# generate_synthetic_collaboration.py, then each builder and renderer is run
+# as a separate process, recording its wall-clock time and peak resident
+# memory. Results can be saved as a baseline and later runs compared to it.
+#
+# The start-up time of each entry point is also measured, by importing it in a
+# fresh interpreter, and it is checked that none of them imports matplotlib or
+# the Google API client unless it is actually used.
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+def script(name):
+    return os.path.join(script_dir, name)
+
+def run_step(command, cwd, log):
+    # os.wait4 gives the resource usage of this child alone, so the peak memory
+    # of each step is measured independently
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=cwd, stdout=log, stderr=subprocess.STDOUT)
+    pid, status, rusage = os.wait4(process.pid, 0)
+    wall = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if(process.returncode != 0):
+        raise RuntimeError('Step failed with status %d : %s'%(process.returncode,' '.join(command)))
+    maxrss_kb = rusage.ru_maxrss if sys.platform != 'darwin' else rusage.ru_maxrss//1024
+    return dict(wall = wall, cpu = rusage.ru_utime + rusage.ru_stime, maxrss_kb = maxrss_kb)
+
+def pipeline_steps(encoding_cache):
+    cache_args = [ '--encoding_cache', encoding_cache ]
+    steps = [
+        ('build_json', [ sys.executable, script('build_json_author_list.py'),
+            '--output', 'authors.json', '--snapshot_dir', '' ] + cache_args),
+        ('xwiki_json', [ sys.executable, script('xwiki_json_author_list.py'),
+            '--input', 'cta_authors.json', '--output', 'xwiki_authors.json' ] + cache_args),
+    ]
+    for style in [ 'sapo', 'mnras', 'aa', 'aa-astroph' ]:
+        steps.append(('latex_'+style, [ sys.executable, script('render_authors_latex.py'),
+            '--render', style, '--input', 'authors.json', '--output', 'authors_%s.tex'%style ]))
+    steps.append(('xml', [ sys.executable, script('render_authors_xml.py'),
+        '--input', 'xwiki_authors.json', '--output', 'authors.xml' ]))
+    return steps
+
+def run_benchmark(size, work_dir, repeat, encoding_cache):
+    size_dir = os.path.join(work_dir, 'n%d'%size)
+    if(not os.path.isdir(size_dir)):
+        os.makedirs(size_dir)
+    results = dict()
+    with open(os.path.join(size_dir, 'benchmark.log'),'w') as log:
+        run_step([ sys.executable, script('generate_synthetic_collaboration.py'),
+            '--num_people', str(size) ], size_dir, log)
+        for name, command in pipeline_steps(encoding_cache):
+            # Keep the fastest of the repeats, as it is least affected by noise
+            best = None
+            for irepeat in range(repeat):
+                result = run_step(command, size_dir, log)
+                if(best is None or result['wall'] < best['wall']):
+                    best = result
+            results[name] = best
+    return results
+
+entry_points = [ 'build_json_author_list', 'xwiki_json_author_list', 'render_authors_latex',
+    'render_authors_xml', 'render_authors_csv', 'render_authors_all', 'author_list_pipeline', 'author_list_service', 'pipeline_runner',
+    'generate_synthetic_collaboration' ]
+heavy_modules = [ 'matplotlib', 'googleapiclient', 'google.auth', 'httplib2' ]
+
+def import_command(module, report=''):
+    return [ sys.executable, '-c', 'import sys; sys.path.insert(0, %r); import %s%s'%(script_dir, module, report) ]
+
+def run_import_benchmark(work_dir, repeat):
+    # Time a bare interpreter as well, as a reference for the others
+    if(not os.path.isdir(work_dir)):
+        os.makedirs(work_dir)
+    results = dict()
+    heavy = dict()
+    with open(os.path.join(work_dir, 'import.log'),'w') as log:
+        for module in [ 'sys' ] + entry_points:
+            best = None
+            for irepeat in range(repeat):
+                result = run_step(import_command(module), work_dir, log)
+                if(best is None or result['wall'] < best['wall']):
+                    best = result
+            results['python' if module == 'sys' else module] = best
+            loaded = subprocess.run(import_command(module,
+                '; print(" ".join(m for m in %r if m in sys.modules))'%heavy_modules),
+                cwd=work_dir, capture_output=True, text=True).stdout.split()
+            if(loaded):
+                heavy[module] = loaded
+    return results, heavy
+
+def compare_to_baseline(all_results, baseline, tolerance):
+    regressions = []
+    for size in all_results:
+        for step in all_results[size]:
+            if(size not in baseline or step not in baseline[size]):
+                continue
+            for quantity in [ 'wall', 'maxrss_kb' ]:
+                new = all_results[size][step][quantity]
+                old = baseline[size][step][quantity]
+                if(old > 0 and new > old*(1+tolerance)):
+                    regressions.append((size, step, quantity, old, new))
+    return regressions
+
+def print_results(all_results, baseline):
+    print('%-8s %-32s %10s %10s %12s %10s'%('Size','Step','Wall [s]','CPU [s]','Peak [MB]','vs base'))
+    for size in all_results:
+        for step, r in all_results[size].items():
+            ratio = ''
+            if(baseline and size in baseline and step in baseline[size] and baseline[size][step]['wall'] > 0):
+                ratio = '%.2fx'%(r['wall']/baseline[size][step]['wall'])
+            print('%-8s %-32s %10.3f %10.3f %12.1f %10s'%(size, step, r['wall'], r['cpu'],
+                r['maxrss_kb']/1024, ratio))
+
+# ================ #
+# Main entry point #
+# ================ #
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--sizes', default='1500,5000,10000', help='Comma separated list of collaboration sizes (default: "%(default)s")')
+    parser.add_argument('--work_dir', default='benchmark_work', help='Directory in which to generate inputs and outputs (default: "%(default)s")')
+    parser.add_argument('--repeat', type=int, default=1, help='Number of times to run each step, keeping the fastest (default: %(default)s)')
+    parser.add_argument('--encoding_cache', default='', help='Encoding cache file passed to the builders, empty to benchmark cold encoding (default: "%(default)s")')
+    parser.add_argument('--baseline', default='benchmark_baseline.json', help='Baseline results file (default: "%(default)s")')
+    parser.add_argument('--save_baseline', action='store_true', help='Save the results as the new baseline')
+    parser.add_argument('--import_repeat', type=int, default=5, help='Number of times to import each entry point, keeping the fastest, or zero to skip the start-up benchmark (default: %(default)s)')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Fractional increase over baseline that is reported as a regression (default: %(default)s)')
+
+    args = parser.parse_args()
+
+    baseline = None
+    if(os.path.exists(args.baseline)):
+        with open(args.baseline,'r') as fp:
+            baseline = json.load(fp)
+
+    all_results = dict()
+    heavy = dict()
+    if(args.import_repeat > 0):
+        all_results['import'], heavy = run_import_benchmark(args.work_dir, args.import_repeat)
+    for size in [ int(x) for x in args.sizes.split(',') if x ]:
+        all_results[str(size)] = run_benchmark(size, args.work_dir, args.repeat, args.encoding_cache)
+
+    print_results(all_results, baseline)
+
+    for module in heavy:
+        print('WARNING %s imports : %s'%(module, ' '.join(heavy[module])))
+
+    if(args.save_baseline):
+        with open(args.baseline,'w') as fp:
+            json.dump(all_results,fp,indent=4)
+        print('Info saved baseline :',args.baseline)
+    elif(baseline):
+        regressions = compare_to_baseline(all_results, baseline, args.tolerance)
+        for size, step, quantity, old, new in regressions:
+            print('WARNING regression : size %s step %s %s %g -> %g'%(size, step, quantity, old, new))
+        if(regressions):
+            sys.exit(1)
+    if(heavy):
+        sys.exit(1)
@@ -2,15 +2,46 @@ import json
 import csv
 import unicodedata
 import re
+import os
+import io
+import sys
+import glob
+import contextlib
+import concurrent.futures
 import pylatexenc.latexencode
+import pylatexenc.version
 import argparse
 import uploader
+import encoding_cache
+import author_records
+import signer_resolver
+import author_validator
+import profiler
+import json_backend
+import author_statistics
+
+# Encodings are memoized in this cache, which the main block attaches to a file
+# on disk so that it persists between runs. Bump the versions below whenever the
+# corresponding encoding function changes.
+cache = encoding_cache.EncodingCache()
+asciify_version = '1/unicode-' + unicodedata.unidata_version
+htmlify_version = '1'
+latexify_version = '1/pylatexenc-' + pylatexenc.version.version_str
+
+def do_asciify(x):
+    return unicodedata.normalize('NFKD', x).encode('ascii', 'ignore').decode('utf-8').strip()
+
+def do_htmlify(x):
+    return x.encode('ascii', 'xmlcharrefreplace').decode('utf8')
 
 def asciify(x):
-    return unicodedata.normalize('NFKD', x).encode('ascii', 'ignore').decode('utf-8').strip()
+    return cache.encode('asciify', asciify_version, do_asciify, x)
 
 def htmlify(x):
-    return x.encode('ascii', 'xmlcharrefreplace').decode('utf8')
+    return cache.encode('htmlify', htmlify_version, do_htmlify, x)
+
+def latexify(x):
+    return cache.encode('latexify', latexify_version, pylatexenc.latexencode.unicode_to_latex, x)
 
 def nbspify(x):
     return re.sub('\s+', '&nbsp;', x)
@@ -23,14 +54,14 @@ def author_unicode(firstname,lastname):
 
 def author_latex(firstname,lastname):
     author = re.sub('\s+','\u00A0',firstname+' '+lastname)
-    return pylatexenc.latexencode.unicode_to_latex(author)
+    return latexify(author)
 
 def author_html(firstname,lastname):
     return nbspify(htmlify(firstname)+' '+htmlify(lastname))
 
 def author_latex(firstname,lastname):
     author = re.sub('\s+','\u00A0',firstname+' '+lastname)
-    return pylatexenc.latexencode.unicode_to_latex(author)
+    return latexify(author)
 
 def short_place_key(short_place_name):
     return re.sub(r'\W+', '', asciify(short_place_name))
@@ -52,6 +83,53 @@ def format_author_name(firstname, lastname):
             name += ' ' + fn
     return name
 
+class Person(author_records.Person):
+    __slots__ = ()
+
+    @author_records.memoized
+    def sortorder(self):
+        return asciify(self.signature).lower()
+
+    @author_records.memoized
+    def signature_names(self):
+        lastname, firstname = self.signature.split(',')
+        return firstname.strip(), lastname.strip()
+
+    @author_records.memoized
+    def author_asciified(self):
+        return author_asciified(*self.signature_names)
+
+    @author_records.memoized
+    def author_unicode(self):
+        return author_unicode(*self.signature_names)
+
+    @author_records.memoized
+    def author_html(self):
+        return author_html(*self.signature_names)
+
+    @author_records.memoized
+    def author_latex(self):
+        return author_latex(*self.signature_names)
+
+class Place(author_records.Place):
+    __slots__ = ()
+
+    @author_records.memoized
+    def short_name_latex(self):
+        return latexify(self.short_name)
+
+    @author_records.memoized
+    def address_asciified(self):
+        return asciify(self.address)
+
+    @author_records.memoized
+    def address_html(self):
+        return htmlify(self.address)
+
+    @author_records.memoized
+    def address_latex(self):
+        return latexify(self.address)
+
 def load_alt_email_rows(rows):
     alt_email = dict()
     for row in rows:
@@ -83,9 +161,7 @@ def load_places_rows(rows):
                     i += 1
                 key = key+str(i)
             short_place_keys.add(key)
-            places[row[0]] = [key, row[1], row[2], row[3]]
-        if '\u200B' in row[3]:
-            print("WARNING address contains character U200B :",row[3])
+            places[row[0]] = Place.from_sapo_row(row, key)
     print("Info read :",len(places),"places")
     return places
 
@@ -104,9 +180,7 @@ def load_people_rows(rows):
         if row[0]:
             if row[0] in people:
                 print('WARNING duplicate person id :',row[0])
-            row_data = row[1:12]
-            row_data.extend([row[15] if len(row)>=16 else ''])
-            people[row[0]] = [x.strip() for x in row_data]
+            people[row[0]] = Person.from_sapo_row(row)
     print("Info read :",len(people),"people")
     return people
 
@@ -123,7 +197,7 @@ def load_people_google(uploader, sheet_id_and_tab_name):
 def load_signers_rows(rows):
     signers = []
     for row in rows:
-        signers.append([row[1], row[2], row[3], row[5]])
+        signers.append(author_records.Signer.from_sapo_row(row))
     print("Info read :",len(signers),"signers")
     return signers
 
@@ -137,6 +211,373 @@ def load_signers_google(uploader, sheet_id_and_tab_name):
     rows = uploader.retrieve_sheet(sheet_id_and_tab_name, row_start=1)
     return load_signers_rows(rows)
 
+def load_all_google_batch(uploader, alt_email_sheet, places_sheet, people_sheet, opt_in_sheets):
+    # Retrieve the shared tabs and all the opt-in tabs in one request, so that
+    # they are consistent with each other and we pay for only one round trip
+    rows = uploader.retrieve_sheets([ alt_email_sheet, places_sheet, people_sheet ] + list(opt_in_sheets),
+        row_starts=[ 0, 0, 1 ] + [ 1 ]*len(opt_in_sheets))
+    return load_alt_email_rows(rows[0]), load_places_rows(rows[1]), \
+        load_people_rows(rows[2]), [ load_signers_rows(r) for r in rows[3:] ]
+
+def load_all_google(uploader, alt_email_sheet, places_sheet, people_sheet, opt_in_sheet):
+    alt_email, places, people, signers = load_all_google_batch(uploader,
+        alt_email_sheet, places_sheet, people_sheet, [ opt_in_sheet ])
+    return alt_email, places, people, signers[0]
+
+author_list_comment = \
+    "CTA author list in JSON format. Contains an array of authors in order that\n" \
+    + "they should be included in the author list (element \"authors\"), and an array\n" \
+    + "of places to which the authors are affiliated (element \"affiliations\").\n\n" \
+    + "Array \"authors\" :\n" \
+    + "- author_id         : Unique identifier of author in SAPO database.\n" \
+    + "- lastname          : Last name(s) of author in unicode.\n" \
+    + "- firstname         : First name(s) of author in unicode.\n" \
+    + "- email             : Email addresses for all authors.\n" \
+    + "- corresponding     : Corresponding author.\n" \
+    + "- orcid             : ORCID identifier if available (optional).\n" \
+    + "- author_sortorder  : Sort key used to order authors names (ascii in format\n" \
+    + "                      \"lastname, f. i.\").\n" \
+    + "- author_asciified  : Ascii version of author's name (in format \n"\
+    + "                      \"F. I. Lastname\", with unicode removed).\n" \
+    + "- author_unicode    : Unicode version of author's name in format\n" \
+    + "                      \"F. I. Lastname\".\n" \
+    + "- author_html       : HTML version of author's name in format\n" \
+    + "                      \"F.&nbsp;I.&nbsp;Lastname\".\n" \
+    + "- author_latex      : LaTeX version of author's name in format\n" \
+    + "                      \"F.~I.~Lastname\".\n" \
+    + "- affil_nums        : Array listing positions of authors' affiliations in the\n" \
+    + "                      affiliation array (starting at zero).\n" \
+    + "- affil_num_strs    : Array listing positions of authors' affiliations in the\n" \
+    + "                      affiliation array as string (staring at one).\n" \
+    + "- affil_place_keys  : Array of text keys for authors affiliations. Can be used\n" \
+    + "                      as a unique but readble key for LaTeX \\ref/\\label pairing\n" \
+    + "                      to identify affiliations.\n" \
+    + "- affil_place_ids   : Array of numeric identifiers for authors affiliations\n" \
+    + "                      corresponding to identifier in the SAPO database \n" \
+    + "                      (not recommended for general use).\n\n" \
+    + "Array \"affiliations\" :\n" \
+    + "- affil_num         : Position of affiliation in the affiliation array\n" \
+    + "                      (starting at zero).\n" \
+    + "- affil_num_str     : Position of affiliation in the affiliation array as\n" \
+    + "                      string (staring at one).\n" \
+    + "- place_key         : Text key for affiliation. Can be used as a unique but\n" \
+    + "                      readble key for LaTeX \\ref/\\label pairing to identify\n" \
+    + "                      affiliations.\n" \
+    + "- place_id          : Numeric identifier for affiliation corresponding to \n" \
+    + "                      identifier in the SAPO database (not recommended for\n" \
+    + "                      general use).\n" \
+    + "- short_name_unicode: Short name of place in unicode.\n" \
+    + "- short_name_latex  : Short name of place in LaTeX format.\n" \
+    + "- country           : Country.\n" \
+    + "- address_asciified : Ascii version of address (with unicode removed).\n" \
+    + "- address_unicode   : Unicode version of address.\n" \
+    + "- address_html      : HTML version of address with unicode escaped.\n" \
+    + "- address_latex     : LaTeX version of address with unicode escaped.\n"
+
+def check_people(people, places, issues=None):
+    # Print the problems found in the People and Places tabs, adding them to
+    # "issues" if given, see author_validator.py
+    found, main_emails, cta_emails = author_validator.validate(people, places, format_author_name)
+    author_validator.print_issues(found)
+    if(issues is not None):
+        issues.extend(found)
+    return main_emails, cta_emails
+
+def resolve_signers(signers, alt_email, people, main_emails, cta_emails, unknown_signers=None):
+    authors = set()
+    for s in signers:
+        email = s.email_key
+        if email in alt_email:
+            email = alt_email[email]
+        author_id = None
+        if email in main_emails:
+            author_id = main_emails[email]
+        elif email in cta_emails:
+            author_id = cta_emails[email]
+        if(author_id is None):
+            print('WARNING unknown person :',email)
+            if(unknown_signers is not None):
+                unknown_signers.append(s)
+        else:
+            n1 = asciify(s.lastname).lower().replace('-',' ')
+            n2 = asciify(people[author_id].lastname).lower().replace('-',' ')
+                
+            if(n1 not in n2 and n2 not in n1):
+                print('WARNING surname mismatch :',s.lastname,"!=",people[author_id].lastname)
+            if(author_id in authors):
+                print('Info person already signed :',email)
+            else:  
+                authors.add(author_id)
+    return authors
+
+def build_state(people, places):
+    # Fingerprints of the input rows and of the encoders, saved alongside the
+    # output so that the next incremental build can tell what has changed
+    return dict(
+        encoders = [ asciify_version, htmlify_version, latexify_version ],
+        people   = { pid: people[pid].fingerprint for pid in people },
+        places   = { pid: places[pid].fingerprint for pid in places }
+    )
+
+def affiliation_fields(place):
+    return dict(
+        place_id           = place.id,
+        place_key          = place.key,
+        short_name_unicode = place.short_name,
+        short_name_latex   = place.short_name_latex,
+        country            = place.country,
+        address_asciified  = place.address_asciified,
+        address_unicode    = place.address,
+        address_html       = place.address_html,
+        address_latex      = place.address_latex
+    )
+
+def author_fields(person, places):
+    return dict(
+        lastname         = person.lastname,
+        firstname        = person.firstname,
+        email            = person.email or '',
+        orcid            = person.orcid,
+        affil_place_ids  = person.place_ids,
+        affil_place_keys = [ places[place_id].key for place_id in person.place_ids ],
+        author_sortorder = person.sortorder,
+        author_asciified = person.author_asciified,
+        author_unicode   = person.author_unicode,
+        author_html      = person.author_html,
+        author_latex     = person.author_latex,
+    )
+
+def build_author_list(people, places, authors, corresponding=[],
+        previous=None, previous_state=None, state=None, stream=False, statistics=False):
+    # If the previous output and the fingerprints of the rows it was built from
+    # are given then the derived fields of all people and places whose rows are
+    # unchanged are taken from it, and only the numbering of the affiliations is
+    # redone. The result is identical to building from scratch.
+    previous_authors = dict()
+    previous_affiliations = dict()
+    if(previous is not None and previous_state is not None and state is not None
+            and previous_state.get('encoders') == state['encoders']):
+        unchanged_places = set(place_id for place_id in state['places']
+            if previous_state['places'].get(place_id) == state['places'][place_id])
+        for affiliation in previous['affiliations']:
+            if(affiliation['place_id'] in unchanged_places):
+                previous_affiliations[affiliation['place_id']] = affiliation
+        for author in previous['authors']:
+            author_id = author['author_id']
+            if(author_id in state['people']
+                    and previous_state['people'].get(author_id) == state['people'][author_id]
+                    and all(place_id in unchanged_places for place_id in author['affil_place_ids'])):
+                previous_authors[author_id] = author
+
+    fields = dict()
+    for author_id in authors:
+        if(author_id in previous_authors):
+            fields[author_id] = previous_authors[author_id]
+        else:
+            fields[author_id] = author_fields(people[author_id], places)
+
+    # Number the affiliations in author order first, and only then generate
+    # the author entries in their final order, so that they can be written out
+    # one at a time if the caller asks for a stream
+    author_list = dict()
+    affiliations_list = []
+    author_affiliation_key = dict()
+    for author_id in sorted(authors, key=lambda x: fields[x]['author_sortorder']):
+        f = fields[author_id]
+        ai = f['author_sortorder']
+        affil_nums = []
+        for place_id in f['affil_place_ids']:
+            if(place_id not in author_affiliation_key):
+                author_affiliation_key[place_id] = len(affiliations_list)
+                if(place_id in previous_affiliations):
+                    af = previous_affiliations[place_id]
+                else:
+                    af = affiliation_fields(places[place_id])
+                affiliations_list.append(dict(
+                    affil_num          = len(affiliations_list),
+                    affil_num_str      = str(len(affiliations_list)+1),
+                    place_id           = af['place_id'],
+                    place_key          = af['place_key'],
+                    short_name_unicode = af['short_name_unicode'],
+                    short_name_latex   = af['short_name_latex'],
+                    country            = af['country'],
+                    address_asciified  = af['address_asciified'],
+                    address_unicode    = af['address_unicode'],
+                    address_html       = af['address_html'],
+                    address_latex      = af['address_latex']
+                ))
+            affil_nums.append(author_affiliation_key[place_id])
+            ai += ", %06d"%author_affiliation_key[place_id]
+
+        author_list[ai] = (author_id, affil_nums)
+        if author_id in corresponding:
+            print("Info corresponding author :", f['author_unicode'],
+                "(" + people[author_id].email +")")
+
+    if(previous is not None):
+        print("Info incremental build : reused",len(previous_authors),"of",len(author_list),
+            "authors and",len(previous_affiliations),"of",len(affiliations_list),"affiliations")
+
+    def author_entry(author_id, affil_nums):
+        f = fields[author_id]
+        return dict(
+            author_id        = author_id,
+            lastname         = f['lastname'],
+            firstname        = f['firstname'],
+            email            = f['email'],
+            corresponding    = author_id in corresponding,
+            orcid            = f['orcid'],
+            affil_place_ids  = list(f['affil_place_ids']),
+            affil_place_keys = list(f['affil_place_keys']),
+            affil_nums       = affil_nums,
+            affil_num_strs   = [ str(x+1) for x in affil_nums ],
+            author_sortorder = f['author_sortorder'],
+            author_asciified = f['author_asciified'],
+            author_unicode   = f['author_unicode'],
+            author_html      = f['author_html'],
+            author_latex     = f['author_latex'],
+        )
+
+    author_entries = json_backend.LazyArray(author_entry, [author_list[x] for x in sorted(author_list)])
+    author_affiliation_list = dict(
+        _comment     = author_list_comment,
+        authors      = author_entries if stream else list(author_entries),
+        affiliations = affiliations_list,
+    )
+    if(statistics):
+        author_affiliation_list['statistics'] = author_statistics.compute(
+            [ author_list[x][1] for x in sorted(author_list) ], affiliations_list)
+    return author_affiliation_list
+
+def dump_author_list(author_affiliation_list, fp, backend='json', compact=False):
+    # Author entries that are still to be generated are written as they come
+    if(isinstance(author_affiliation_list['authors'], json_backend.LazyArray)):
+        json_backend.dump_streaming(author_affiliation_list, fp, backend, compact)
+    else:
+        json_backend.dump(author_affiliation_list, fp, backend, compact)
+
+def make_author_list(alt_email, places, people, signers, corresponding=[], statistics=False):
+    # Validate the loaded tabs and build the author list for "signers" in memory
+    main_emails, cta_emails = check_people(people, places)
+    authors = resolve_signers(signers, alt_email, people, main_emails, cta_emails)
+    return build_author_list(people, places, authors, corresponding, statistics=statistics)
+
+def batch_name(opt_in):
+    return re.sub(r'[^A-Za-z0-9_.-]+', '_', opt_in).strip('_')
+
+def batch_filename(filename, name):
+    # File name for one paper of a batch : "{name}" is replaced by the name of
+    # the paper or, if it is not present, the name is added before the extension
+    if('{name}' in filename):
+        return filename.replace('{name}', name)
+    base, ext = os.path.splitext(filename)
+    return base + '_' + name + ext
+
+def build_paper(signers, output, shared, args, prof, unknown_report=None, unknown_alt_email_csv=None):
+    # Resolve the signers of one paper against the shared People, Places and
+    # Alternative email tabs, and write its author list. Returns True if the
+    # incremental build had to be replaced by a full rebuild.
+    people = shared['people']
+    places = shared['places']
+    corresponding = shared['corresponding']
+
+    with prof.stage('resolve_signers'):
+        unknown_signers = []
+        authors = resolve_signers(signers, shared['alt_email'], people,
+            shared['main_emails'], shared['cta_emails'], unknown_signers)
+
+    if(unknown_report or unknown_alt_email_csv):
+        with prof.stage('unknown_signers'):
+            # The index of people is the same for all papers of a batch
+            if(shared.get('resolver') is None):
+                shared['resolver'] = signer_resolver.SignerResolver(people)
+            report = shared['resolver'].resolve(unknown_signers)
+            for entry in report:
+                if(entry['candidates']):
+                    best = entry['candidates'][0]
+                    print('Info unknown person :',entry['email'],'best candidate :',best['id'],
+                        best['firstname'],best['lastname'],'(score %.2f)'%best['score'])
+            if(unknown_report):
+                signer_resolver.write_report(report, unknown_report)
+            if(unknown_alt_email_csv):
+                nwritten = signer_resolver.write_alt_email_csv(report,
+                    unknown_alt_email_csv, min_score=args.unknown_min_score)
+                print('Info wrote',nwritten,'alternative emails to :',unknown_alt_email_csv)
+
+    previous = None
+    previous_state = None
+    state = None
+    state_file = output + '.state'
+    if(args.incremental or args.verify_incremental):
+        with prof.stage('load_previous'):
+            state = shared.get('state')
+            if(state is None):
+                state = shared['state'] = build_state(people, places)
+            if(os.path.exists(output) and os.path.exists(state_file)):
+                with open(output,'r') as fp:
+                    previous = json_backend.load(fp, args.json_backend)
+                with open(state_file,'r') as fp:
+                    previous_state = json.load(fp)
+            else:
+                print("Info incremental build : no previous output, building from scratch")
+
+    with prof.stage('build_author_list'):
+        # The incremental build can only be compared with a full rebuild if it
+        # is all in memory
+        author_affiliation_list = build_author_list(people, places, authors, corresponding,
+            previous, previous_state, state, stream=args.json_stream and not args.verify_incremental,
+            statistics=args.statistics)
+
+    verify_failed = False
+    if(args.verify_incremental):
+        with prof.stage('verify_incremental'):
+            full_author_affiliation_list = build_author_list(people, places, authors, corresponding,
+                statistics=args.statistics)
+            if(json.dumps(author_affiliation_list,indent=4) != json.dumps(full_author_affiliation_list,indent=4)):
+                print("ERROR incremental build differs from full rebuild, writing full rebuild")
+                author_affiliation_list = full_author_affiliation_list
+                verify_failed = True
+            else:
+                print("Info incremental build identical to full rebuild")
+
+    with prof.stage('write_json'):
+        with open(output,'w') as fp:
+            dump_author_list(author_affiliation_list,fp,args.json_backend,args.json_compact)
+
+        if(state is not None):
+            with open(state_file,'w') as fp:
+                json.dump(state,fp)
+
+    print('')
+    print("Number of authors:",len(author_affiliation_list['authors']))
+    print("Number of affiliations:",len(author_affiliation_list['affiliations']))
+
+    return verify_failed
+
+# Shared data and options of the worker processes of a parallel batch
+batch_shared = None
+batch_args = None
+
+def batch_worker_init(shared, args):
+    global batch_shared, batch_args
+    batch_shared = shared
+    batch_args = args
+    # Forked workers inherit the cache of the parent, others must load it
+    if(cache.filename is None):
+        cache.open(args.encoding_cache, args.encoding_cache_size)
+    cache.track_added()
+
+def batch_worker(job):
+    # Build one paper, returning its log rather than printing it so that the
+    # logs of the papers are not interleaved, and the new encodings so that
+    # the parent can save them in the cache
+    name, signers, output, unknown_report, unknown_alt_email_csv = job
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        verify_failed = build_paper(signers, output, batch_shared, batch_args,
+            profiler.Profiler(), unknown_report, unknown_alt_email_csv)
+    return name, log.getvalue(), verify_failed, cache.take_added()
+
 # ================ #
 # Main entry point #
 # ================ #
@@ -150,207 +591,131 @@ if __name__ == "__main__":
     parser.add_argument('--csv_base', default='SAPO Author List', help='Base name of CSV files (default: "%(default)s")')
     parser.add_argument('--google_base', default=None, help='Base address of SAPO Authorship sheet. If not set, then read data from CSV files rather than Google')
     parser.add_argument('--google_token', default='token.pickle', help='Google authentication token (default: "%(default)s")')
+    parser.add_argument('--snapshot_dir', default='~/.cache/sapo_authorlist/sheets', help='Directory in which to keep snapshots of the Google sheets, which are only downloaded again if the spreadsheet has changed, or empty to disable (default: "%(default)s")')
+    parser.add_argument('--offline', action='store_true', help='Build from the last snapshots of the Google sheets without contacting Google')
     parser.add_argument('--email_authors', default=None, help='IDs of people whose email addresses should be added. Should be given as a list of People IDs')
     parser.add_argument('--output', '-o', default='authors.json', help='Output JSON file name (default: "%(default)s")')
+    parser.add_argument('--encoding_cache', default=encoding_cache.default_filename, help='File in which to cache LaTeX, HTML and ASCII encodings between runs, or empty to disable (default: "%(default)s")')
+    parser.add_argument('--encoding_cache_size', type=int, default=100000, help='Maximum number of entries in the encoding cache (default: %(default)s)')
+    parser.add_argument('--unknown_report', default=None, help='Write candidate People IDs for each unknown signer to this JSON file')
+    parser.add_argument('--unknown_alt_email_csv', default=None, help='Write the best candidate for each unknown signer to this CSV file, in the format of the "Alternative email" sheet')
+    parser.add_argument('--unknown_min_score', type=float, default=0.6, help='Minimum score of candidates written to the alternative email CSV file (default: %(default)s)')
+    parser.add_argument('--validation_report', default=None, help='Write the problems found in the People and Places sheets to this JSON or CSV file, depending on its extension')
+    parser.add_argument('--incremental', action='store_true', help='Reuse the previous output file for all people and places whose rows have not changed. Fingerprints of the rows are kept in OUTPUT.state')
+    parser.add_argument('--verify_incremental', action='store_true', help='Also do a full rebuild and check that it is identical to the incremental one')
+    parser.add_argument('--batch_opt_in_sheets', default=None, help='Build one author list for each of these opt-in sheets, given as a comma separated list of names in Google or as CSV files, instead of for OPT_IN_SHEET. The shared sheets are loaded and validated only once')
+    parser.add_argument('--batch_opt_in_csv', default=None, help='Build one author list for each opt-in CSV file matching this pattern, e.g. "opt_in/*.csv", in addition to BATCH_OPT_IN_SHEETS')
+    parser.add_argument('--batch_workers', type=int, default=1, help='Number of processes over which to spread the papers of a batch (default: %(default)s)')
+    parser.add_argument('--statistics', action='store_true', help='Add the number of authors per country and per affiliation to the output')
+    json_backend.add_arguments(parser)
+    profiler.add_arguments(parser)
 
     args = parser.parse_args()
 
+    prof = profiler.from_args(args)
+
+    # In batch mode the output and report file names are those of each paper,
+    # see batch_filename
+    batch = bool(args.batch_opt_in_sheets or args.batch_opt_in_csv)
+    opt_in_sheets = [ args.opt_in_sheet ]
+    opt_in_files = []
+    if(batch):
+        opt_in_sheets = [ x.strip() for x in (args.batch_opt_in_sheets or '').split(',') if x.strip() ]
+        opt_in_files = sorted(glob.glob(args.batch_opt_in_csv)) if args.batch_opt_in_csv else []
+        if(not opt_in_sheets and not opt_in_files):
+            print("ERROR no opt-in sheets found for batch")
+            sys.exit(1)
+
+    with prof.stage('encoding_cache_load'):
+        cache.open(args.encoding_cache, args.encoding_cache_size)
+
+    google_uploader = None
     if(args.google_base):
         def sheet_name(sheet):
             return args.google_base + '#' + sheet
 
-        google_uploader = uploader.GoogleDriveUploader(args.google_token, None, loud=True)
-        alt_email = load_alt_email_google(google_uploader, sheet_name(args.alt_email_sheet))
-        places = load_places_google(google_uploader, sheet_name(args.places_sheet))
-        people = load_people_google(google_uploader, sheet_name(args.people_sheet))
-        signers = load_signers_google(google_uploader, sheet_name(args.opt_in_sheet))
+        with prof.stage('retrieve_sheets'):
+            google_uploader = uploader.GoogleDriveUploader(args.google_token, None, loud=True,
+                snapshot_directory=args.snapshot_dir, offline=args.offline)
+            alt_email, places, people, all_signers = load_all_google_batch(google_uploader,
+                sheet_name(args.alt_email_sheet), sheet_name(args.places_sheet),
+                sheet_name(args.people_sheet), [ sheet_name(x) for x in opt_in_sheets ])
     else:
         def csv_name(sheet):
             return args.csv_base + ' - ' + sheet + '.csv'
 
-        alt_email = load_alt_email_csv(csv_name(args.alt_email_sheet))
-        places = load_places_csv(csv_name(args.places_sheet))
-        people = load_people_csv(csv_name(args.people_sheet))
-        signers = load_signers_csv(csv_name(args.opt_in_sheet))
+        with prof.stage('read_csv'):
+            alt_email = load_alt_email_csv(csv_name(args.alt_email_sheet))
+            places = load_places_csv(csv_name(args.places_sheet))
+            people = load_people_csv(csv_name(args.people_sheet))
+            all_signers = [ load_signers_csv(csv_name(x)) for x in opt_in_sheets ]
+
+    names = [ batch_name(x) for x in opt_in_sheets ]
+    if(opt_in_files):
+        with prof.stage('read_opt_in_csv'):
+            for filename in opt_in_files:
+                name = os.path.splitext(os.path.basename(filename))[0]
+                if(name.startswith(args.csv_base + ' - ')):
+                    name = name[len(args.csv_base + ' - '):]
+                names.append(batch_name(name))
+                all_signers.append(load_signers_csv(filename))
+    if(len(set(names)) != len(names)):
+        print("ERROR opt-in sheets of batch do not have distinct names :",', '.join(names))
+        sys.exit(1)
 
     corresponding = [ ]
     if args.email_authors:
         corresponding=args.email_authors.split(',')
 
-    main_emails = dict()
-    cta_emails = dict()
+    with prof.stage('validate'):
+        issues = []
+        main_emails, cta_emails = check_people(people, places, issues)
+        if(args.validation_report):
+            author_validator.write_report(issues, args.validation_report)
 
-    for pid in people:
-        p = people[pid]
-        main_email = p[2].lower()
-        cta_email = p[3].lower()
+    shared = dict(alt_email = alt_email, places = places, people = people,
+        main_emails = main_emails, cta_emails = cta_emails, corresponding = corresponding)
 
-        if(p[7] != format_author_name(p[1],p[0])):
-            print('WARNING signature name differs :',p[7],"!=",format_author_name(p[1],p[0]))
-
-        if main_email:
-            if main_email in main_emails:
-                print('WARNING duplicate email address : %s (ids : %s and %s)'%(main_email,pid,main_emails[main_email]))
-            main_emails[main_email] = pid
-
-
-        if(cta_email):
-            if cta_email in cta_emails:
-                print('WARNING duplicate CTA email address : %s (ids : %s and %s)'%(cta_email,pid,cta_emails[cta_email]))
-            cta_emails[cta_email] = pid
-
-        if p[8].strip()=='':
-            print('WARNING author has no affiliation :',p[2])
-            if p[9] not in places:
-                print('WARNING author affiliation not found :',p[2])
-            if len(p)>9:
-                if p[9] and p[9] not in places:
-                    print('WARNING author 2nd affiliation not found :',p[2])
-
-            if len(p)>10:
-                if p[10] and p[10] not in places:
-                    print('WARNING author 3rd affiliation not found :',p[2])
-
-    authors = set()
-    for s in signers:
-        email = s[0].lower().strip()
-        if email in alt_email:
-            email = alt_email[email]
-        author_id = None
-        if email in main_emails:
-            author_id = main_emails[email]
-        elif email in cta_emails:
-            author_id = cta_emails[email]
-        if(author_id is None):
-            print('WARNING unknown person :',email)
+    verify_failed = False
+    if(not batch):
+        verify_failed = build_paper(all_signers[0], args.output, shared, args, prof,
+            args.unknown_report, args.unknown_alt_email_csv)
+    else:
+        def file_for(filename, name):
+            return batch_filename(filename, name) if filename else None
+        jobs = [ (name, signers, file_for(args.output, name), file_for(args.unknown_report, name),
+            file_for(args.unknown_alt_email_csv, name)) for name, signers in zip(names, all_signers) ]
+        if(args.batch_workers > 1 and len(jobs) > 1):
+            with prof.stage('batch'):
+                with concurrent.futures.ProcessPoolExecutor(min(args.batch_workers, len(jobs)),
+                        initializer=batch_worker_init, initargs=(shared, args)) as pool:
+                    for name, log, failed, added in pool.map(batch_worker, jobs):
+                        print('')
+                        print("Info paper :",name)
+                        sys.stdout.write(log)
+                        cache.merge(added)
+                        verify_failed = verify_failed or failed
         else:
-            n1 = asciify(s[2]).lower().replace('-',' ')
-            n2 = asciify(people[author_id][0]).lower().replace('-',' ')
-                
-            if(n1 not in n2 and n2 not in n1):
-                print('WARNING surname mismatch :',s[2],"!=",people[author_id][0])
-            if(author_id in authors):
-                print('Info person already signed :',email)
-            else:  
-                authors.add(author_id)
-
-    author_list = dict()
-    affiliations_list = []
-    author_affiliation_key = dict()
-    for author_id in sorted(authors, key=lambda x: asciify(people[x][7]).lower()):
-        ai = asciify(people[author_id][7]).lower()
-        place_ids = []
-        place_keys = []
-        affil_nums = []
-        affil_num_strs = []
-        for place_id in people[author_id][8:11]:
-            if(place_id):
-                if(place_id not in author_affiliation_key):
-                    author_affiliation_key[place_id] = len(affiliations_list)
-                    affiliations_list.append(dict(
-                        affil_num          = len(affiliations_list),
-                        affil_num_str      = str(len(affiliations_list)+1),
-                        place_id           = place_id,
-                        place_key          = places[place_id][0],
-                        short_name_unicode = places[place_id][1],
-                        short_name_latex   = pylatexenc.latexencode.unicode_to_latex(places[place_id][1]),
-                        country            = places[place_id][2],
-                        address_asciified  = asciify(places[place_id][3]),
-                        address_unicode    = places[place_id][3],
-                        address_html       = htmlify(places[place_id][3]),
-                        address_latex      = pylatexenc.latexencode.unicode_to_latex(places[place_id][3])
-                    ))
-                place_ids.append(place_id)
-                place_keys.append(places[place_id][0])
-                affil_nums.append(author_affiliation_key[place_id])
-                affil_num_strs.append(str(author_affiliation_key[place_id]+1))
-                ai += ", %06d"%author_affiliation_key[place_id]
-        
-        lastname, firstname = people[author_id][7].split(',')
-        lastname = lastname.strip()
-        firstname = firstname .strip()
-
-        author_list[ai] = dict(
-            author_id        = author_id,
-            lastname         = people[author_id][0],
-            firstname        = people[author_id][1],
-            email            = people[author_id][2] or '',
-            corresponding    = False,
-            orcid            = people[author_id][11] if len(people[author_id])>=12 else '',
-            affil_place_ids  = place_ids,
-            affil_place_keys = place_keys,
-            affil_nums       = affil_nums,
-            affil_num_strs   = affil_num_strs,
-            author_sortorder = asciify(people[author_id][7]).lower(),
-            author_asciified = author_asciified(firstname, lastname),
-            author_unicode   = author_unicode(firstname, lastname),
-            author_html      = author_html(firstname, lastname),
-            author_latex     = author_latex(firstname, lastname),
-        )
-        if author_id in corresponding:
-            print("Info corresponding author :", author_unicode(firstname, lastname),
-                "(" + people[author_id][2] +")")
-            author_list[ai]['corresponding'] = True
-
-    comment = \
-        "CTA author list in JSON format. Contains an array of authors in order that\n" \
-        + "they should be included in the author list (element \"authors\"), and an array\n" \
-        + "of places to which the authors are affiliated (element \"affiliations\").\n\n" \
-        + "Array \"authors\" :\n" \
-        + "- author_id         : Unique identifier of author in SAPO database.\n" \
-        + "- lastname          : Last name(s) of author in unicode.\n" \
-        + "- firstname         : First name(s) of author in unicode.\n" \
-        + "- email             : Email addresses for all authors.\n" \
-        + "- corresponding     : Corresponding author.\n" \
-        + "- orcid             : ORCID identifier if available (optional).\n" \
-        + "- author_sortorder  : Sort key used to order authors names (ascii in format\n" \
-        + "                      \"lastname, f. i.\").\n" \
-        + "- author_asciified  : Ascii version of author's name (in format \n"\
-        + "                      \"F. I. Lastname\", with unicode removed).\n" \
-        + "- author_unicode    : Unicode version of author's name in format\n" \
-        + "                      \"F. I. Lastname\".\n" \
-        + "- author_html       : HTML version of author's name in format\n" \
-        + "                      \"F.&nbsp;I.&nbsp;Lastname\".\n" \
-        + "- author_latex      : LaTeX version of author's name in format\n" \
-        + "                      \"F.~I.~Lastname\".\n" \
-        + "- affil_nums        : Array listing positions of authors' affiliations in the\n" \
-        + "                      affiliation array (starting at zero).\n" \
-        + "- affil_num_strs    : Array listing positions of authors' affiliations in the\n" \
-        + "                      affiliation array as string (staring at one).\n" \
-        + "- affil_place_keys  : Array of text keys for authors affiliations. Can be used\n" \
-        + "                      as a unique but readble key for LaTeX \\ref/\\label pairing\n" \
-        + "                      to identify affiliations.\n" \
-        + "- affil_place_ids   : Array of numeric identifiers for authors affiliations\n" \
-        + "                      corresponding to identifier in the SAPO database \n" \
-        + "                      (not recommended for general use).\n\n" \
-        + "Array \"affiliations\" :\n" \
-        + "- affil_num         : Position of affiliation in the affiliation array\n" \
-        + "                      (starting at zero).\n" \
-        + "- affil_num_str     : Position of affiliation in the affiliation array as\n" \
-        + "                      string (staring at one).\n" \
-        + "- place_key         : Text key for affiliation. Can be used as a unique but\n" \
-        + "                      readble key for LaTeX \\ref/\\label pairing to identify\n" \
-        + "                      affiliations.\n" \
-        + "- place_id          : Numeric identifier for affiliation corresponding to \n" \
-        + "                      identifier in the SAPO database (not recommended for\n" \
-        + "                      general use).\n" \
-        + "- short_name_unicode: Short name of place in unicode.\n" \
-        + "- short_name_latex  : Short name of place in LaTeX format.\n" \
-        + "- country           : Country.\n" \
-        + "- address_asciified : Ascii version of address (with unicode removed).\n" \
-        + "- address_unicode   : Unicode version of address.\n" \
-        + "- address_html      : HTML version of address with unicode escaped.\n" \
-        + "- address_latex     : LaTeX version of address with unicode escaped.\n"
-
-    author_affiliation_list = dict(
-        _comment     = comment,
-        authors      = [author_list[x] for x in sorted(author_list)],
-        affiliations = affiliations_list
-    )
-
-    with open(args.output,'w') as fp:
-        json.dump(author_affiliation_list,fp,indent=4)
-
-    print('')
-    print("Number of authors:",len(author_list))
-    print("Number of affiliations:",len(affiliations_list))
+            for name, signers, output, unknown_report, unknown_alt_email_csv in jobs:
+                print('')
+                print("Info paper :",name)
+                with prof.stage(name):
+                    failed = build_paper(signers, output, shared, args, prof,
+                        unknown_report, unknown_alt_email_csv)
+                verify_failed = verify_failed or failed
+        print('')
+        print("Info batch : built",len(jobs),"author lists :",', '.join(job[2] for job in jobs))
+
+    with prof.stage('encoding_cache_save'):
+        cache.save()
+
+    cache.print_stats()
+
+    prof.add_counters('encoding_cache.', cache.stats())
+    if(google_uploader is not None):
+        prof.add_counters('api_calls.', google_uploader.api_calls)
+        prof.add_counters('retries.', google_uploader.retry_stats)
+    prof.finish()
+
+    if(verify_failed):
+        sys.exit(1)
@@ -0,0 +1,463 @@
+# Checks that the faster paths of the pipeline give the same results as the
+# plain ones, and that invalid output is refused, on synthetic collaborations
+# made with generate_synthetic_collaboration.py, and that failed Google API
+# calls are retried as intended, against scripted failures. Each check prints
+# OK or the problems it found, and the script exits with status 1 if any check
+# fails, e.g.
+#
+#   python check_pipeline.py --checks xwiki_stream
+#
+# Checks that need an optional package that is not installed are reported as
+# skipped rather than passed.
+
+import os
+import sys
+import csv
+import json
+import time
+import email.utils
+import random
+import socket
+import argparse
+import contextlib
+import subprocess
+import xml.etree.ElementTree
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, script_dir)
+
+def script(name):
+    return os.path.join(script_dir, name)
+
+def run(command, cwd, log):
+    # The order of people with equal sort keys depends on set iteration, so
+    # hashing is fixed to make outputs of separate runs comparable
+    env = dict(os.environ, PYTHONHASHSEED='0')
+    process = subprocess.run(command, cwd=cwd, stdout=log, stderr=subprocess.STDOUT, env=env)
+    if(process.returncode != 0):
+        raise RuntimeError('Command failed with status %d : %s'%(process.returncode,' '.join(command)))
+
+def same_file(a, b):
+    with open(a,'rb') as fa, open(b,'rb') as fb:
+        return fa.read() == fb.read()
+
+def generate(work_dir, log, num_people):
+    run([ sys.executable, script('generate_synthetic_collaboration.py'),
+        '--num_people', str(num_people) ], work_dir, log)
+
+class Skipped(Exception):
+    pass
+
+def check_xwiki_stream(work_dir, log, num_people):
+    # The export read with ijson, author by author, must give the same author
+    # list as the export read whole with json.load. A second export has its
+    # keys in another order, extra fields at all levels and strings that need
+    # escaping, to exercise the parser of the streaming loader.
+    try:
+        import ijson
+    except ImportError:
+        raise Skipped('ijson is not installed')
+    generate(work_dir, log, num_people)
+    with open(os.path.join(work_dir, 'cta_authors.json'),'r') as fp:
+        export = json.load(fp)
+    export['authors'][0]['signature'] = 'Ä. "Q" \\ Öé’'
+    export['authors'][0]['extra'] = dict(authors = [ dict(a = 1.5) ], addresses = dict(b = 2))
+    export['authors'][1]['firstName'] = 'Ünïcödé'
+    export['paper_title'] = 'Title "with" <xml> & é'
+    reordered = dict(extra = dict(authors = [ 1, 2 ], paper_title = 'x'))
+    for key in reversed(list(export)):
+        reordered[key] = export[key]
+    with open(os.path.join(work_dir, 'cta_authors_reordered.json'),'w') as fp:
+        json.dump(reordered, fp, ensure_ascii=False)
+
+    problems = []
+    for input in [ 'cta_authors.json', 'cta_authors_reordered.json' ]:
+        command = [ sys.executable, script('xwiki_json_author_list.py'), '--input', input, '--encoding_cache', '' ]
+        run(command + [ '--output', 'plain.json' ], work_dir, log)
+        run(command + [ '--output', 'stream.json', '--stream_input' ], work_dir, log)
+        if(not same_file(os.path.join(work_dir, 'plain.json'), os.path.join(work_dir, 'stream.json'))):
+            problems.append('author lists differ with --stream_input for '+input)
+    return problems
+
+def edit_csv(filename, edit):
+    # Apply "edit" to the list of rows of a CSV file
+    with open(filename,'r',newline='') as fp:
+        rows = list(csv.reader(fp))
+    edit(rows)
+    with open(filename,'w',newline='') as fp:
+        csv.writer(fp).writerows(rows)
+
+def edit_people(rows, round):
+    # Rows of people, after the header, change name, signature, affiliations
+    # and ORCID
+    header = rows[0]
+    col = { name: header.index(name) for name in header }
+    people = rows[1:]
+    people[round][col['First name']] = 'Édith'
+    people[round][col['Signature']] = 'Piaf, É.'
+    people[round+10][col['Affiliation 1']], people[round+10][col['Affiliation 2']] = \
+        people[round+11][col['Affiliation 1']], people[round+10][col['Affiliation 1']]
+    people[round+20][col['ORCID']] = ''
+    people[round+30][col['Status']] = 'Inactive'
+
+def edit_places(rows, round):
+    # Places have no header : id, short name, country, address
+    rows[round][3] = 'Nouvelle adresse %d, Genève, Switzerland'%round
+    rows[round][2] = 'Switzerland'
+    rows[round+5][1] = 'Renamed %d'%round
+
+def check_incremental(work_dir, log, num_people):
+    # An incremental rebuild after changes to people and places must be
+    # identical, byte for byte, to a full rebuild from the same sheets
+    generate(work_dir, log, num_people)
+    command = [ sys.executable, script('build_json_author_list.py'), '--snapshot_dir', '',
+        '--encoding_cache', '', '--email_authors', '2' ]
+    run(command + [ '--output', 'incremental.json', '--incremental' ], work_dir, log)
+    problems = []
+    for round in range(3):
+        edit_csv(os.path.join(work_dir, 'SAPO Author List - People.csv'), lambda rows: edit_people(rows, round))
+        edit_csv(os.path.join(work_dir, 'SAPO Author List - Places.csv'), lambda rows: edit_places(rows, round))
+        run(command + [ '--output', 'incremental.json', '--incremental' ], work_dir, log)
+        run(command + [ '--output', 'full.json' ], work_dir, log)
+        if(not same_file(os.path.join(work_dir, 'incremental.json'), os.path.join(work_dir, 'full.json'))):
+            problems.append('incremental build differs from full rebuild after edit %d'%(round+1))
+    return problems
+
+def render_xml_fails(work_dir, log, options):
+    # Render authors.xml with render_authors_xml.py and the given options,
+    # returning True if it fails
+    try:
+        run([ sys.executable, script('render_authors_xml.py'), '--input', 'authors.json',
+            '--output', 'authors.xml' ] + options, work_dir, log)
+    except RuntimeError:
+        return True
+    return False
+
+def check_xml(work_dir, log, num_people):
+    # The XML author list must be well formed and valid, documents that break
+    # the DTD must be rejected unless --no_validate is given, and DTDs that
+    # the writer cannot check must be refused rather than ignored
+    import xml_writer
+    generate(work_dir, log, num_people)
+    run([ sys.executable, script('xwiki_json_author_list.py'), '--input', 'cta_authors.json',
+        '--output', 'authors.json', '--encoding_cache', '' ], work_dir, log)
+    xml_file = os.path.join(work_dir, 'authors.xml')
+    problems = []
+
+    if(render_xml_fails(work_dir, log, [])):
+        problems.append('valid author list rejected')
+    else:
+        root = xml.etree.ElementTree.parse(xml_file).getroot()
+        if(len(root.findall('{http://inspirehep.net/info/HepNames/tools/authors_xml/}authors/'
+                '{http://xmlns.com/foaf/0.1/}Person')) == 0):
+            problems.append('no authors in XML author list')
+
+    # A DTD in which the family name comes before the given name, so that
+    # the elements of each person are in the wrong order
+    with open(script('author.dtd'),'r') as fp:
+        dtd = fp.read()
+    with open(os.path.join(work_dir, 'swapped.dtd'),'w') as fp:
+        fp.write(dtd.replace('foaf:givenName?, foaf:familyName,', 'foaf:familyName, foaf:givenName?,'))
+    os.remove(xml_file)
+    if(not render_xml_fails(work_dir, log, [ '--dtd', 'swapped.dtd' ])):
+        problems.append('elements in the wrong order not rejected')
+    elif(os.path.exists(xml_file)):
+        problems.append('output left behind by rejected author list')
+    if(render_xml_fails(work_dir, log, [ '--dtd', 'swapped.dtd', '--no_validate' ])):
+        problems.append('--no_validate did not bypass the DTD')
+
+    # Choices are not supported by the writer
+    with open(os.path.join(work_dir, 'choice.dtd'),'w') as fp:
+        fp.write(dtd.replace('( foaf:Organization+ )', '( foaf:Organization | cal:group )+'))
+    if(not render_xml_fails(work_dir, log, [ '--dtd', 'choice.dtd' ])):
+        problems.append('unsupported content model in DTD not refused')
+
+    # Elements out of order, written directly
+    writer = xml_writer.XMLWriter(open(os.devnull,'w'), xml_writer.load_dtd(script('author.dtd')))
+    writer.start('collaborationauthorlist')
+    try:
+        writer.element('cal:publicationReference', 'x')
+        writer.element('cal:creationDate', 'x')
+        problems.append('cal:creationDate after cal:publicationReference not rejected')
+    except RuntimeError:
+        pass
+
+    # Characters that must be escaped, and control characters that cannot be
+    # in XML at all, in text and attributes
+    text = 'a & b < c > d " e \x01\x1f\tf'
+    with open(xml_file,'w') as fp:
+        writer = xml_writer.XMLWriter(fp, xml_writer.load_dtd(script('author.dtd')))
+        writer.start('collaborationauthorlist', {
+            'xmlns:foaf': 'http://xmlns.com/foaf/0.1/',
+            'xmlns:cal':  'http://inspirehep.net/info/HepNames/tools/authors_xml/' })
+        writer.element('cal:creationDate', text)
+        writer.element('cal:publicationReference', xml_writer.escape_text(text), escaped=True)
+        writer.start('cal:collaborations')
+        writer.start('cal:collaboration', { 'id': 'c1' })
+        writer.element('foaf:name', 'x')
+        writer.element('cal:group', 'x', { 'with': 'c1' })
+        writer.end()
+        writer.end()
+        fp.write('</collaborationauthorlist>\n')
+    try:
+        root = xml.etree.ElementTree.parse(xml_file).getroot()
+        expected = 'a & b < c > d " e \tf'
+        values = [ e.text for e in root[:2] ] + [ root[2][0][1].get('with') ]
+        if(values != [ expected, expected, 'c1' ]):
+            problems.append('text not escaped correctly : %s'%values)
+    except xml.etree.ElementTree.ParseError as e:
+        problems.append('XML with escaped text is not well formed : %s'%e)
+    return problems
+
+class FakeClock:
+    # Stands in for the time module in uploader, so that the delays between
+    # attempts are recorded rather than waited for
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, delay):
+        self.sleeps.append(delay)
+        self.now += delay
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+def http_error(status, content=b'', **headers):
+    import uploader
+    resp = uploader.httplib2.Response(dict(status=str(status), **headers))
+    return uploader.googleapiclient.errors.HttpError(resp, content)
+
+def scripted(clock, errors, policy=None):
+    # Function that raises each of errors in turn and then returns the number
+    # of calls made, each call taking one second. If policy is given each
+    # call reports progress before failing, as an upload does after a chunk.
+    calls = []
+    def fn():
+        calls.append(clock.now)
+        clock.now += 1
+        if(policy is not None):
+            policy.progressed()
+        if(len(calls) <= len(errors)):
+            raise errors[len(calls)-1]
+        return len(calls)
+    return fn
+
+def jitter(rng, base_delay, max_delay, delay, n):
+    # The delays that RetryPolicy should draw from rng after n failures
+    delays = []
+    for i in range(n):
+        delay = min(max_delay, rng.uniform(base_delay, max(delay, base_delay)*3))
+        delays.append(delay)
+    return delays
+
+class FakeRequest:
+    def __init__(self, name, outcomes):
+        self.methodId = 'drive.files.get'
+        self.name = name
+        self.outcomes = outcomes
+
+class FakeBatch:
+    # Batch that completes each request with the next of its outcomes, an
+    # exception or a response, taking one second, or that fails as a whole
+    # with the next of service.batch_errors
+    def __init__(self, service, callback):
+        self.service = service
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id):
+        self.requests.append((request, request_id))
+
+    def execute(self, http=None):
+        self.service.clock.now += 1
+        self.service.batch_sizes.append(len(self.requests))
+        if(self.service.batch_errors):
+            raise self.service.batch_errors.pop(0)
+        for request, request_id in self.requests:
+            outcome = request.outcomes.pop(0) if request.outcomes else request.name
+            if(isinstance(outcome, Exception)):
+                self.callback(request_id, None, outcome)
+            else:
+                self.callback(request_id, outcome, None)
+
+class FakeService:
+    def __init__(self, clock, batch_errors=[]):
+        self.clock = clock
+        self.batch_errors = list(batch_errors)
+        self.batch_sizes = []
+
+    def new_batch_http_request(self, callback):
+        return FakeBatch(self, callback)
+
+def check_retry(work_dir, log, num_people):
+    # RetryPolicy and GoogleDriveUploader.execute_batch against scripted
+    # failures, with a fake clock and a seeded random generator so that the
+    # delays are known exactly
+    import uploader
+    try:
+        uploader.import_google()
+    except ImportError:
+        raise Skipped('the Google API client is not installed')
+    problems = []
+    def expect(what, value, expected):
+        if(value != expected):
+            problems.append('%s : %s, expected %s'%(what, value, expected))
+
+    rate_limit = b'{"error": {"errors": [{"reason": "rateLimitExceeded"}]}}'
+    clock = FakeClock()
+    uploader.time = clock
+    try:
+        with contextlib.redirect_stderr(log):
+            # Jitter : each delay between base_delay and three times the last,
+            # capped at max_delay, for each kind of retryable failure
+            clock.__init__()
+            policy = uploader.RetryPolicy(base_delay=1.0, max_delay=10.0, budget=1000.0)
+            policy.random = random.Random(1)
+            errors = [ http_error(503), http_error(500), http_error(429), http_error(408),
+                http_error(403, rate_limit), socket.timeout(), ConnectionError(), http_error(502) ]
+            expect('jitter result', policy.call('jitter', scripted(clock, errors), max_try=10), 9)
+            expect('jitter delays', clock.sleeps, jitter(random.Random(1), 1.0, 10.0, 1.0, 8))
+            previous = 1.0
+            for delay in clock.sleeps:
+                if(delay < 1.0 or delay > min(10.0, previous*3)):
+                    problems.append('jitter delay %.3f out of range after %.3f'%(delay, previous))
+                previous = delay
+            if(10.0 not in clock.sleeps):
+                problems.append('jitter delays not capped : %s'%clock.sleeps)
+            expect('jitter counters', [ policy.counters[x] for x in ('calls','attempts','retries','failures','status.503') ],
+                [ 1, 9, 8, 8, 1 ])
+            expect('jitter sleep seconds', policy.counters['sleep_seconds'], sum(clock.sleeps))
+
+            # Retry-After, in seconds and as a date, replaces the jitter
+            clock.__init__()
+            policy = uploader.RetryPolicy()
+            when = email.utils.formatdate(time.time() + 30, usegmt=True)
+            errors = [ http_error(429, **{'Retry-After': '7'}), http_error(503, **{'Retry-After': when}),
+                http_error(503, **{'Retry-After': 'soon'}) ]
+            policy.call('retry after', scripted(clock, errors), max_try=4)
+            if(len(clock.sleeps) != 3 or clock.sleeps[0] != 7.0 or not 28.0 <= clock.sleeps[1] <= 30.0
+                    or not 1.0 <= clock.sleeps[2] <= 90.0):
+                problems.append('Retry-After not honoured : %s'%clock.sleeps)
+
+            # Errors that cannot succeed later are raised at once
+            for error in [ http_error(404), http_error(400), http_error(403, b'forbidden'), ValueError() ]:
+                clock.__init__()
+                policy = uploader.RetryPolicy()
+                try:
+                    policy.call('not retryable', scripted(clock, [ error ]))
+                    problems.append('%s not raised'%repr(error))
+                except Exception as e:
+                    if(e is not error or clock.sleeps or policy.counters['not_retryable'] != 1):
+                        problems.append('%s retried'%repr(error))
+
+            # Giving up after max_try attempts
+            clock.__init__()
+            policy = uploader.RetryPolicy()
+            try:
+                policy.call('max try', scripted(clock, [ http_error(503) ]*5), max_try=3)
+                problems.append('call succeeded after max_try attempts')
+            except Exception:
+                pass
+            expect('max_try attempts', [ len(clock.sleeps), policy.counters['attempts'], policy.counters['gave_up'] ], [ 2, 3, 1 ])
+
+            # Budget : with 20s between attempts that take 1s, the third
+            # attempt ends at 43s and a fourth would start after the 60s budget
+            clock.__init__()
+            policy = uploader.RetryPolicy(budget=60.0)
+            errors = [ http_error(503, **{'Retry-After': '20'}) ]*10
+            try:
+                policy.call('budget', scripted(clock, errors), max_try=10)
+                problems.append('call succeeded after budget')
+            except Exception:
+                pass
+            expect('budget attempts', [ len(clock.sleeps), policy.counters['attempts'], policy.counters['budget_exhausted'] ], [ 2, 3, 1 ])
+
+            # ... but progress restarts the budget
+            clock.__init__()
+            policy = uploader.RetryPolicy(budget=60.0)
+            try:
+                expect('progress result', policy.call('progress', scripted(clock, errors[:5], policy), max_try=10), 6)
+            except Exception as e:
+                problems.append('call failed despite progress : %s'%repr(e))
+
+            # Batches : a succeeds, b and c fail once, c with Retry-After, d
+            # cannot be retried and e fails until max_try, in chunks of two
+            clock.__init__()
+            drive = uploader.GoogleDriveUploader(os.path.join(work_dir, 'token.json'), 'root',
+                offline=True, snapshot_directory=work_dir)
+            drive.max_batch_size = 2
+            drive.retry.random = random.Random(2)
+            drive.drive_service = FakeService(clock)
+            requests = [ FakeRequest('a', []), FakeRequest('b', [ http_error(503) ]),
+                FakeRequest('c', [ http_error(429, **{'Retry-After': '12'}) ]),
+                FakeRequest('d', [ http_error(404) ]), FakeRequest('e', [ http_error(500) ]*5) ]
+            responses = drive.execute_batch(requests, max_try=3)
+            expect('batch responses', [ r if r is not None else drive.retry.status(e) for r, e in responses ],
+                [ 'a', 'b', 'c', 404, 500 ])
+            rng = random.Random(2)
+            b, e = jitter(rng, 1.0, 100.0, 1.0, 2)
+            expect('batch delays', clock.sleeps, [ max(b, 12.0, e) ] + jitter(rng, 1.0, 100.0, max(b, 12.0, e), 1))
+            expect('batch sizes', drive.drive_service.batch_sizes, [ 2, 2, 1, 2, 1, 1 ])
+            expect('batch counters', [ drive.retry.counters[x] for x in ('attempts','retries','not_retryable','gave_up') ],
+                [ 6, 4, 1, 1 ])
+
+            # ... a batch that fails as a whole is sent again, and the budget
+            # also applies to batches
+            clock.__init__()
+            drive.retry = uploader.RetryPolicy(budget=10.0)
+            drive.drive_service = FakeService(clock, [ ConnectionError(), http_error(503, **{'Retry-After': '12'}) ])
+            responses = drive.execute_batch([ FakeRequest('a', []), FakeRequest('b', []) ])
+            expect('failed batch responses', [ r for r, e in responses ], [ None, None ])
+            expect('failed batch counters', [ len(clock.sleeps), drive.retry.counters['budget_exhausted'] ], [ 1, 2 ])
+    finally:
+        uploader.time = time
+    return problems
+
+checks = dict(
+    xwiki_stream = check_xwiki_stream,
+    incremental  = check_incremental,
+    xml          = check_xml,
+    retry        = check_retry,
+)
+
+# ================ #
+# Main entry point #
+# ================ #
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--checks', default=','.join(checks), help='Comma separated list of checks to run (default: "%(default)s")')
+    parser.add_argument('--work_dir', default='check_work', help='Directory in which to generate inputs and outputs (default: "%(default)s")')
+    parser.add_argument('--num_people', type=int, default=300, help='Number of people in the synthetic collaborations (default: %(default)s)')
+
+    args = parser.parse_args()
+
+    failed = False
+    for name in [ x.strip() for x in args.checks.split(',') if x.strip() ]:
+        if(name not in checks):
+            print("ERROR unknown check :",name)
+            sys.exit(1)
+        check_dir = os.path.join(args.work_dir, name)
+        if(not os.path.isdir(check_dir)):
+            os.makedirs(check_dir)
+        with open(os.path.join(check_dir, 'check.log'),'w') as log:
+            try:
+                problems = checks[name](check_dir, log, args.num_people)
+            except Skipped as e:
+                print("WARNING check %s : skipped, %s"%(name, e))
+                continue
+            except RuntimeError as e:
+                problems = [ str(e) ]
+        if(problems):
+            failed = True
+            for problem in problems:
+                print("ERROR check %s : %s"%(name, problem))
+        else:
+            print("Info check %s : OK"%name)
+
+    if(failed):
+        sys.exit(1)
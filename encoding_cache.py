@@ -0,0 +1,146 @@
+# Persistent cache of the LaTeX, HTML/XML and ASCII encodings of names and
+# addresses, shared between build_json_author_list.py and
+# xwiki_json_author_list.py so that strings that have not changed since the
+# last run do not have to be re-encoded.
+#
+# Entries are keyed by encoder name, encoder version and input string, so
+# upgrading pylatexenc (or changing one of the encoding functions and bumping
+# its version) invalidates only the affected entries. The cache is bounded in
+# size, the least recently used entries being evicted first.
+
+import os
+import json
+import time
+import threading
+import collections
+
+default_filename = '~/.cache/sapo_authorlist/encoding_cache.json'
+file_format_version = 1
+
+class EncodingCache:
+    def __init__(self, filename=None, max_entries=100000, loud=False):
+        self.filename = os.path.expanduser(filename) if filename else None
+        self.max_entries = max_entries
+        self.loud = loud
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.encode_time = 0.0
+        self.modified = False
+        # Keys added since the last take_added, only kept once track_added
+        # has been called, as only batch workers need them
+        self.added = None
+        # Requests of author_list_service.py encode from several threads
+        self.lock = threading.RLock()
+        if(self.filename):
+            self.load()
+
+    def open(self, filename, max_entries=None):
+        self.filename = os.path.expanduser(filename) if filename else None
+        if(max_entries is not None):
+            self.max_entries = max_entries
+        if(self.filename):
+            self.load()
+
+    def load(self):
+        if(not os.path.exists(self.filename)):
+            return
+        try:
+            with open(self.filename,'r') as fp:
+                data = json.load(fp)
+        except (OSError, ValueError):
+            print("WARNING could not read encoding cache :",self.filename)
+            return
+        if(data.get('version') != file_format_version):
+            return
+        # Entries are stored from least to most recently used
+        for encoder, version, x, y in data.get('entries', []):
+            self.entries[(encoder, version, x)] = y
+        self.evict()
+
+    def save(self):
+        if(not self.filename or not self.modified):
+            return
+        dirname = os.path.dirname(self.filename)
+        if(dirname and not os.path.isdir(dirname)):
+            os.makedirs(dirname)
+        with self.lock:
+            data = dict(
+                version = file_format_version,
+                entries = [ [k[0], k[1], k[2], y] for k, y in self.entries.items() ]
+            )
+            self.modified = False
+        # Write to a temporary file and move it into place so that concurrent
+        # runs never see a partially written cache
+        tmp_filename = self.filename + '.%d.tmp'%os.getpid()
+        try:
+            with open(tmp_filename,'w') as fp:
+                json.dump(data, fp)
+            os.replace(tmp_filename, self.filename)
+        except:
+            self.modified = True
+            raise
+
+    def evict(self):
+        with self.lock:
+            while(len(self.entries) > self.max_entries):
+                self.entries.popitem(last=False)
+                self.evictions += 1
+                self.modified = True
+
+    def encode(self, encoder, version, function, x):
+        key = (encoder, version, x)
+        with self.lock:
+            y = self.entries.get(key)
+            if(y is not None):
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return y
+            self.misses += 1
+        # The encoding itself is done without the lock
+        start = time.perf_counter()
+        y = function(x)
+        with self.lock:
+            self.encode_time += time.perf_counter() - start
+            self.entries[key] = y
+            if(self.added is not None):
+                self.added.append(key)
+            self.modified = True
+            self.evict()
+        return y
+
+    def track_added(self):
+        with self.lock:
+            self.added = []
+
+    def take_added(self):
+        # Entries added since the last call, so that caches in worker processes
+        # can be merged back into the one that is saved by the parent
+        with self.lock:
+            added = [ (k, self.entries[k]) for k in self.added or [] if k in self.entries ]
+            if(self.added is not None):
+                self.added = []
+        return added
+
+    def merge(self, added):
+        with self.lock:
+            for key, y in added:
+                key = tuple(key)
+                if(key not in self.entries):
+                    self.entries[key] = y
+                    self.modified = True
+            self.evict()
+
+    def cached(self, encoder, version, function):
+        def cached_function(x):
+            return self.encode(encoder, version, function, x)
+        return cached_function
+
+    def stats(self):
+        return dict(hits = self.hits, misses = self.misses, evictions = self.evictions,
+            entries = len(self.entries), encode_ms = int(self.encode_time*1000))
+
+    def print_stats(self):
+        print("Info encoding cache :",self.hits,"hits,",self.misses,"misses,",
+            self.evictions,"evictions,",len(self.entries),"entries")
@@ -0,0 +1,182 @@
+# Generate a synthetic collaboration of configurable size, for testing and
+# benchmarking. Writes the four "SAPO Author List - *.csv" files read by
+# build_json_author_list.py and an xwiki export read by
+# xwiki_json_author_list.py. Names include non-ASCII characters, hyphenated
+# first names and multiple surnames, and some people have several
+# affiliations, some signers use alternative or unknown email addresses and
+# some sign more than once.
+
+import csv
+import json
+import random
+import argparse
+
+first_names = [ 'Stephen', 'Jean-Pierre', 'José', 'Björn', 'Łukasz', 'Zoë',
+    'Hans-Jürgen', 'Ana María', 'François', 'Søren', 'Chiara', 'Ming', 'Yuki',
+    'Olga', 'Raphaël', 'Jiří', 'Ines', 'Mohammed', 'Ngozi', 'Aoife', 'Karl-Heinz',
+    'Marie-Hélène', 'Đorđe', 'Tomás', 'Émilie', 'Gunnar', 'Priya', 'Lucía', 'Ørjan',
+    'Wei', 'Sven Erik', 'Anne-Sophie', 'Çağla', 'Dvir', 'Kateřina', 'Matthias' ]
+
+last_names = [ 'Fegan', 'Müller', 'Núñez', 'García', 'Øster', 'Dvořák',
+    "O'Brien", 'van der Berg', 'Smith', 'Schröder', 'Rossi', 'Zhang', 'Tanaka',
+    'Ivanova', 'Lefèvre', 'Novák', 'da Silva', 'Al-Hassan', 'Okafor', 'Ní Bhriain',
+    'Łopuszańska', 'Jovanović', 'Fernández Ruiz', 'Gómez', 'Håkansson', 'Patel',
+    'Wójcik', 'Kowalski', 'Yılmaz', 'Levi', 'Svoboda', 'Weiß', 'de la Cruz',
+    'Nguyễn', 'Sørensen', 'Papadopoulos' ]
+
+institution_types = [ 'Université', 'University', 'Universität', 'Istituto Nazionale',
+    'Institut', 'Observatorio', 'Max-Planck-Institut', 'Laboratoire', 'Centro',
+    'Instytut', 'Obserwatorium' ]
+
+cities = [ ('Paris','France'), ('Palaiseau','France'), ('Heidelberg','Germany'),
+    ('München','Germany'), ('Roma','Italy'), ('Padova','Italy'), ('Madrid','Spain'),
+    ('Barcelona','Spain'), ('Kraków','Poland'), ('Praha','Czech Republic'),
+    ('Tōkyō','Japan'), ('São Paulo','Brazil'), ('Córdoba','Argentina'),
+    ('Genève','Switzerland'), ('Zürich','Switzerland'), ('Dublin','Ireland'),
+    ('London','United Kingdom'), ('Stockholm','Sweden'), ('Århus','Denmark'),
+    ('Johannesburg','South Africa'), ('Melbourne','Australia'), ('Yerevan','Armenia') ]
+
+def format_author_name(firstname, lastname):
+    name = lastname.strip() + ','
+    for fn in firstname.split():
+        if '-' in fn:
+            fn = '-'.join(map(lambda hfn: hfn[0] + '.', fn.split('-')))
+        else:
+            fn = fn[0] + '.'
+        name += ' ' + fn
+    return name
+
+def format_paper_name(firstname, lastname):
+    lastname, initials = format_author_name(firstname, lastname).split(',')
+    return initials.strip() + ' ' + lastname
+
+def generate_places(rng, num_places):
+    places = []
+    for iplace in range(num_places):
+        city, country = rng.choice(cities)
+        kind = rng.choice(institution_types)
+        name = '%s %s %d'%(kind, city, iplace)
+        short_name = '%s %s'%(''.join(w[0] for w in kind.split() if w[0].isupper()) or kind[:3], city)
+        address = '%s, Département %d, F-%05d %s, %s'%(name, iplace%17, rng.randrange(100000), city, country)
+        places.append(dict(id=str(1000+iplace), short_name=short_name, country=country, address=address))
+    return places
+
+def generate_people(rng, num_people, places, multi_affiliation_fraction):
+    people = []
+    for iperson in range(num_people):
+        firstname = rng.choice(first_names)
+        lastname = rng.choice(last_names)
+        if(rng.random() < 0.1):
+            lastname += '-' + rng.choice(last_names)
+        naffil = 1
+        if(rng.random() < multi_affiliation_fraction):
+            naffil = rng.choice([2,2,2,3])
+        affiliations = [ p['id'] for p in rng.sample(places, naffil) ]
+        email = 'person%d@institute%d.example.org'%(iperson, int(affiliations[0])%97)
+        cta_email = 'p%d@cta-observatory.example.org'%iperson if rng.random() < 0.3 else ''
+        orcid = 'https://orcid.org/0000-0002-%04d-%04d'%(iperson//10000, iperson%10000) if rng.random() < 0.6 else ''
+        people.append(dict(id=str(iperson+1), firstname=firstname, lastname=lastname,
+            email=email, cta_email=cta_email, orcid=orcid, affiliations=affiliations))
+    return people
+
+def write_sapo_csv(csv_base, people, places, signers, alt_emails):
+    def csv_name(sheet):
+        return csv_base + ' - ' + sheet + '.csv'
+
+    with open(csv_name('People'),'w',newline='') as fp:
+        csv_writer = csv.writer(fp)
+        csv_writer.writerow(['ID', 'Last name', 'First name', 'Email', 'CTA email',
+            'Status', 'Group', 'Comment', 'Signature', 'Affiliation 1', 'Affiliation 2',
+            'Affiliation 3', 'Start', 'End', 'Notes', 'ORCID'])
+        for p in people:
+            affiliations = (p['affiliations'] + ['', '', ''])[0:3]
+            csv_writer.writerow([p['id'], p['lastname'], p['firstname'], p['email'],
+                p['cta_email'], 'Active', '', '', format_author_name(p['firstname'], p['lastname'])]
+                + affiliations + ['', '', '', p['orcid']])
+
+    with open(csv_name('Places'),'w',newline='') as fp:
+        csv_writer = csv.writer(fp)
+        for p in places:
+            csv_writer.writerow([p['id'], p['short_name'], p['country'], p['address']])
+
+    with open(csv_name('Alternative email'),'w',newline='') as fp:
+        csv_writer = csv.writer(fp)
+        for alt_email, email in alt_emails:
+            csv_writer.writerow([alt_email, email])
+
+    with open(csv_name('Opt in'),'w',newline='') as fp:
+        csv_writer = csv.writer(fp)
+        csv_writer.writerow(['Timestamp', 'Email', 'First name', 'Last name', 'Comment', 'Agreement'])
+        for email, firstname, lastname in signers:
+            csv_writer.writerow(['2026-01-01 12:00:00', email, firstname, lastname, '', 'I agree'])
+
+def write_xwiki_json(filename, people, places, signed_ids, title, date):
+    paper = dict(
+        paper_title = title,
+        date = date,
+        corresponding_authors = [ 'XWiki.person%s'%pid for pid in sorted(signed_ids)[0:2] ],
+        addresses = { 'AffiliationAddress.P%s'%p['id']: dict(shortName=p['short_name'],
+            country=p['country'], address=p['address']) for p in places },
+        authors = [ dict(
+            user = 'XWiki.person%s'%p['id'],
+            signature = format_paper_name(p['firstname'], p['lastname']),
+            firstName = p['firstname'],
+            lastName = p['lastname'],
+            email = p['email'],
+            orcid = p['orcid'].removeprefix('https://orcid.org/'),
+            affiliations = [ 'AffiliationAddress.P%s'%a for a in p['affiliations'] ])
+            for p in people if p['id'] in signed_ids ]
+    )
+    with open(filename,'w') as fp:
+        json.dump(paper,fp,indent=1)
+
+# ================ #
+# Main entry point #
+# ================ #
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--num_people', type=int, default=1500, help='Number of people in the collaboration (default: %(default)s)')
+    parser.add_argument('--num_places', type=int, default=None, help='Number of places (default: one for every five people)')
+    parser.add_argument('--signer_fraction', type=float, default=0.8, help='Fraction of people who sign the paper (default: %(default)s)')
+    parser.add_argument('--multi_affiliation_fraction', type=float, default=0.15, help='Fraction of people with more than one affiliation (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=1, help='Random number seed (default: %(default)s)')
+    parser.add_argument('--csv_base', default='SAPO Author List', help='Base name of CSV files (default: "%(default)s")')
+    parser.add_argument('--xwiki_output', default='cta_authors.json', help='Output xwiki JSON file name, or empty to skip (default: "%(default)s")')
+
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    num_places = args.num_places or max(1, args.num_people//5)
+
+    places = generate_places(rng, num_places)
+    people = generate_people(rng, args.num_people, places, args.multi_affiliation_fraction)
+
+    signers = []
+    alt_emails = []
+    signed_ids = set()
+    for p in people:
+        if(rng.random() >= args.signer_fraction):
+            continue
+        signed_ids.add(p['id'])
+        email = p['email']
+        r = rng.random()
+        if(r < 0.05):
+            email = 'alt.%s'%p['email']
+            alt_emails.append((email, p['email']))
+        elif(r < 0.15 and p['cta_email']):
+            email = p['cta_email'].upper()
+        elif(r < 0.17):
+            email = '%s.%s@gmail.example.com'%(p['firstname'].split()[0].lower(), p['lastname'].lower())
+        signers.append((email, p['firstname'], p['lastname']))
+        if(rng.random() < 0.02):
+            signers.append((email, p['firstname'], p['lastname']))
+    rng.shuffle(signers)
+
+    write_sapo_csv(args.csv_base, people, places, signers, alt_emails)
+    if(args.xwiki_output):
+        write_xwiki_json(args.xwiki_output, people, places, signed_ids,
+            'Synthetic collaboration paper with %d authors'%len(signed_ids), '2026-01-01')
+
+    print("Info wrote :",len(people),"people,",len(places),"places,",len(signers),"signers,",
+        len(alt_emails),"alternative emails")
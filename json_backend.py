@@ -0,0 +1,114 @@
+# Pluggable JSON serialisation for the author list files.
+#
+# The default "json" backend with indentation produces exactly the same bytes
+# as json.dump(..., indent=4), which is what the builders have always written.
+# The "orjson" backend, if installed, is much faster but writes UTF-8 rather
+# than \u escapes and can only indent by two spaces, so its output is
+# equivalent but not byte-identical. "compact" output has no indentation or
+# whitespace at all.
+#
+# dump_streaming writes a top-level object whose values may be iterators, which
+# are written as arrays one element at a time, so that a large list of authors
+# never has to be held in memory or serialised as a single string.
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def available_backends():
+    backends = [ 'json' ]
+    if(orjson is not None):
+        backends.append('orjson')
+    return backends
+
+def check_backend(backend):
+    if(backend not in available_backends()):
+        raise RuntimeError('JSON backend not available : '+backend)
+
+def indent_width(backend):
+    return 2 if backend == 'orjson' else 4
+
+def dumps(obj, backend='json', compact=False, level=0):
+    # Serialise "obj" as it would appear nested "level" deep in an indented
+    # document. Strings never contain raw newlines, so all newlines come from
+    # indentation.
+    check_backend(backend)
+    if(backend == 'orjson'):
+        s = orjson.dumps(obj, option=0 if compact else orjson.OPT_INDENT_2).decode('utf-8')
+    elif(compact):
+        s = json.dumps(obj, separators=(',',':'))
+    else:
+        s = json.dumps(obj, indent=4)
+    if(level and not compact):
+        s = s.replace('\n', '\n' + ' '*indent_width(backend)*level)
+    return s
+
+def dump(obj, fp, backend='json', compact=False):
+    check_backend(backend)
+    if(backend == 'json' and not compact):
+        json.dump(obj, fp, indent=4)
+    else:
+        fp.write(dumps(obj, backend, compact))
+
+def loads(s, backend='json'):
+    check_backend(backend)
+    if(backend == 'orjson'):
+        return orjson.loads(s)
+    return json.loads(s)
+
+def load(fp, backend='json'):
+    check_backend(backend)
+    if(backend == 'orjson'):
+        return orjson.loads(fp.read())
+    return json.load(fp)
+
+class LazyArray:
+    # Array whose elements are only generated, by calling make_element with
+    # each of the argument tuples in turn, as it is iterated over, but whose
+    # length is known in advance
+    def __init__(self, make_element, args):
+        self.make_element = make_element
+        self.args = args
+
+    def __len__(self):
+        return len(self.args)
+
+    def __iter__(self):
+        for a in self.args:
+            yield self.make_element(*a)
+
+def dump_streaming(obj, fp, backend='json', compact=False):
+    # Write a dict whose values may be lists, or iterators that are consumed as
+    # they are written. Produces the same output as dump() for the same data.
+    check_backend(backend)
+    pad = '' if compact else ' '*indent_width(backend)
+    newline = '' if compact else '\n'
+    colon = ':' if compact else ': '
+    if(not obj):
+        fp.write('{}')
+        return
+    fp.write('{' + newline)
+    for ikey, key in enumerate(obj):
+        value = obj[key]
+        fp.write(pad + dumps(key, backend, compact) + colon)
+        if(isinstance(value, (list, dict, str, int, float, bool)) or value is None):
+            fp.write(dumps(value, backend, compact, level=1))
+        else:
+            empty = True
+            for element in value:
+                fp.write(('[' if empty else ',') + newline + pad*2
+                    + dumps(element, backend, compact, level=2))
+                empty = False
+            fp.write('[]' if empty else newline + pad + ']')
+        fp.write((',' if ikey < len(obj)-1 else '') + newline)
+    fp.write('}')
+
+def add_arguments(parser, output=True):
+    parser.add_argument('--json_backend', default='json', choices=[ 'json', 'orjson' ],
+        help='Library used to read%s JSON (default: "%%(default)s")'%(' and write' if output else ''))
+    if(output):
+        parser.add_argument('--json_compact', action='store_true', help='Write JSON without indentation')
+        parser.add_argument('--json_stream', action='store_true', help='Write authors to the JSON file as they are generated rather than all at once')
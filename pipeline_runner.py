@@ -0,0 +1,276 @@
+# Run the full production job : fetch the sheets, build authors.json, render it
+# in all formats and upload the results, skipping each step whose inputs have
+# not changed since the last run.
+#
+# The content hashes of the inputs and outputs of each step are kept in a
+# manifest. A step is skipped if the hash of its inputs, which includes the
+# source of the code that runs it and the options that affect it, is the one
+# recorded, and its outputs are still present with the recorded hashes. Files
+# are uploaded only if they differ from the last version uploaded to the same
+# destination. Fetching cannot be skipped, but with a snapshot directory it
+# costs only one revision query when the sheets are unchanged.
+
+import os
+import csv
+import sys
+import json
+import hashlib
+import argparse
+import encoding_cache
+import json_backend
+import profiler
+import uploader
+import author_records
+import author_statistics
+import author_validator
+import build_json_author_list as sapo
+import xwiki_json_author_list as xwiki
+import author_list_pipeline
+import render_authors_latex
+import render_authors_xml
+import render_authors_csv
+import xml_writer
+
+manifest_version = 1
+
+mime_types = dict(json = 'application/json', csv = 'text/csv', xml = 'application/xml', tex = 'text/x-tex')
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+def hash_file(filename):
+    if(not os.path.exists(filename)):
+        return None
+    h = hashlib.sha256()
+    with open(filename,'rb') as fp:
+        for block in iter(lambda: fp.read(1<<20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def hash_values(*values):
+    return hash_bytes(json.dumps(values, sort_keys=True).encode('utf-8'))
+
+def source_hash(modules):
+    # Changes to the code of a step must cause it to be rerun
+    return hash_values(*[ hash_file(m.__file__) for m in modules ])
+
+build_modules = [ sapo, xwiki, author_records, author_validator, author_statistics, json_backend, encoding_cache ]
+render_modules = [ author_list_pipeline, render_authors_latex, render_authors_xml, render_authors_csv,
+    author_statistics, xml_writer ]
+
+class Manifest:
+    def __init__(self, filename, force=False) -> None:
+        self.filename = filename
+        self.data = dict(version = manifest_version, steps = dict(), uploads = dict())
+        if(filename and os.path.exists(filename) and not force):
+            with open(filename,'r') as fp:
+                data = json.load(fp)
+            if(data.get('version') == manifest_version):
+                self.data = data
+
+    def unchanged(self, step, inputs):
+        # True if the step was last run with the same inputs, and all of its
+        # outputs are as it left them
+        record = self.data['steps'].get(step)
+        return record is not None and record['inputs'] == inputs and \
+            all(hash_file(f) == h for f, h in record['outputs'].items())
+
+    def record(self, step, inputs, outputs):
+        self.data['steps'][step] = dict(inputs = inputs,
+            outputs = { f: hash_file(f) for f in outputs })
+        self.save()
+
+    def uploaded(self, destination):
+        return self.data['uploads'].get(destination)
+
+    def record_upload(self, destination, hash):
+        self.data['uploads'][destination] = hash
+        self.save()
+
+    def save(self):
+        # Saved after each step, so that an interrupted run keeps the work done
+        if(not self.filename):
+            return
+        tmp_filename = self.filename + '.%d.tmp'%os.getpid()
+        with open(tmp_filename,'w') as fp:
+            json.dump(self.data, fp, indent=4)
+        os.replace(tmp_filename, self.filename)
+
+def read_csv_rows(filename, skip_header):
+    with open(filename) as fp:
+        if(skip_header):
+            fp.readline()
+        return list(csv.reader(fp))
+
+def fetch_sapo(args, prof):
+    # Returns the rows of the alternative email, places, people and opt-in tabs
+    sheets = [ args.alt_email_sheet, args.places_sheet, args.people_sheet, args.opt_in_sheet ]
+    if(args.google_base):
+        google_uploader = uploader.GoogleDriveUploader(args.google_token, None, loud=True,
+            snapshot_directory=args.snapshot_dir, offline=args.offline)
+        rows = google_uploader.retrieve_sheets([ args.google_base + '#' + x for x in sheets ],
+            row_starts=[ 0, 0, 1, 1 ])
+        prof.add_counters('api_calls.', google_uploader.api_calls)
+        prof.add_counters('retries.', google_uploader.retry_stats)
+        return rows
+    return [ read_csv_rows(args.csv_base + ' - ' + x + '.csv', skip_header)
+        for x, skip_header in zip(sheets, [ False, False, True, True ]) ]
+
+def build_sapo(rows, corresponding, statistics):
+    alt_email_rows, places_rows, people_rows, signers_rows = rows
+    return sapo.make_author_list(sapo.load_alt_email_rows(alt_email_rows),
+        sapo.load_places_rows(places_rows), sapo.load_people_rows(people_rows),
+        sapo.load_signers_rows(signers_rows), corresponding, statistics)
+
+def run_step(manifest, step, inputs, outputs, run):
+    if(manifest.unchanged(step, inputs)):
+        print("Info step %s : skipped, inputs unchanged"%step)
+        return False
+    print("Info step %s : running"%step)
+    run()
+    manifest.record(step, inputs, outputs)
+    return True
+
+def make_uploader(args):
+    if(args.upload_dir):
+        if(not os.path.isdir(args.upload_dir)):
+            os.makedirs(args.upload_dir)
+        return 'file:' + os.path.abspath(args.upload_dir), \
+            uploader.FilesystemUploader(args.upload_dir, loud=True)
+    if(args.upload_folder_id):
+        google_uploader = uploader.GoogleDriveUploader(args.google_token, args.upload_folder_id, loud=True)
+        google_uploader.prefetch_directory_tree(args.upload_path)
+        return 'drive:' + args.upload_folder_id, google_uploader
+    return None, None
+
+# ================ #
+# Main entry point #
+# ================ #
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--manifest', default='pipeline_manifest.json', help='File in which the hashes of the inputs and outputs of each step are kept (default: "%(default)s")')
+    parser.add_argument('--force', action='store_true', help='Run all steps, ignoring the manifest')
+    parser.add_argument('--xwiki_input', default=None, help='Build from this XWiki export rather than from the SAPO sheets')
+    parser.add_argument('--opt_in_sheet', default='Opt in', help='Name of author opt-in sheet in Google or as CSV file (default: "%(default)s")')
+    parser.add_argument('--people_sheet', default='People', help='Name of people sheet in Google or as CSV file (default: "%(default)s")')
+    parser.add_argument('--places_sheet', default='Places', help='Name of places sheet in Google or as CSV file (default: "%(default)s")')
+    parser.add_argument('--alt_email_sheet', default='Alternative email', help='Name of alternative email sheet in Google or as CSV file (default: "%(default)s")')
+    parser.add_argument('--csv_base', default='SAPO Author List', help='Base name of CSV files (default: "%(default)s")')
+    parser.add_argument('--google_base', default=None, help='Base address of SAPO Authorship sheet. If not set, then read data from CSV files rather than Google')
+    parser.add_argument('--google_token', default='token.pickle', help='Google authentication token (default: "%(default)s")')
+    parser.add_argument('--snapshot_dir', default='~/.cache/sapo_authorlist/sheets', help='Directory in which to keep snapshots of the Google sheets, or empty to disable (default: "%(default)s")')
+    parser.add_argument('--offline', action='store_true', help='Use the sheet snapshots without contacting Google')
+    parser.add_argument('--email_authors', default=None, help='IDs of people whose email addresses should be added. Should be given as a list of People IDs')
+    parser.add_argument('--statistics', action='store_true', help='Add the number of authors per country and per affiliation to authors.json')
+    parser.add_argument('--formats', default=None, help='Comma separated list of formats to render, from %s (default: all LaTeX styles and CSV, and XML for XWiki author lists)'%', '.join(author_list_pipeline.formats))
+    parser.add_argument('--output_base', '-o', default='authors', help='Base name of output files, e.g. "authors" gives authors.json and authors_sapo.tex (default: "%(default)s")')
+    parser.add_argument('--title', '-t', default='', help='Title for LaTeX document')
+    parser.add_argument('--suppress_summary', action='store_true', help='Suppress SAPO summary information in LaTeX')
+    parser.add_argument('--orcid', action='store_true', help='Output ORCID identities for authors where they are available and supported by the LaTeX style')
+    parser.add_argument('--publication_reference', '-r', default='', help='Publication reference for XML document')
+    parser.add_argument('--upload_dir', default=None, help='Copy the outputs into this directory')
+    parser.add_argument('--upload_folder_id', default=None, help='Upload the outputs into this Google Drive folder')
+    parser.add_argument('--upload_workers', type=int, default=4, help='Number of files to upload to Google Drive at once (default: %(default)s)')
+    parser.add_argument('--upload_path', default='', help='Path below the upload directory or folder in which to put the outputs')
+    parser.add_argument('--encoding_cache', default=encoding_cache.default_filename, help='File in which to cache LaTeX, HTML and ASCII encodings between runs, or empty to disable (default: "%(default)s")')
+    parser.add_argument('--encoding_cache_size', type=int, default=100000, help='Maximum number of entries in the encoding cache (default: %(default)s)')
+    profiler.add_arguments(parser)
+
+    args = parser.parse_args()
+
+    prof = profiler.from_args(args)
+
+    manifest = Manifest(args.manifest, args.force)
+    builder = xwiki if args.xwiki_input else sapo
+    corresponding = args.email_authors.split(',') if args.email_authors else []
+    json_output = author_list_pipeline.output_filename(args.output_base, 'json')
+    output_dir = os.path.dirname(json_output)
+    if(output_dir and not os.path.isdir(output_dir)):
+        os.makedirs(output_dir)
+
+    # Fetch
+    with prof.stage('fetch'):
+        if(args.xwiki_input):
+            with open(args.xwiki_input,'rb') as fp:
+                rows = fp.read()
+            fetched = hash_bytes(rows)
+        else:
+            rows = fetch_sapo(args, prof)
+            fetched = hash_values(rows)
+
+    # Build
+    def build():
+        with prof.stage('encoding_cache_load'):
+            builder.cache.open(args.encoding_cache, args.encoding_cache_size)
+        if(args.xwiki_input):
+            paper = xwiki.make_author_list(json.loads(rows), args.statistics)
+        else:
+            paper = build_sapo(rows, corresponding, args.statistics)
+        with open(json_output,'w') as fp:
+            sapo.dump_author_list(paper, fp)
+        with prof.stage('encoding_cache_save'):
+            builder.cache.save()
+
+    # The names of the outputs are part of the inputs of each step, so that a
+    # step is run again when its output goes somewhere else
+    with prof.stage('build'):
+        run_step(manifest, 'build', hash_values(fetched, source_hash(build_modules),
+            bool(args.xwiki_input), corresponding, args.statistics, json_output), [ json_output ], build)
+
+    # Render
+    if(args.formats):
+        formats = [ x.strip() for x in args.formats.split(',') if x.strip() ]
+    else:
+        formats = author_list_pipeline.latex_styles + [ 'csv' ] + ([ 'xml' ] if args.xwiki_input else [])
+    for format in formats:
+        if(format not in author_list_pipeline.formats or format == 'json'):
+            print("ERROR cannot render format :",format)
+            sys.exit(1)
+    render_inputs = hash_values(hash_file(json_output), source_hash(render_modules),
+        args.title, args.orcid, args.suppress_summary, args.publication_reference)
+    outputs = { format: author_list_pipeline.output_filename(args.output_base, format) for format in formats }
+    format_inputs = { format: hash_values(render_inputs, outputs[format]) for format in formats }
+    with prof.stage('render'):
+        pending = [ format for format in formats
+            if not manifest.unchanged('render_'+format, format_inputs[format]) ]
+        for format in formats:
+            if(format not in pending):
+                print("Info step render_%s : skipped, inputs unchanged"%format)
+        if(pending):
+            with open(json_output,'r') as fp:
+                paper = json_backend.load(fp)
+            texts = author_list_pipeline.render_all(paper, pending, args.title, args.orcid,
+                args.suppress_summary, args.publication_reference)
+            for format in pending:
+                print("Info step render_%s : running"%format)
+                with open(outputs[format],'w') as fp:
+                    fp.write(texts[format])
+                manifest.record('render_'+format, format_inputs[format], [ outputs[format] ])
+
+    # Upload
+    destination, upload = make_uploader(args)
+    if(upload is not None):
+        with prof.stage('upload'):
+            changed = []
+            for filename in [ json_output ] + [ outputs[format] for format in formats ]:
+                rel_filepath = os.path.join(args.upload_path, os.path.basename(filename))
+                key = destination + '/' + rel_filepath
+                hash = hash_file(filename)
+                if(manifest.uploaded(key) == hash):
+                    print("Info step upload : skipped, unchanged :",rel_filepath)
+                else:
+                    changed.append((filename, rel_filepath, key, hash))
+            # Uploads to Drive are spread over a pool of threads, after finding
+            # the folders and existing files in a few batch requests. The files
+            # are read as they are sent, rather than all loaded into memory.
+            uploads = [ (rel_filepath, mime_types[os.path.splitext(filename)[1][1:]], filename)
+                for filename, rel_filepath, key, hash in changed ]
+            results = upload.upload_concurrently(uploads, args.upload_workers)
+            # Files that were not written, e.g. as they exist and must not be
+            # overwritten, are not recorded as uploaded
+            for (filename, rel_filepath, key, hash), result in zip(changed, results):
+                if(result):
+                    manifest.record_upload(key, hash)
+
+    prof.finish()
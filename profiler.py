@@ -0,0 +1,99 @@
+# Per-stage timing and memory profiling for the builder and renderer scripts.
+#
+# Each script wraps its main stages in "with profiler.stage(name):". When
+# profiling is enabled (--profile or --profile_trace) the wall-clock time, CPU
+# time and peak traced memory of each stage are recorded, together with any
+# counters the script adds (e.g. Google API calls), and a summary table is
+# printed to stderr at the end. The trace can also be written to a JSON file
+# so that runs can be compared over time. When profiling is disabled stages
+# cost next to nothing.
+
+import sys
+import time
+import json
+import contextlib
+import tracemalloc
+
+class Profiler:
+    def __init__(self, enabled=False, trace_file=None, name=''):
+        self.enabled = enabled or bool(trace_file)
+        self.trace_file = trace_file
+        self.name = name or (sys.argv[0] if sys.argv else '')
+        self.stages = []
+        self.counters = dict()
+        self.stack = []
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+        if(self.enabled and not tracemalloc.is_tracing()):
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if(not self.enabled):
+            yield
+            return
+        # Fold the peak so far into the enclosing stage before resetting it, so
+        # that nested stages do not hide the peak of their parents
+        if(self.stack):
+            self.stack[-1]['peak'] = max(self.stack[-1]['peak'], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        entry = dict(name = '/'.join([ s['name'] for s in self.stack ] + [ name ]), peak = 0)
+        self.stack.append(entry)
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start_wall
+            cpu = time.process_time() - start_cpu
+            self.stack.pop()
+            peak = max(entry['peak'], tracemalloc.get_traced_memory()[1])
+            if(self.stack):
+                self.stack[-1]['peak'] = max(self.stack[-1]['peak'], peak)
+            self.stages.append(dict(name = entry['name'], wall = wall, cpu = cpu, peak_bytes = peak))
+
+    def add_counter(self, name, value):
+        if(self.enabled):
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def add_counters(self, prefix, counters):
+        for name in counters:
+            self.add_counter(prefix + name, counters[name])
+
+    def trace(self):
+        return dict(
+            script = self.name,
+            argv = sys.argv[1:],
+            time = time.strftime('%Y-%m-%dT%H:%M:%S'),
+            total_wall = time.perf_counter() - self.start_wall,
+            total_cpu = time.process_time() - self.start_cpu,
+            stages = self.stages,
+            counters = self.counters)
+
+    def print_summary(self, file=None):
+        file = file or sys.stderr
+        trace = self.trace()
+        print('', file=file)
+        print('Profile of %s'%trace['script'], file=file)
+        print('%-32s %10s %10s %12s'%('Stage','Wall [s]','CPU [s]','Peak [MB]'), file=file)
+        for s in self.stages:
+            print('%-32s %10.3f %10.3f %12.2f'%(s['name'], s['wall'], s['cpu'],
+                s['peak_bytes']/1024/1024), file=file)
+        print('%-32s %10.3f %10.3f'%('Total', trace['total_wall'], trace['total_cpu']), file=file)
+        for name in sorted(self.counters):
+            print('%-32s %10s'%(name, self.counters[name]), file=file)
+
+    def finish(self):
+        if(not self.enabled):
+            return
+        self.print_summary()
+        if(self.trace_file):
+            with open(self.trace_file,'w') as fp:
+                json.dump(self.trace(),fp,indent=4)
+
+def add_arguments(parser):
+    parser.add_argument('--profile', action='store_true', help='Print time and memory used by each stage')
+    parser.add_argument('--profile_trace', default=None, help='Write time and memory used by each stage to this JSON file')
+
+def from_args(args):
+    return Profiler(args.profile, args.profile_trace)
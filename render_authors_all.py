@@ -0,0 +1,58 @@
+# Render an author list in all formats from a single load of the JSON file,
+# rather than running each of the render scripts on it in turn
+
+import sys
+import argparse
+import profiler
+import json_backend
+import author_list_pipeline
+
+def default_formats(paper):
+    # The XML format needs the XML encoded fields written by the XWiki builder
+    formats = author_list_pipeline.latex_styles + [ 'csv' ]
+    if('title_xml' in paper):
+        formats.append('xml')
+    return formats
+
+# ================ #
+# Main entry point #
+# ================ #
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--input', '-i', default='authors.json', help='Input JSON file name (default: "%(default)s")')
+    parser.add_argument('--output_base', '-o', default='authors', help='Base name of output files, e.g. "authors" gives authors.csv and authors_sapo.tex (default: "%(default)s")')
+    parser.add_argument('--formats', default=None, help='Comma separated list of formats to write, from %s (default: all LaTeX styles and CSV, and XML for XWiki author lists)'%', '.join(author_list_pipeline.formats))
+    parser.add_argument('--title', '-t', default='', help='Title for LaTeX document')
+    parser.add_argument('--suppress_summary', action='store_true', help='Suppress SAPO summary information in LaTeX')
+    parser.add_argument('--orcid', action='store_true', help='Output ORCID identities for authors where they are available and supported by the LaTeX style')
+    parser.add_argument('--publication_reference', '-r', default='', help='Publication reference for XML document')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes over which to spread the formats, or 1 to write all LaTeX styles in a single pass (default: %(default)s)')
+    json_backend.add_arguments(parser, output=False)
+    profiler.add_arguments(parser)
+
+    args = parser.parse_args()
+
+    prof = profiler.from_args(args)
+
+    with prof.stage('read_json'):
+        with open(args.input,'r') as fp:
+            paper = json_backend.load(fp, args.json_backend)
+
+    if(args.formats):
+        formats = [ x.strip() for x in args.formats.split(',') if x.strip() ]
+    else:
+        formats = default_formats(paper)
+    for format in formats:
+        if(format not in author_list_pipeline.formats):
+            print("ERROR unknown format :",format)
+            sys.exit(1)
+
+    with prof.stage('render'):
+        outputs = author_list_pipeline.render_all(paper, formats, args.title, args.orcid,
+            args.suppress_summary, args.publication_reference, args.workers)
+
+    with prof.stage('write'):
+        author_list_pipeline.write_all(outputs, args.output_base)
+
+    prof.finish()
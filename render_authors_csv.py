@@ -1,13 +1,33 @@
 # Simple script to generate a comma-separated list of author names
 
-import json
 import sys
+import argparse
+import profiler
+import json_backend
 
-json_file = sys.argv[1] if len(sys.argv)>1 else 'authors.json'
-with open(json_file,'r') as fp:
-    author_affiliation_list = json.load(fp)
+def render_author_list(paper, fp=None):
+    # Write the list of names to "fp", or to stdout if none
+    fp = fp if fp is not None else sys.stdout
+    for iauthor,author in enumerate(paper['authors']):
+        print(author['author_unicode']+",", file=fp)
 
-authors = author_affiliation_list['authors']
+# ================ #
+# Main entry point #
+# ================ #
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input', nargs='?', default='authors.json', help='Input JSON file name (default: "%(default)s")')
+    json_backend.add_arguments(parser, output=False)
+    profiler.add_arguments(parser)
+    args = parser.parse_args()
 
-for iauthor,author in enumerate(authors):
-    print(author['author_unicode']+",")
\ No newline at end of file
+    prof = profiler.from_args(args)
+
+    with prof.stage('read_json'):
+        with open(args.input,'r') as fp:
+            author_affiliation_list = json_backend.load(fp, args.json_backend)
+
+    with prof.stage('render'):
+        render_author_list(author_affiliation_list)
+
+    prof.finish()
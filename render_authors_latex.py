@@ -1,32 +1,39 @@
-import json
 import sys
 import argparse
+import profiler
+import json_backend
+import author_statistics
 
 class LatexRenderer:
-    def __init__(self, document_class="article", class_options=None) -> None:
+    def __init__(self, document_class="article", class_options=None, fp=None) -> None:
         self.document_class = document_class
         self.class_options = class_options
+        self.fp = fp
+
+    def print(self, *args, **kwargs):
+        # Write to the stream given to the renderer, or to stdout if none
+        print(*args, file=self.fp if self.fp is not None else sys.stdout, **kwargs)
 
     def setup_class(self):
         if(self.class_options):
-            print('\\documentclass[',self.class_options,']{',self.document_class,'}',sep='')
+            self.print('\\documentclass[',self.class_options,']{',self.document_class,'}',sep='')
         else:
-            print('\\documentclass{',self.document_class,'}',sep='')
-        print('\\usepackage{enumitem}')
-        print('\\usepackage[T1]{fontenc}')
-        print('\\usepackage{textcomp}')
+            self.print('\\documentclass{',self.document_class,'}',sep='')
+        self.print('\\usepackage{enumitem}')
+        self.print('\\usepackage[T1]{fontenc}')
+        self.print('\\usepackage{textcomp}')
 
     def begin_document(self, title = "CTA paper author list", date=""):
-        print('\\title{',title,'}',sep='')
+        self.print('\\title{',title,'}',sep='')
         if(date):
-            print('\\date{',date,'}',sep='')
-        print('\n\\begin{document}')
+            self.print('\\date{',date,'}',sep='')
+        self.print('\n\\begin{document}')
 
     def generate_title_pages(self):
-        print('\\maketitle')
+        self.print('\\maketitle')
 
     def end_document(self):
-        print('\n\\end{document}')
+        self.print('\n\\end{document}')
 
     def start_author_block(self, authors, affiliations):
         pass
@@ -50,36 +57,36 @@ class LatexRenderer:
         pass
 
 class SAPOLatexRenderer(LatexRenderer):
-    def __init__(self, orcid=False, document_class="article", class_options='a4paper,10pt') -> None:
-        super().__init__(document_class, class_options)
+    def __init__(self, orcid=False, document_class="article", class_options='a4paper,10pt', fp=None) -> None:
+        super().__init__(document_class, class_options, fp)
         self.orcid = orcid
         self.email_list = []
         self.author_list = []
 
     def setup_class(self):
         super().setup_class()
-        print('\\usepackage[margin=2cm, top=2cm, bottom=2cm]{geometry}')
-        print('\\usepackage{graphicx}')
-        print('\\usepackage{hyperref}')
+        self.print('\\usepackage[margin=2cm, top=2cm, bottom=2cm]{geometry}')
+        self.print('\\usepackage{graphicx}')
+        self.print('\\usepackage{hyperref}')
         if(self.orcid):
-            print('\\newcommand{\\orcid}[1]{\\unskip\\protect\\href{https://orcid.org/#1}{\\protect\\includegraphics[width=8pt,clip]{logo_orcid}}}')
+            self.print('\\newcommand{\\orcid}[1]{\\unskip\\protect\\href{https://orcid.org/#1}{\\protect\\includegraphics[width=8pt,clip]{logo_orcid}}}')
 
     def begin_document(self, title = "CTA paper author list", date=""):
-        print('\n\\begin{document}')
-        print('\\centering\\LARGE')
-        print(title,'\\\\[0.5cm]',sep='')
-        print('\\normalsize')
+        self.print('\n\\begin{document}')
+        self.print('\\centering\\LARGE')
+        self.print(title,'\\\\[0.5cm]',sep='')
+        self.print('\\normalsize')
         if(date):
-            print(date,'\\\\[0.5cm]',sep='')
-        print('\\raggedright')
+            self.print(date,'\\\\[0.5cm]',sep='')
+        self.print('\\raggedright')
         for ia,a in enumerate(self.author_list):
-            print('  \\mbox{',a,'}',', ' if ia < len(self.author_list)-1 else '',sep='')
+            self.print('  \\mbox{',a,'}',', ' if ia < len(self.author_list)-1 else '',sep='')
 
         if(self.email_list):
-            print('\\subsection*{Corresponding authors}')
+            self.print('\\subsection*{Corresponding authors}')
             for iemail, email in enumerate(self.email_list):
-                print(email,'\\\\',sep='')
-        print('\\twocolumn')
+                self.print(email,'\\\\',sep='')
+        self.print('\\twocolumn')
 
     def generate_title_pages(self):
         pass
@@ -95,23 +102,24 @@ class SAPOLatexRenderer(LatexRenderer):
         pass
 
     def start_affiliations_section(self, affiliations):
-        print('\\section*{Affiliations}')
-        print('\\begin{enumerate}[label=$^{\\arabic*}$,ref=\\arabic*,leftmargin=1.5em,labelsep=0.25em,labelwidth=1.25em]')
+        self.print('\\section*{Affiliations}')
+        self.print('\\begin{enumerate}[label=$^{\\arabic*}$,ref=\\arabic*,leftmargin=1.5em,labelsep=0.25em,labelwidth=1.25em]')
 
     def affiliation_in_section(self, iaffiliation, affiliation):
-        print('\\item ',affiliation['address_latex'],
+        self.print('\\item ',affiliation['address_latex'],
             '\\label{AFFIL::',affiliation['place_key'],'}',sep='')
 
     def end_affiliations_section(self):
-        print('\\end{enumerate}')
+        self.print('\\end{enumerate}')
 
 class MNRASLatexRenderer(LatexRenderer):
-    def __init__(self, document_class="mnras", class_options=None) -> None:
-        super().__init__(document_class)
+    def __init__(self, orcid=False, document_class="mnras", class_options=None, fp=None) -> None:
+        super().__init__(document_class, fp=fp)
+        self.orcid = orcid
         self.email_list = []
 
     def start_author_block(self, authors, affiliations):
-        print('\n\\author['+authors[0]['author_latex']+' et al]{\parbox{\\textwidth}{\\raggedright\\normalsize%')
+        self.print('\n\\author['+authors[0]['author_latex']+' et al]{\parbox{\\textwidth}{\\raggedright\\normalsize%')
 
     def author(self, iauthor, author):
         inst = ['\\ref{AFFIL::'+x+'}' for x in author['affil_place_keys']]
@@ -121,47 +129,47 @@ class MNRASLatexRenderer(LatexRenderer):
         if author['corresponding'] and 'email' in author:
             inst += '\\ref{CONTACTAUTHOR::'+str(len(self.email_list)+1)+'}'
             self.email_list.append('\\url{'+author['email']+'} ('+author['author_latex']+')')
-        print('  ',author['author_latex'],inst,sep='')
+        self.print('  ',author['author_latex'],inst,sep='')
 
     def end_author_block(self):
-        print('\\newline\\newline\n\\emph{Affiliations can be found at the end of the article}}}')
+        self.print('\\newline\\newline\n\\emph{Affiliations can be found at the end of the article}}}')
 
     def generate_title_pages(self):
         super().generate_title_pages()
         for iemail, email in enumerate(self.email_list):
-            print('\\footnotetext[',str(iemail+1),']{',email,
+            self.print('\\footnotetext[',str(iemail+1),']{',email,
                   '\\label{CONTACTAUTHOR::',str(iemail+1),'}}',sep='')
 
     def start_affiliations_section(self, affiliations):
-        print('\n\\section*{Affiliations}')
-        print('\\begin{enumerate}[label=$^{\\arabic*}$,ref=\\arabic*,leftmargin=1.5em,labelsep=0.25em,labelwidth=1.25em]')
+        self.print('\n\\section*{Affiliations}')
+        self.print('\\begin{enumerate}[label=$^{\\arabic*}$,ref=\\arabic*,leftmargin=1.5em,labelsep=0.25em,labelwidth=1.25em]')
 
     def affiliation_in_section(self, iaffiliation, affiliation):
-        print('\\item ',affiliation['address_latex'],
+        self.print('\\item ',affiliation['address_latex'],
               '\\label{AFFIL::',affiliation['place_key'],'}',sep='')
 
     def end_affiliations_section(self):
-        print('\\end{enumerate}')
+        self.print('\\end{enumerate}')
 
 class AALatexRenderer(LatexRenderer):
-    def __init__(self, astroph=False, orcid=False, document_class="aa", class_options="longauth") -> None:
+    def __init__(self, astroph=False, orcid=False, document_class="aa", class_options="longauth", fp=None) -> None:
         self.astroph = astroph
         self.orcid = orcid
-        super().__init__(document_class, class_options)
+        super().__init__(document_class, class_options, fp)
 
     def setup_class(self):
         super().setup_class()
-        print('\\usepackage{txfonts}')
+        self.print('\\usepackage{txfonts}')
 
     def generate_title_pages(self):
         super().generate_title_pages()
         if self.astroph:
-            print('\n%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%')
-            print('% Note : this suppresses generation of the institution list after the')
-            print('% bibliography, as in this "astroph" mode we generate the list ourselves.')
-            print('% This must be kept in the document submitted to astroph.')
-            print('%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%')
-            print('\\makeatletter\\aa@longauthfalse\\makeatother')
+            self.print('\n%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%')
+            self.print('% Note : this suppresses generation of the institution list after the')
+            self.print('% bibliography, as in this "astroph" mode we generate the list ourselves.')
+            self.print('% This must be kept in the document submitted to astroph.')
+            self.print('%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%')
+            self.print('\\makeatletter\\aa@longauthfalse\\makeatother')
 
 
     def author(self, iauthor, author):
@@ -175,40 +183,162 @@ class AALatexRenderer(LatexRenderer):
             inst += '\\thanks{\\url{'+author['email']+'} ('+author['author_latex']+')}'
         if self.orcid and 'orcid' in author and author['orcid']:
             inst += '\\orcid{' + author['orcid'] + '}'
-        print(linestart,author['author_latex'],inst,sep='')
+        self.print(linestart,author['author_latex'],inst,sep='')
 
     def affiliation_in_author_block(self, iaffiliation, affiliation):
         if not self.astroph:
             linestart= '}\n\n\\institute{' if iaffiliation==0 else '  \\and '
-            print(linestart,'{',affiliation['address_latex'],' ',
+            self.print(linestart,'{',affiliation['address_latex'],' ',
                 '\\label{AFFIL::',affiliation['place_key'],'}}',sep='')
 
     def end_author_block(self):
-        print('}')
+        self.print('}')
 
     def start_affiliations_section(self, affiliations):
         if self.astroph:
-            print('\n%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%')
-            print('% Note : in this "astroph" mode we generate the affiliation list ourselves.')
-            print('%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%')
-            print('\\section*{Affiliations}')
-            print('\\begin{enumerate}[label=$^{\\arabic*}$,ref=\\arabic*,leftmargin=1.5em,labelsep=0.25em,labelwidth=1.25em]')
+            self.print('\n%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%')
+            self.print('% Note : in this "astroph" mode we generate the affiliation list ourselves.')
+            self.print('%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%')
+            self.print('\\section*{Affiliations}')
+            self.print('\\begin{enumerate}[label=$^{\\arabic*}$,ref=\\arabic*,leftmargin=1.5em,labelsep=0.25em,labelwidth=1.25em]')
         else:
-            print('\n%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%')
-            print('% Note : this forces AA macros to output institutes without there being,')
-            print('% a bibliography present, it would not be needed in a real AA paper.')
-            print('%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%')
-            print('\\kern6pt\\hrule\\kern6pt\\aainstitutename')
+            self.print('\n%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%')
+            self.print('% Note : this forces AA macros to output institutes without there being,')
+            self.print('% a bibliography present, it would not be needed in a real AA paper.')
+            self.print('%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%')
+            self.print('\\kern6pt\\hrule\\kern6pt\\aainstitutename')
 
     def affiliation_in_section(self, iaffiliation, affiliation):
         if self.astroph:
-            print('\\item ',affiliation['address_latex'],
+            self.print('\\item ',affiliation['address_latex'],
                 '\\label{AFFIL::',affiliation['place_key'],'}',sep='')
 
     def end_affiliations_section(self):
         if self.astroph:
-            print('\\end{enumerate}')
+            self.print('\\end{enumerate}')
+
 
+class MultiLatexRenderer(LatexRenderer):
+    # Passes each call on to all of a list of renderers, so that documents in
+    # several styles can be written from a single walk over the author list
+    def __init__(self, renderers) -> None:
+        super().__init__()
+        self.renderers = renderers
+
+    def print(self, *args, **kwargs):
+        for r in self.renderers:
+            r.print(*args, **kwargs)
+
+    def setup_class(self):
+        for r in self.renderers:
+            r.setup_class()
+
+    def begin_document(self, title = "CTA paper author list", date=""):
+        for r in self.renderers:
+            r.begin_document(title, date)
+
+    def generate_title_pages(self):
+        for r in self.renderers:
+            r.generate_title_pages()
+
+    def end_document(self):
+        for r in self.renderers:
+            r.end_document()
+
+    def start_author_block(self, authors, affiliations):
+        for r in self.renderers:
+            r.start_author_block(authors, affiliations)
+
+    def author(self, iauthor, author):
+        for r in self.renderers:
+            r.author(iauthor, author)
+
+    def affiliation_in_author_block(self, iaffiliation, affiliation):
+        for r in self.renderers:
+            r.affiliation_in_author_block(iaffiliation, affiliation)
+
+    def end_author_block(self):
+        for r in self.renderers:
+            r.end_author_block()
+
+    def start_affiliations_section(self, affiliations):
+        for r in self.renderers:
+            r.start_affiliations_section(affiliations)
+
+    def affiliation_in_section(self, iaffiliation, affiliation):
+        for r in self.renderers:
+            r.affiliation_in_section(iaffiliation, affiliation)
+
+    def end_affiliations_section(self):
+        for r in self.renderers:
+            r.end_affiliations_section()
+
+def make_renderer(style, orcid=False, fp=None):
+    if(style == 'sapo'):
+        return SAPOLatexRenderer(orcid=orcid, fp=fp)
+    elif(style == 'mnras'):
+        return MNRASLatexRenderer(orcid=orcid, fp=fp)
+    elif(style == 'aa'):
+        return AALatexRenderer(orcid=orcid, fp=fp)
+    elif(style == 'aa-astroph'):
+        return AALatexRenderer(astroph=True,orcid=orcid, fp=fp)
+    raise RuntimeError('Unknown LaTeX style : '+style)
+
+def render_author_list(paper, render, title='', suppress_summary=False):
+    # Write the LaTeX document for the author list "paper" using "render", to
+    # the stream that it was given
+    authors = paper['authors']
+    affiliations = paper['affiliations']
+
+    render.setup_class()
+
+    render.start_author_block(authors, affiliations)
+    for iauthor,author in enumerate(authors):
+        render.author(iauthor, author)
+    for iaffiliation,affiliation in enumerate(affiliations):
+        render.affiliation_in_author_block(iaffiliation, affiliation)
+    render.end_author_block()
+
+    if(not title):
+        title = paper['title_latex'] if('title_latex' in paper) else 'Title not set'
+
+    render.begin_document(title, paper['date'] if 'date' in paper else '')
+    render.generate_title_pages()
+
+    if(not suppress_summary):
+        render.print('\n\\section*{Corrections}\n')
+        render.print('\\flushleft If your details are incorrect on this author list, please correct them on your')
+        render.print('\\href{https://cta.cloud.xwiki.com/xwiki/wiki/sapo/view/UserAffiliation/Code/MyAffiliation}{\\hypersetup{linkcolor=blue}SAPO profile page on XWiki}\\footnote{\\url{https://cta.cloud.xwiki.com/xwiki/wiki/sapo/view/UserAffiliation/Code/MyAffiliation}}.')
+
+    render.start_affiliations_section(affiliations)
+    for iaffiliation,affiliation in enumerate(affiliations):
+        render.affiliation_in_section(iaffiliation, affiliation)
+    render.end_affiliations_section()
+
+    if(not suppress_summary):
+        # Add table giving number of authors per country
+        render.print('\n\\section*{Authors by country}\n')
+        render.print('Number of authors:',len(authors),'\\\\')
+        render.print('Number of affiliations:',len(affiliations))
+        statistics = author_statistics.from_paper(paper)
+        country_count = { c['country']: c['authors_fractional'] for c in statistics['countries'] }
+        render.print('\n\\begin{tabbing}')
+        render.print('\\textbf{United Kingdom UK} \\= 8888.8 \\= \\kill')
+        for k in sorted(country_count,key=lambda x:country_count[x],reverse=True):
+            render.print('\\textbf{%s} \\> %g \\> %.1f\\%%\\\\'%(k,int(country_count[k]*10)/10, country_count[k]/len(authors)*100))
+        render.print('\\end{tabbing}')
+
+        # Add table giving list of authors per institution, to aid in verification
+        # of author eligibility
+        render.print('\n\\section*{Authors by affiliation}\n')
+        place_person = [ [ authors[iauthor]['author_latex'] for iauthor in x ]
+            for x in statistics['place_authors'] ]
+        render.print('\\begin{enumerate}[label=\\arabic*]')
+        for id,affil in enumerate(affiliations):
+            render.print('\\item \\textbf{%s}:'%affil['short_name_latex'],', '.join(place_person[id]))
+        render.print('\\end{enumerate}')
+
+    render.end_document()
 
 # ================ #
 # Main entry point #
@@ -224,83 +354,20 @@ if __name__ == "__main__":
     parser.add_argument('--orcid', action='store_true', help='Output ORCID identities for authors where they are available and supported by the LaTeX style')
     parser.add_argument('--input', '-i', default='authors.json', help='Input JSON file name (default: "%(default)s")')
     parser.add_argument('--output', '-o', default='authors.tex', help='Output LaTeX file name (default: "%(default)s")')
+    json_backend.add_arguments(parser, output=False)
+    profiler.add_arguments(parser)
 
     args = parser.parse_args()
 
-    with open(args.input,'r') as fp:
-        paper = json.load(fp)
+    prof = profiler.from_args(args)
 
-    authors = paper['authors']
-    affiliations = paper['affiliations']
-
-    render = None
-    if(args.render == 'sapo'):
-        render = SAPOLatexRenderer(orcid=args.orcid)
-    elif(args.render == 'mnras'):
-        render = MNRASLatexRenderer()
-    elif(args.render == 'aa'):
-        render = AALatexRenderer(orcid=args.orcid)
-    elif(args.render == 'aa-astroph'):
-        render = AALatexRenderer(astroph=True,orcid=args.orcid)
+    with prof.stage('read_json'):
+        with open(args.input,'r') as fp:
+            paper = json_backend.load(fp, args.json_backend)
 
     with open(args.output,'w') as fp:
-        # Set default stream for print to "fp"
-        sys_stdout = sys.stdout
-        sys.stdout = fp
-
-        render.setup_class()
-
-        render.start_author_block(authors, affiliations)
-        for iauthor,author in enumerate(authors):
-            render.author(iauthor, author)
-        for iaffiliation,affiliation in enumerate(affiliations):
-            render.affiliation_in_author_block(iaffiliation, affiliation)
-        render.end_author_block()
-
-        title = args.title
-        if(not title):
-            title = paper['title_latex'] if('title_latex' in paper) else 'Title not set'
-
-        render.begin_document(title, paper['date'] if 'date' in paper else '')
-        render.generate_title_pages()
-
-        if(not args.suppress_summary):
-            print('\n\\section*{Corrections}\n')
-            print('\\flushleft If your details are incorrect on this author list, please correct them on your')
-            print('\\href{https://cta.cloud.xwiki.com/xwiki/wiki/sapo/view/UserAffiliation/Code/MyAffiliation}{\\hypersetup{linkcolor=blue}SAPO profile page on XWiki}\\footnote{\\url{https://cta.cloud.xwiki.com/xwiki/wiki/sapo/view/UserAffiliation/Code/MyAffiliation}}.')
-
-        render.start_affiliations_section(affiliations)
-        for iaffiliation,affiliation in enumerate(affiliations):
-            render.affiliation_in_section(iaffiliation, affiliation)
-        render.end_affiliations_section()
-        
-        if(not args.suppress_summary):
-            # Add table giving number of authors per country
-            print('\n\\section*{Authors by country}\n')
-            print('Number of authors:',len(authors),'\\\\')
-            print('Number of affiliations:',len(affiliations))
-            country_count = dict()
-            for author in authors:
-                for country in [affiliations[id]['country'] for id in author['affil_nums']]:
-                    country_count[country] = country_count.get(country, 0) + 1/len(author['affil_nums'])
-            print('\n\\begin{tabbing}')
-            print('\\textbf{United Kingdom UK} \\= 8888.8 \\= \\kill')
-            for k in sorted(country_count,key=lambda x:country_count[x],reverse=True):
-                print('\\textbf{%s} \\> %g \\> %.1f\\%%\\\\'%(k,int(country_count[k]*10)/10, country_count[k]/len(authors)*100))
-            print('\\end{tabbing}')
-
-            # Add table giving list of authors per institution, to aid in verification
-            # of author eligibility
-            print('\n\\section*{Authors by affiliation}\n')
-            place_person = dict()
-            for author in authors:
-                for id in author['affil_nums']:
-                    if id not in place_person:
-                        place_person[id] = [].copy()
-                    place_person[id].append(author['author_latex'])
-            print('\\begin{enumerate}[label=\\arabic*]')
-            for id,affil in enumerate(affiliations):
-                print('\\item \\textbf{%s}:'%affil['short_name_latex'],', '.join(place_person[id]))
-            print('\\end{enumerate}')
-
-        render.end_document()
+        with prof.stage('render'):
+            render = make_renderer(args.render, args.orcid, fp)
+            render_author_list(paper, render, args.title, args.suppress_summary)
+
+    prof.finish()
@@ -1,6 +1,69 @@
-import json
+import os
 import sys
 import argparse
+import xml_writer
+import profiler
+import json_backend
+
+default_dtd = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'author.dtd')
+
+def render_author_list(paper, fp=None, publication_reference='', dtd=default_dtd):
+    # Write the XML author list for "paper" to "fp", or to stdout if none. The
+    # list must have been built by xwiki_json_author_list.py as it uses the XML
+    # encoded fields. Each element is checked against "dtd" as it is written,
+    # unless it is None.
+    fp = fp if fp is not None else sys.stdout
+    out = xml_writer.XMLWriter(fp, xml_writer.load_dtd(dtd) if dtd else None)
+
+    authors = paper['authors']
+    affiliations = paper['affiliations']
+
+    out.declaration()
+    out.doctype('collaborationauthorlist', 'author.dtd')
+    out.blank()
+    out.start('collaborationauthorlist', {
+        'xmlns:foaf': 'http://xmlns.com/foaf/0.1/',
+        'xmlns:cal':  'http://inspirehep.net/info/HepNames/tools/authors_xml/' }, multiline=True)
+    out.blank()
+    out.element('cal:creationDate', paper['date'])
+    if(publication_reference and publication_reference != ""):
+        out.element('cal:publicationReference', publication_reference)
+    else:
+        out.element('cal:publicationReference', paper['title_xml'], escaped=True)
+    out.blank()
+    out.start('cal:collaborations')
+    out.start('cal:collaboration', { 'id': 'cta' })
+    out.element('foaf:name', 'CTA')
+    out.end()
+    out.end()
+
+    out.start('cal:organizations')
+    for iaffiliation,affiliation in enumerate(affiliations):
+        out.start('foaf:Organization', { 'id': affiliation['place_key'] })
+        out.element('foaf:name', affiliation['short_name_xml'], escaped=True)
+        out.element('cal:orgAddress', affiliation['address_xml'], escaped=True)
+        out.end()
+    out.end()
+
+    out.start('cal:authors')
+    for iauthor,author in enumerate(authors):
+        out.start('foaf:Person')
+        out.element('foaf:name', '%s %s'%(author['firstname_xml'],author['lastname_xml']), escaped=True)
+        out.element('foaf:givenName', author['firstname_xml'], escaped=True)
+        out.element('foaf:familyName', author['lastname_xml'], escaped=True)
+        out.element('cal:authorNamePaper', author['author_xml'], escaped=True)
+        out.element('cal:authorCollaboration', attrs={ 'collaborationid': 'cta' })
+        out.start('cal:authorAffiliations')
+        for place_key in author['affil_place_keys']:
+            out.element('cal:authorAffiliation', attrs={ 'organizationid': place_key })
+        out.end()
+        out.start('cal:authorids')
+        if 'orcid' in author and author['orcid']:
+            out.element('cal:authorid', author['orcid'].removeprefix('https://orcid.org/'), { 'source': 'ORCID' })
+        out.end()
+        out.end()
+    out.end()
+    out.end()
 
 # ================ #
 # Main entry point #
@@ -11,66 +74,36 @@ if __name__ == "__main__":
     parser.add_argument('--publication_reference', '-r', default='', help='Publication reference for document')
     parser.add_argument('--input', '-i', default='authors.json', help='Input JSON file name (default: "%(default)s")')
     parser.add_argument('--output', '-o', default='authors.xml', help='Output LaTeX file name (default: "%(default)s")')
+    parser.add_argument('--dtd', default=default_dtd, help='DTD against which to check the document as it is written (default: "%(default)s")')
+    parser.add_argument('--no_validate', action='store_true', help='Do not check the document against the DTD')
+    json_backend.add_arguments(parser, output=False)
+    profiler.add_arguments(parser)
 
     args = parser.parse_args()
 
-    with open(args.input,'r') as fp:
-        paper = json.load(fp)
-
-    authors = paper['authors']
-    affiliations = paper['affiliations']
-
-    with open(args.output,'w') as fp:
-        # Set default stream for print to "fp"
-        sys_stdout = sys.stdout
-        sys.stdout = fp
+    prof = profiler.from_args(args)
 
-        print('<?xml version="1.0" encoding="UTF-8"?>')
-        print('<!DOCTYPE collaborationauthorlist SYSTEM "author.dtd">')
-        print()
-        print('<collaborationauthorlist')
-        print('   xmlns:foaf="http://xmlns.com/foaf/0.1/"')
-        print('   xmlns:cal="http://inspirehep.net/info/HepNames/tools/authors_xml/">')
-        print()
-        print('   <cal:creationDate>%s</cal:creationDate>'%paper['date'])
-        if(args.publication_reference and args.publication_reference != ""):
-            print('   <cal:publicationReference>%s</cal:publicationReference>'%args.publication_reference)
-        else:
-            print('   <cal:publicationReference>%s</cal:publicationReference>'%paper['title_xml'])
-        print()
-        print('   <cal:collaborations>')
-        print('      <cal:collaboration id="cta">')
-        print('         <foaf:name>CTA</foaf:name>')
-        print('      </cal:collaboration>')
-        print('   </cal:collaborations>')
+    with prof.stage('read_json'):
+        with open(args.input,'r') as fp:
+            paper = json_backend.load(fp, args.json_backend)
 
-        print('   <cal:organizations>')
-        for iaffiliation,affiliation in enumerate(affiliations):
-            print('      <foaf:Organization id="%s">'%affiliation['place_key'])
-            print('         <foaf:name>%s</foaf:name>'%affiliation['short_name_xml'])
-            print('         <cal:orgAddress>%s</cal:orgAddress>'%affiliation['address_xml'])
-            print('      </foaf:Organization>')
-        print('   </cal:organizations>')
+    # The document is written to a temporary file that replaces the output
+    # only once it is complete, so that an invalid author list does not leave
+    # a truncated file behind
+    tmp_output = args.output + '.%d.tmp'%os.getpid()
+    try:
+        with open(tmp_output,'w') as fp:
+            with prof.stage('render'):
+                render_author_list(paper, fp, args.publication_reference, None if args.no_validate else args.dtd)
+        os.replace(tmp_output, args.output)
+    except RuntimeError as e:
+        print("ERROR",e)
+        sys.exit(1)
+    finally:
+        if(os.path.exists(tmp_output)):
+            os.remove(tmp_output)
 
-        print('   <cal:authors>')
-        for iauthor,author in enumerate(authors):
-            print('      <foaf:Person>')
-            print('         <foaf:name>%s %s</foaf:name>'%(author['firstname_xml'],author['lastname_xml']))
-            print('         <foaf:givenName>%s</foaf:givenName>'%author['firstname_xml'])
-            print('         <foaf:familyName>%s</foaf:familyName>'%author['lastname_xml'])
-            print('         <cal:authorNamePaper>%s</cal:authorNamePaper>'%author['author_xml'])
-            print('         <cal:authorCollaboration collaborationid="cta" />')
-            print('         <cal:authorAffiliations>')
-            for place_key in author['affil_place_keys']:
-                print('            <cal:authorAffiliation organizationid="%s" />'%place_key)
-            print('         </cal:authorAffiliations>')
-            print('         <cal:authorids>')
-            if 'orcid' in author and author['orcid']:
-                print('            <cal:authorid source="ORCID">%s</cal:authorid>'%author['orcid'].removeprefix('https://orcid.org/'))
-            print('         </cal:authorids>')
-            print('      </foaf:Person>')
-        print('   </cal:authors>')
-        print('</collaborationauthorlist>')
+    prof.finish()
 #        for iauthor,author in enumerate(authors):
 #            render.author(iauthor, author)
 #        for iaffiliation,affiliation in enumerate(affiliations):
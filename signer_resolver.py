@@ -0,0 +1,113 @@
+# Suggest who the "unknown person" signers of an opt-in sheet might be.
+#
+# The surnames, first names and email local-parts of all people are indexed by
+# their character trigrams. For each unresolved signer only the people who
+# share at least one trigram with the signer are scored, using the Dice
+# coefficient between the trigram sets of each field, so the cost does not grow
+# as the product of the number of signers and the number of people. Trigrams
+# that are shared by a large fraction of people carry little information and
+# are not used to look up candidates.
+
+import re
+import csv
+import json
+import unicodedata
+import collections
+
+field_weights = dict(lastname = 0.5, firstname = 0.2, email = 0.3)
+
+def normalise(x):
+    x = unicodedata.normalize('NFKD', x).encode('ascii', 'ignore').decode('utf-8')
+    return re.sub(r'[^a-z0-9]+', ' ', x.lower()).strip()
+
+def email_local_part(email):
+    return email.split('@')[0]
+
+def trigrams(x):
+    x = normalise(x)
+    if not x:
+        return set()
+    x = ' ' + x + ' '
+    return set(x[i:i+3] for i in range(len(x)-2))
+
+class SignerResolver:
+    def __init__(self, people, max_posting_fraction=0.05, max_candidates=5):
+        self.people = people
+        self.max_candidates = max_candidates
+        self.index = { field: collections.defaultdict(list) for field in field_weights }
+        self.sizes = { field: dict() for field in field_weights }
+        for pid in people:
+            p = people[pid]
+            for field, grams in self.person_trigrams(p).items():
+                self.sizes[field][pid] = len(grams)
+                for gram in grams:
+                    self.index[field][gram].append(pid)
+        self.max_posting = max(10, int(max_posting_fraction * len(people)))
+
+    def person_trigrams(self, p):
+        email_grams = trigrams(email_local_part(p.email))
+        email_grams |= trigrams(email_local_part(p.cta_email))
+        return dict(
+            lastname = trigrams(p.lastname),
+            firstname = trigrams(p.firstname),
+            email = email_grams)
+
+    def signer_trigrams(self, s):
+        return dict(
+            lastname = trigrams(s.lastname),
+            firstname = trigrams(s.firstname),
+            email = trigrams(email_local_part(s.email_key)))
+
+    def candidates(self, s):
+        query = self.signer_trigrams(s)
+        shared = { field: collections.Counter() for field in field_weights }
+        for field, grams in query.items():
+            for gram in grams:
+                posting = self.index[field].get(gram, [])
+                if len(posting) <= self.max_posting:
+                    shared[field].update(posting)
+        scores = collections.Counter()
+        for field, counts in shared.items():
+            for pid, nshared in counts.items():
+                nquery = len(query[field])
+                nperson = self.sizes[field][pid]
+                scores[pid] += field_weights[field] * 2.0 * nshared / (nquery + nperson)
+        return [ (pid, score) for pid, score in scores.most_common(self.max_candidates) ]
+
+    def resolve(self, signers):
+        report = []
+        for s in signers:
+            report.append(dict(
+                email = s.email_key,
+                firstname = s.firstname,
+                lastname = s.lastname,
+                candidates = [ dict(
+                    id = pid,
+                    score = round(score, 3),
+                    lastname = self.people[pid].lastname,
+                    firstname = self.people[pid].firstname,
+                    email = self.people[pid].email)
+                    for pid, score in self.candidates(s) ]
+            ))
+        return report
+
+def write_report(report, filename):
+    with open(filename,'w') as fp:
+        json.dump(report,fp,indent=4)
+
+def write_alt_email_csv(report, filename, min_score=0.6, min_margin=0.1):
+    # Write the best candidate for each signer in the format of the SAPO
+    # "Alternative email" sheet, if it is good enough and clearly better than
+    # the next one
+    nwritten = 0
+    with open(filename,'w',newline='') as fp:
+        csv_writer = csv.writer(fp)
+        for entry in report:
+            candidates = entry['candidates']
+            if(not candidates or not candidates[0]['email'] or candidates[0]['score'] < min_score):
+                continue
+            if(len(candidates)>1 and candidates[0]['score']-candidates[1]['score'] < min_margin):
+                continue
+            csv_writer.writerow([entry['email'], candidates[0]['email'].lower()])
+            nwritten += 1
+    return nwritten
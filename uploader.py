@@ -22,21 +22,169 @@ import os.path
 import time
 import fcntl
 
-import matplotlib
-import matplotlib.figure
-import matplotlib.backends.backend_agg
-
 import pickle
 import os.path
-import googleapiclient.http
-import googleapiclient.discovery
-# import google_auth_oauthlib.flow
-import google.auth.transport.requests
 import socket
+import random
+import datetime
+import email.utils
+import threading
+import concurrent.futures
+import collections
+import hashlib
+import json
+import shutil
+
+# matplotlib and the Google API client take most of a second to import, so
+# they are only imported when a figure is uploaded or a GoogleDriveUploader is
+# created, and not by scripts that only read CSV files
+googleapiclient = None
+google = None
+google_auth_httplib2 = None
+httplib2 = None
+
+def import_google():
+    global googleapiclient, google, google_auth_httplib2, httplib2
+    if(googleapiclient is None):
+        import googleapiclient.http
+        import googleapiclient.errors
+        import googleapiclient.discovery
+        import googleapiclient.discovery_cache
+        # import google_auth_oauthlib.flow
+        import google.auth.transport.requests
+        import google_auth_httplib2
+        import httplib2
+
+# Credentials read from each token file by this process, with the modification
+# time of the file, so that uploaders created later need not read it again
+credentials_cache = dict()
+
+discovery_url = 'https://www.googleapis.com/discovery/v1/apis/%s/%s/rest'
 
 def esc(x):
     return x.replace("'", "\\'")
 
+ordinal = ["zeroth", "first", "second", "third", "fourth", "fifth",
+    "sixth", "seventh", "eigth","ninth","tenth"]
+
+def attempt_name(ntry):
+    return ordinal[ntry] + ' attempt' if ntry<len(ordinal) else 'attempt %d'%ntry
+
+class RetryPolicy:
+    # Retry of failed API calls, shared by all the calls of an uploader.
+    #
+    # Only failures that may succeed later are retried : timeouts, connection
+    # errors, and HTTP errors 408, 429, 5xx and 403 due to rate limits. Other
+    # HTTP errors, such as 400 or 404, are raised at once. The delay between
+    # attempts is "decorrelated jitter", random between base_delay and three
+    # times the previous delay, capped at max_delay, unless the server asks
+    # for a delay with a Retry-After header. A call is abandoned when it has
+    # been tried max_try times or when the next attempt would start after its
+    # time budget has run out. The budget starts again whenever the call
+    # reports that it has made progress, e.g. sent a chunk of an upload, so
+    # that long transfers can still be retried. Counts of attempts, retries, failures and time
+    # spent waiting are kept in "counters".
+    def __init__(self, base_delay=1.0, max_delay=100.0, budget=300.0) -> None:
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self.counters = collections.Counter()
+        self.counters_lock = threading.Lock()
+        self.random = random.Random()
+        # Deadline of the call being made by each thread
+        self.state = threading.local()
+
+    def count(self, name, value=1):
+        with self.counters_lock:
+            self.counters[name] += value
+
+    def count_failure(self, error):
+        status = self.status(error)
+        self.count('failures')
+        self.count('status.%s'%(status if status is not None else type(error).__name__))
+
+    def status(self, error):
+        if(googleapiclient is not None and isinstance(error, googleapiclient.errors.HttpError)):
+            return int(error.resp.status)
+        return None
+
+    def retryable(self, error):
+        status = self.status(error)
+        if(status is None):
+            return isinstance(error, (socket.timeout, TimeoutError, ConnectionError))
+        if(status in (408, 429) or status >= 500):
+            return True
+        if(status == 403):
+            content = error.content.decode('utf-8', 'replace') if isinstance(error.content, bytes) else str(error.content)
+            return 'rateLimitExceeded' in content or 'userRateLimitExceeded' in content
+        return False
+
+    def retry_after(self, error):
+        # Delay in seconds requested by the server, if any
+        if(self.status(error) is None):
+            return None
+        value = error.resp.get('retry-after')
+        if(not value):
+            return None
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            try:
+                return max((email.utils.parsedate_to_datetime(value) -
+                    datetime.datetime.now(datetime.timezone.utc)).total_seconds(), 0.0)
+            except (TypeError, ValueError):
+                return None
+
+    def next_delay(self, error, previous_delay):
+        delay = self.retry_after(error)
+        if(delay is None):
+            delay = min(self.max_delay, self.random.uniform(self.base_delay, max(previous_delay, self.base_delay)*3))
+        return delay
+
+    def progressed(self):
+        # Restart the time budget of the call being made by this thread
+        if(getattr(self.state, 'budget', None) is not None):
+            self.state.deadline = time.monotonic() + self.state.budget
+
+    def call(self, what, fn, max_try=2, budget=None):
+        # Returns fn(), calling it again after failures as described above.
+        # "what" describes the call in messages, e.g. "retrieve sheet".
+        outer = (getattr(self.state, 'budget', None), getattr(self.state, 'deadline', None))
+        try:
+            self.state.budget = self.budget if budget is None else budget
+            self.state.deadline = time.monotonic() + self.state.budget
+            return self.call_with_state(what, fn, max_try)
+        finally:
+            self.state.budget, self.state.deadline = outer
+
+    def call_with_state(self, what, fn, max_try):
+        delay = self.base_delay
+        ntry = 0
+        self.count('calls')
+        while(True):
+            ntry += 1
+            self.count('attempts')
+            try:
+                return fn()
+            except Exception as error:
+                self.count_failure(error)
+                if(not self.retryable(error)):
+                    self.count('not_retryable')
+                    raise
+                delay = self.next_delay(error, delay)
+                if(ntry >= max_try):
+                    self.count('gave_up')
+                    print("Failed to %s on %s, giving up"%(what, attempt_name(ntry)), file=sys.stderr)
+                    raise
+                if(time.monotonic() + delay > self.state.deadline):
+                    self.count('budget_exhausted')
+                    print("Failed to %s on %s, no time left to try again"%(what, attempt_name(ntry)), file=sys.stderr)
+                    raise
+                print("Failed to %s on %s, trying again in %.1fs"%(what, attempt_name(ntry), delay), file=sys.stderr)
+                self.count('retries')
+                self.count('sleep_seconds', delay)
+                time.sleep(delay)
+
 class Uploader:
     def __init__(self, overwrite=True, loud=False):
         self.loud = loud
@@ -46,13 +194,37 @@ class Uploader:
     def do_single_upload_from_io(self, rel_filepaths, mime_type, iostream):
         raise RuntimeError('do_single_upload_from_io: unimplemented in base class')
 
+    def do_single_upload_from_path(self, rel_filepath, mime_type, filename):
+        with open(filename, 'rb') as iostream:
+            return self.do_single_upload_from_io(rel_filepath, mime_type, iostream)
+
     def upload_from_io(self, rel_filepaths, mime_type, iostream):
         if(type(rel_filepaths) is not list):
-            rel_filepaths = [ rel_filepaths ]
-        for rel_filepath in rel_filepaths:
-            self.do_single_upload_from_io(rel_filepath, mime_type, iostream)
+            return self.do_single_upload_from_io(rel_filepaths, mime_type, iostream)
+        return [ self.do_single_upload_from_io(rel_filepath, mime_type, iostream)
+            for rel_filepath in rel_filepaths ]
+
+    def upload_from_path(self, rel_filepaths, mime_type, filename):
+        # Upload the file "filename" without reading it all into memory
+        if(type(rel_filepaths) is not list):
+            return self.do_single_upload_from_path(rel_filepaths, mime_type, filename)
+        return [ self.do_single_upload_from_path(rel_filepath, mime_type, filename)
+            for rel_filepath in rel_filepaths ]
+
+    def upload(self, rel_filepaths, mime_type, source):
+        # "source" is either a stream or the name of a file
+        if(isinstance(source, str)):
+            return self.upload_from_path(rel_filepaths, mime_type, source)
+        return self.upload_from_io(rel_filepaths, mime_type, source)
+
+    def upload_concurrently(self, uploads, max_workers=4, wait=True):
+        # Uploads one after the other, see GoogleDriveUploader for the
+        # concurrent version
+        return [ self.upload(rel_filepaths, mime_type, source)
+            for rel_filepaths, mime_type, source in uploads ]
 
     def upload_png_from_figure(self, rel_filepaths, figure):
+        import matplotlib.backends.backend_agg
         canvas = matplotlib.backends.backend_agg.FigureCanvas(figure)
         output = io.BytesIO()
         canvas.print_png(output)
@@ -61,6 +233,12 @@ class Uploader:
     def retrieve_sheet(self, sheet_id, row_start=0):
         raise RuntimeError('retrieve_sheet: unimplemented in base class')
 
+    def retrieve_sheets(self, sheet_ids, row_starts=0):
+        if(type(row_starts) is not list):
+            row_starts = [ row_starts ] * len(sheet_ids)
+        return [ self.retrieve_sheet(sheet_id, row_start=row_start)
+            for sheet_id, row_start in zip(sheet_ids, row_starts) ]
+
     def append_row_to_sheet(self, sheet_id_and_tab_name, row, row_start=0):
         raise RuntimeError('retrieve_sheet: unimplemented in base class')
 
@@ -79,7 +257,7 @@ class FilesystemUploader(Uploader):
 
     def make_path(self, rel_path):
         if(not rel_path):
-            return ''
+            return self.root_directory
         rel_path = os.path.normpath(rel_path)
         abs_path = os.path.normpath(os.path.join(self.root_directory, rel_path))
         if((self.root_directory == '.' and (abs_path.startswith('../') or abs_path.startswith('/')))
@@ -92,23 +270,47 @@ class FilesystemUploader(Uploader):
             os.mkdir(abs_path)
         return abs_path
 
-    def do_single_upload_from_io(self, rel_filepath, mime_type, iostream):
+    def destination(self, rel_filepath):
+        # Returns the path to write "rel_filepath" to, or None if it exists and
+        # must not be overwritten
         (rel_path, filename) = os.path.split(rel_filepath)
         abs_path = os.path.join(self.make_path(rel_path), filename)
-        mode = 'wb' if iostream is io.StringIO else 'w'
-        if(os.exists(abs_path)):
+        if(os.path.exists(abs_path)):
             if(self.overwrite):
                 if(self.loud):
-                    print("Skipping:",rel_filepath)
-                return None
+                    print("Updating:",rel_filepath)
             else:
                 if(self.loud):
-                    print("Updating:",rel_filepath)
+                    print("Skipping:",rel_filepath)
+                return None
         else:
             if(self.loud):
                 print("Uploading:",rel_filepath)
-        with open(abs_path, mode) as f:
-            f.write(iostream.getvalue())
+        return abs_path
+
+    def do_single_upload_from_io(self, rel_filepath, mime_type, iostream):
+        abs_path = self.destination(rel_filepath)
+        if(abs_path is None):
+            return None
+        # In-memory streams are written from their buffer without a copy, and
+        # others are copied in blocks
+        with open(abs_path, 'w' if isinstance(iostream, io.TextIOBase) else 'wb') as f:
+            if(isinstance(iostream, io.BytesIO)):
+                f.write(iostream.getbuffer())
+            elif(isinstance(iostream, io.StringIO)):
+                f.write(iostream.getvalue())
+            else:
+                iostream.seek(0)
+                shutil.copyfileobj(iostream, f)
+        return abs_path
+
+    def do_single_upload_from_path(self, rel_filepath, mime_type, filename):
+        abs_path = self.destination(rel_filepath)
+        if(abs_path is None):
+            return None
+        # Uploading a file into the directory it is in leaves it as it is
+        if(not (os.path.exists(abs_path) and os.path.samefile(filename, abs_path))):
+            shutil.copyfile(filename, abs_path)
         return abs_path
 
     def get_id(self, rel_filepath):
@@ -127,34 +329,383 @@ class FilesystemUploader(Uploader):
         else:
             return ''
 
+class BatchResult:
+    # Result of an operation queued in a DriveBatch, available once the batch
+    # has been sent
+    def __init__(self) -> None:
+        self.done = False
+        self.value = None
+        self.error = None
+
+    def set(self, value=None, error=None):
+        self.done = True
+        self.value = value
+        self.error = error
+
+    def result(self):
+        if(not self.done):
+            raise RuntimeError('BatchResult: batch has not been sent')
+        if(self.error is not None):
+            raise self.error
+        return self.value
+
+class DriveBatch:
+    # Queues folder creations and file lookups on a GoogleDriveUploader and
+    # sends them as batch requests when the context is left, or when flush is
+    # called, e.g.
+    #
+    #   with uploader.batch() as batch:
+    #       ids = [ batch.get_id(f) for f in files ]
+    #   print([ id.result() for id in ids ])
+    #
+    # Folders are resolved one level at a time, with one batch to look up all
+    # the folders of a level and one to create those that are missing, so the
+    # number of round trips depends on the depth of the paths and not on how
+    # many there are. The results are also stored in the caches of the
+    # uploader, so uploads of the files need no further lookups.
+    def __init__(self, uploader, max_try=5) -> None:
+        self.uploader = uploader
+        self.max_try = max_try
+        self.folders = dict()
+        self.files = dict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if(type is None):
+            self.flush()
+
+    def make_path(self, rel_path, do_create = True):
+        rel_path = os.path.normpath(rel_path) if rel_path else ''
+        if(rel_path.startswith('../')):
+            raise RuntimeError('Cannot make path outside of base : '+rel_path)
+        result, create = self.folders.get(rel_path, (BatchResult(), False))
+        self.folders[rel_path] = (result, create or do_create)
+        return result
+
+    def lookup_file(self, rel_filepath, field):
+        (rel_path, filename) = os.path.split(rel_filepath)
+        self.make_path(rel_path, do_create = False)
+        if((rel_filepath, field) not in self.files):
+            self.files[(rel_filepath, field)] = BatchResult()
+        return self.files[(rel_filepath, field)]
+
+    def get_id(self, rel_filepath):
+        return self.lookup_file(rel_filepath, 'id')
+
+    def get_url(self, rel_filepath):
+        return self.lookup_file(rel_filepath, 'webViewLink')
+
+    def prepare_upload(self, rel_filepath):
+        # Create the folder of a file that is to be uploaded, and find whether
+        # it exists already
+        (rel_path, filename) = os.path.split(rel_filepath)
+        self.make_path(rel_path)
+        return self.get_id(rel_filepath)
+
+    def lookup_folders(self, folders, errors):
+        # Find the (rel_path, parent) folders in one batch, returning those
+        # that do not exist
+        u = self.uploader
+        if(not folders):
+            return []
+        requests = [ u.drive_service.files().list(
+                spaces='drive',
+                fields='files(id, name)',
+                q="name='%s' and '%s' in parents and trashed=false and mimeType='application/vnd.google-apps.folder'"%(
+                    esc(os.path.split(rel_path)[1]),parent)) for rel_path, parent in folders ]
+        missing = []
+        for (rel_path, parent), (response, error) in zip(folders, u.execute_batch(requests, self.max_try)):
+            if(error is not None):
+                errors[rel_path] = error
+            elif(response.get('files')):
+                u.directory[rel_path] = response['files'][0].get('id')
+            else:
+                missing.append((rel_path, parent))
+        return missing
+
+    def flush(self):
+        u = self.uploader
+        folders = self.folders
+        files = self.files
+        self.folders = dict()
+        self.files = dict()
+
+        # All the folders needed, with their parents, and whether to create them
+        create = dict()
+        for rel_path in folders:
+            if(rel_path):
+                create[rel_path] = create.get(rel_path, False) or folders[rel_path][1]
+            head = os.path.split(rel_path)[0]
+            while(head):
+                create.setdefault(head, False)
+                head = os.path.split(head)[0]
+        for rel_path in sorted(create, key=lambda x: x.count('/'), reverse=True):
+            head = os.path.split(rel_path)[0]
+            if(head):
+                create[head] = create[head] or create[rel_path]
+
+        errors = dict()
+        created = set()
+        def parent_of(rel_path):
+            head = os.path.split(rel_path)[0]
+            if(head in errors):
+                errors[rel_path] = errors[head]
+            return head, u.directory.get(head, '') if head else u.root_folder_id
+
+        for depth in sorted(set(rel_path.count('/') for rel_path in create)):
+            level = [ rel_path for rel_path in create
+                if rel_path.count('/') == depth and rel_path not in u.directory ]
+            lookups = []
+            missing = []
+            for rel_path in level:
+                head, parent = parent_of(rel_path)
+                if(not parent or rel_path in errors):
+                    continue
+                if(head in u.directories_prefetched):
+                    missing.append((rel_path, parent))
+                else:
+                    lookups.append((rel_path, parent))
+            missing += self.lookup_folders(lookups, errors)
+            missing = [ (rel_path, parent) for rel_path, parent in missing if create[rel_path] ]
+            if(missing):
+                u.lock()
+                try:
+                    # Look again with the lock held, as another process may
+                    # have made the folders since the prefetch or the lookup
+                    creations = [ (rel_path, u.drive_service.files().create(
+                            body={
+                                'name' : os.path.split(rel_path)[1],
+                                'mimeType' : 'application/vnd.google-apps.folder',
+                                'parents' : [ parent ] },
+                            fields='id')) for rel_path, parent in self.lookup_folders(missing, errors) ]
+                    responses = u.execute_batch([ request for rel_path, request in creations ], self.max_try)
+                finally:
+                    u.unlock()
+                for (rel_path, request), (response, error) in zip(creations, responses):
+                    if(error is not None):
+                        errors[rel_path] = error
+                    else:
+                        # A new folder is empty, so nothing in it need be looked up
+                        u.directory[rel_path] = response.get('id')
+                        u.directories_prefetched.add(rel_path)
+                        created.add(rel_path)
+
+        for rel_path in folders:
+            if(rel_path in errors):
+                folders[rel_path][0].set(error = errors[rel_path])
+            else:
+                folders[rel_path][0].set(u.directory.get(rel_path, '') if rel_path else u.root_folder_id)
+
+        # Files, by name in their folders, or by id if that is known already
+        lookups = []
+        for (rel_filepath, field) in files:
+            result = files[(rel_filepath, field)]
+            head, parent = parent_of(rel_filepath)
+            if(rel_filepath in errors):
+                result.set(error = errors[rel_filepath])
+            elif(field == 'id' and rel_filepath in u.directory):
+                result.set(u.directory[rel_filepath])
+            elif(field == 'webViewLink' and rel_filepath in u.web_view_links):
+                result.set(u.web_view_links[rel_filepath])
+            elif(head in created):
+                u.files_absent.add(rel_filepath)
+                result.set('')
+            elif(not parent or rel_filepath in u.files_absent):
+                result.set('')
+            elif(rel_filepath in u.directory):
+                lookups.append((rel_filepath, result, u.drive_service.files().get(
+                    fileId=u.directory[rel_filepath], fields='id, webViewLink')))
+            else:
+                lookups.append((rel_filepath, result, u.drive_service.files().list(
+                    spaces='drive',
+                    fields='files(id, webViewLink)',
+                    q="name='%s' and '%s' in parents and trashed=false"%(esc(os.path.split(rel_filepath)[1]),parent))))
+        for (rel_filepath, result, request), (response, error) in zip(lookups,
+                u.execute_batch([ request for rel_filepath, result, request in lookups ], self.max_try)):
+            if(error is not None):
+                result.set(error = error)
+                continue
+            file = response['files'][0] if 'files' in response and response['files'] else \
+                (None if 'files' in response else response)
+            if(file is None):
+                u.files_absent.add(rel_filepath)
+            else:
+                u.directory[rel_filepath] = file.get('id')
+                u.web_view_links[rel_filepath] = file.get('webViewLink')
+        for (rel_filepath, field) in files:
+            result = files[(rel_filepath, field)]
+            if(not result.done):
+                result.set((u.directory if field == 'id' else u.web_view_links).get(rel_filepath, ''))
+
 class GoogleDriveUploader(Uploader):
     def __init__(self, token_file, root_folder_id, credentials_file='',
-            cache_directory_lists = True, assume_atomic = False, overwrite=True, loud=False):
-        self.ordinal = ["zeroth", "first", "second", "third", "fourth", "fifth",
-            "sixth", "seventh", "eigth","ninth","tenth"]
+            cache_directory_lists = True, assume_atomic = False, overwrite=True, loud=False,
+            snapshot_directory = None, offline = False, discovery_directory = None):
+        import_google()
         self.scopes = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
+        # Google limits the number of requests in one batch to 100
+        self.max_batch_size = 100
         self.root_folder_id = root_folder_id
         self.token_file = os.path.expanduser(token_file)
         self.credentials_file = os.path.expanduser(credentials_file)
         self.creds = None
         self.directory = {}
         self.directories_listed = set()
+        self.directories_prefetched = set()
+        self.files_absent = set()
+        self.web_view_links = dict()
         self.cache_directory_list = cache_directory_lists
         self.assume_atomic = assume_atomic
-        self.drive_service = None
-        self.sheets_service = None
+        # The services are built when first used, see get_service
+        self.services = dict()
+        self.services_lock = threading.Lock()
+        self.discovery_directory = os.path.expanduser(discovery_directory) if discovery_directory \
+            else os.path.dirname(self.token_file)
         self.lockfile = open(self.token_file+".lock",'ab')
         self.lockcount = 0
-        self.auth()
+        self.thread_lock = threading.RLock()
+        self.list_lock = threading.RLock()
+        self.thread_local = threading.local()
+        self.api_calls = collections.Counter()
+        self.api_calls_lock = threading.Lock()
+        self.retry = RetryPolicy()
+        self.retry_stats = self.retry.counters
+        # Files of at least resumable_threshold bytes are sent in chunks of
+        # chunk_size, which must be a multiple of 256kB, in resumable sessions
+        # whose URIs are kept in upload_session_file until they complete, so
+        # that an upload interrupted by an error or a crash can be continued
+        self.chunk_size = 8*1024*1024
+        self.resumable_threshold = 5*1024*1024
+        self.upload_session_file = self.token_file+".uploads"
+        self.upload_session_lifetime = 6*24*3600
+        self.snapshot_directory = os.path.expanduser(snapshot_directory) if snapshot_directory else None
+        self.offline = offline
+        if(self.offline and not self.snapshot_directory):
+            raise RuntimeError('GoogleDriveUploader: offline mode requires a snapshot directory')
+        if(not self.offline):
+            self.auth()
         super().__init__(overwrite=overwrite,loud=loud)
 
+    def get_discovery_document(self, name, version):
+        # Recent versions of the API client come with the documents of all the
+        # services, older ones fetch them on each run unless they are cached
+        if(hasattr(googleapiclient.discovery_cache, 'get_static_doc')):
+            document = googleapiclient.discovery_cache.get_static_doc(name, version)
+            if(document):
+                return document
+        filename = os.path.join(self.discovery_directory, 'discovery_%s_%s.json'%(name, version))
+        if(os.path.exists(filename)):
+            with open(filename, 'r') as fp:
+                return fp.read()
+        resp, content = httplib2.Http().request(discovery_url%(name, version))
+        if(resp.status != 200):
+            raise googleapiclient.errors.HttpError(resp, content, uri=discovery_url%(name, version))
+        document = content.decode('utf-8')
+        with open(filename+'.tmp', 'w') as fp:
+            fp.write(document)
+        os.replace(filename+'.tmp', filename)
+        return document
+
+    def get_service(self, name, version):
+        with self.services_lock:
+            if(name not in self.services):
+                if(self.offline):
+                    raise RuntimeError('GoogleDriveUploader: cannot access %s service in offline mode'%name)
+                self.services[name] = googleapiclient.discovery.build_from_document(
+                    self.get_discovery_document(name, version), credentials=self.creds)
+            return self.services[name]
+
+    @property
+    def drive_service(self):
+        return self.get_service('drive', 'v3')
+
+    @drive_service.setter
+    def drive_service(self, service):
+        self.services['drive'] = service
+
+    @property
+    def sheets_service(self):
+        return self.get_service('sheets', 'v4')
+
+    @sheets_service.setter
+    def sheets_service(self, service):
+        self.services['sheets'] = service
+
     def get_drive_service(self):
         return self.drive_service
 
     def get_sheets_service(self):
         return self.sheets_service
 
+    def execute(self, request, http=None):
+        # All API requests go through here so that they can be counted. Threads
+        # of the upload pool use their own Http object, see upload_concurrently
+        with self.api_calls_lock:
+            self.api_calls[getattr(request, 'methodId', None) or 'unknown'] += 1
+        return request.execute(http=http if http is not None else getattr(self.thread_local, 'http', None))
+
+    def batch(self, max_try=5):
+        return DriveBatch(self, max_try)
+
+    def execute_batch(self, requests, max_try=5, http=None):
+        # Send Drive requests in batches of at most max_batch_size, returning the
+        # (response, error) of each in order. Requests that fail are sent again
+        # in the next batch, up to max_try times.
+        responses = [ (None, None) ] * len(requests)
+        pending = list(range(len(requests)))
+        deadline = time.monotonic() + self.retry.budget
+        delay = self.retry.base_delay
+        ntry = 0
+        self.retry.count('calls')
+        while(pending):
+            ntry += 1
+            for ichunk in range(0, len(pending), self.max_batch_size):
+                chunk = pending[ichunk:ichunk+self.max_batch_size]
+                def callback(request_id, response, exception):
+                    responses[int(request_id)] = (response, exception)
+                batch = self.drive_service.new_batch_http_request(callback=callback)
+                for i in chunk:
+                    batch.add(requests[i], request_id=str(i))
+                    with self.api_calls_lock:
+                        self.api_calls[getattr(requests[i], 'methodId', None) or 'unknown'] += 1
+                with self.api_calls_lock:
+                    self.api_calls['batch'] += 1
+                self.retry.count('attempts')
+                try:
+                    batch.execute(http=http if http is not None else getattr(self.thread_local, 'http', None))
+                except Exception as e:
+                    if(not self.retry.retryable(e)):
+                        raise
+                    for i in chunk:
+                        responses[i] = (None, e)
+            failed = [ i for i in pending if responses[i][1] is not None ]
+            for i in failed:
+                self.retry.count_failure(responses[i][1])
+            pending = [ i for i in failed if self.retry.retryable(responses[i][1]) ]
+            self.retry.count('not_retryable', len(failed)-len(pending))
+            if(pending):
+                # Wait for as long as the longest Retry-After, if any
+                delay = max(self.retry.next_delay(responses[i][1], delay) for i in pending)
+                if(ntry >= max_try):
+                    self.retry.count('gave_up', len(pending))
+                    print("%d batched requests failed on %s, giving up"%(len(pending),attempt_name(ntry)), file=sys.stderr)
+                    break
+                if(time.monotonic() + delay > deadline):
+                    self.retry.count('budget_exhausted', len(pending))
+                    print("%d batched requests failed on %s, no time left to try again"%(len(pending),attempt_name(ntry)), file=sys.stderr)
+                    break
+                print("%d batched requests failed on %s, trying again in %.1fs"%(len(pending),attempt_name(ntry),delay), file=sys.stderr)
+                self.retry.count('retries', len(pending))
+                self.retry.count('sleep_seconds', delay)
+                time.sleep(delay)
+        return responses
+
     def lock(self):
+        # The file lock excludes other processes, but not other threads of this
+        # one, which the thread lock does
+        self.thread_lock.acquire()
         if(self.lockcount == 0):
             fcntl.lockf(self.lockfile, fcntl.LOCK_EX)
         self.lockcount += 1
@@ -163,16 +714,64 @@ class GoogleDriveUploader(Uploader):
         self.lockcount -= 1
         if(self.lockcount == 0):
             fcntl.lockf(self.lockfile, fcntl.LOCK_UN)
+        self.thread_lock.release()
+
+    def init_upload_thread(self):
+        self.thread_local.http = self.new_http()
+
+    def upload_concurrently(self, uploads, max_workers=4, wait=True):
+        # Upload many files at once, from a pool of "max_workers" threads, each
+        # with its own Http object as httplib2 is not thread safe. "uploads" is a
+        # list of (rel_filepaths, mime_type, source), where source is a stream or
+        # the name of a file. The folders and existing
+        # files are first found in a batch, so that the threads mostly only
+        # upload. Returns the ids of the uploaded files in the order of
+        # "uploads", or their futures if "wait" is False.
+        with self.batch() as batch:
+            for rel_filepaths, mime_type, source in uploads:
+                for rel_filepath in (rel_filepaths if type(rel_filepaths) is list else [ rel_filepaths ]):
+                    batch.prepare_upload(rel_filepath)
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers,
+            initializer=self.init_upload_thread)
+        futures = [ executor.submit(self.upload, rel_filepaths, mime_type, source)
+            for rel_filepaths, mime_type, source in uploads ]
+        executor.shutdown(wait=False)
+        if(not wait):
+            return futures
+        return [ future.result() for future in futures ]
+
+    def load_credentials(self):
+        # The file token.pickle stores the user's access and refresh tokens, and is
+        # created automatically when the authorization flow completes for the first
+        # time. It is only read again if it has changed.
+        try:
+            mtime = os.stat(self.token_file).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        if(self.token_file not in credentials_cache or credentials_cache[self.token_file][0] != mtime):
+            with open(self.token_file, 'rb') as token:
+                credentials_cache[self.token_file] = (mtime, pickle.load(token))
+        return credentials_cache[self.token_file][1]
+
+    def save_credentials(self):
+        # The file is replaced in one step, so that other processes can read
+        # it without taking the lock
+        with open(self.token_file+'.tmp', 'wb') as token:
+            pickle.dump(self.creds, token)
+        os.replace(self.token_file+'.tmp', self.token_file)
+        credentials_cache[self.token_file] = (os.stat(self.token_file).st_mtime_ns, self.creds)
 
     def auth(self):
+        # A token that is still valid is used as it is. Otherwise the file is
+        # read again with the lock held, in case another process has refreshed
+        # the token in the meantime, before refreshing it here.
+        self.creds = self.load_credentials()
+        if self.creds and self.creds.valid:
+            return
+
         self.lock()
         try:
-            # The file token.pickle stores the user's access and refresh tokens, and is
-            # created automatically when the authorization flow completes for the first
-            # time.
-            if os.path.exists(self.token_file):
-                with open(self.token_file, 'rb') as token:
-                    self.creds = pickle.load(token)
+            self.creds = self.load_credentials()
 
             # If there are no (valid) credentials available, let the user log in.
             if not self.creds or not self.creds.valid:
@@ -186,33 +785,76 @@ class GoogleDriveUploader(Uploader):
                     raise RuntimeError('GoogleDriveUploader: could not find valid access token')
 
                 # Save the credentials for the next run
-                with open(self.token_file, 'wb') as token:
-                    pickle.dump(self.creds, token)
-        except:
+                self.save_credentials()
+        finally:
             self.unlock()
-            raise
-
-        self.unlock()
-        self.drive_service = googleapiclient.discovery.build('drive', 'v3', credentials=self.creds)
-        self.sheets_service = googleapiclient.discovery.build('sheets', 'v4', credentials=self.creds)
 
     def list_directory_into_cache(self, rel_path):
-        if(rel_path not in self.directories_listed):
-            parent = self.make_path(rel_path, do_create = False)
-            self.directories_listed.add(rel_path)
-            next_page_token = ''
-            while(1):
-                response = self.drive_service.files().list(\
-                    spaces='drive',
-                    pageSize=1000,
-                    pageToken=next_page_token,
-                    fields='nextPageToken, files(name,id)',
-                    q="'%s' in parents and trashed=false"%(parent)).execute()
-                next_page_token = response.get('nextPageToken', '')
-                for file in response.get('files', []):
-                    self.directory[rel_path+'/'+file.get('name')] = file.get('id')
-                if(next_page_token == ''):
-                    break
+        # Another thread must not find the directory marked as listed before
+        # its files are in the cache
+        with self.list_lock:
+            if(rel_path not in self.directories_listed):
+                parent = self.make_path(rel_path, do_create = False)
+                self.directories_listed.add(rel_path)
+                next_page_token = ''
+                while(1):
+                    response = self.execute(self.drive_service.files().list(\
+                        spaces='drive',
+                        pageSize=1000,
+                        pageToken=next_page_token,
+                        fields='nextPageToken, files(name,id)',
+                        q="'%s' in parents and trashed=false"%(parent)))
+                    next_page_token = response.get('nextPageToken', '')
+                    for file in response.get('files', []):
+                        self.directory[rel_path+'/'+file.get('name')] = file.get('id')
+                    if(next_page_token == ''):
+                        break
+
+    def prefetch_directory_tree(self, rel_path = '', max_depth = None, parents_per_query = 40):
+        # Fill the directory cache with all the folders below "rel_path", one
+        # level at a time, listing the subfolders of many parents in each query,
+        # so that make_path and get_id need no API calls for folders that exist.
+        # The folders whose subfolders are then all known are remembered, so
+        # that make_path can also create missing folders without searching.
+        if(rel_path):
+            rel_path = os.path.normpath(rel_path)
+        parent = self.make_path(rel_path, do_create = False)
+        if(not parent):
+            return 0
+        level = { parent: rel_path }
+        depth = 0
+        nfolder = 0
+        while(level and (max_depth is None or depth < max_depth)):
+            next_level = dict()
+            parent_ids = list(level)
+            for ichunk in range(0, len(parent_ids), parents_per_query):
+                chunk = parent_ids[ichunk:ichunk+parents_per_query]
+                next_page_token = ''
+                while(1):
+                    response = self.execute(self.drive_service.files().list(\
+                        spaces='drive',
+                        pageSize=1000,
+                        pageToken=next_page_token,
+                        fields='nextPageToken, files(id, name, parents)',
+                        q="mimeType='application/vnd.google-apps.folder' and trashed=false and (%s)"%(
+                            ' or '.join("'%s' in parents"%id for id in chunk))))
+                    next_page_token = response.get('nextPageToken', '')
+                    for file in response.get('files', []):
+                        for id in file.get('parents', []):
+                            if(id in level):
+                                folder_path = os.path.join(level[id], file.get('name'))
+                                # As in make_path, the first of any folders with
+                                # the same name is used
+                                if(folder_path not in self.directory):
+                                    self.directory[folder_path] = file.get('id')
+                                    next_level[file.get('id')] = folder_path
+                                    nfolder += 1
+                    if(next_page_token == ''):
+                        break
+            self.directories_prefetched.update(level.values())
+            level = next_level
+            depth += 1
+        return nfolder
 
     def make_path(self, rel_path, do_create = True):
         if(not rel_path):
@@ -233,41 +875,66 @@ class GoogleDriveUploader(Uploader):
                         return ''
                     else:
                         raise RuntimeError('Parent was not created')
-                response = self.drive_service.files().list(\
-                    spaces='drive',
-                    fields='files(id, name)',
-                    q="name='%s' and '%s' in parents and trashed=false and mimeType='application/vnd.google-apps.folder'"%(tail,parent)).execute()
-                files = response.get('files', [])
+                if(rel_path in self.directory):
+                    # Made by another thread while this one waited for the lock
+                    files = [ dict(id = self.directory[rel_path]) ]
+                elif(head in self.directories_prefetched and not do_create):
+                    # All the subfolders of the parent were in the cache. A
+                    # folder is always searched for again, with the lock held,
+                    # before being created, in case another process made it.
+                    files = []
+                else:
+                    response = self.execute(self.drive_service.files().list(\
+                        spaces='drive',
+                        fields='files(id, name)',
+                        q="name='%s' and '%s' in parents and trashed=false and mimeType='application/vnd.google-apps.folder'"%(tail,parent)))
+                    files = response.get('files', [])
                 if(files):
                     self.directory[rel_path] = files[0].get('id')
                 elif(do_create):
-                    response = self.drive_service.files().create(\
+                    response = self.execute(self.drive_service.files().create(\
                         body={ \
                             'name' : tail,
                             'mimeType' : 'application/vnd.google-apps.folder',
                             'parents' : [ parent ] },
-                        fields='id').execute()
+                        fields='id'))
                     self.directory[rel_path] = response.get('id')
+                    self.directories_prefetched.add(rel_path)
                 else:
                     # do_create is false, so no need to unlock
                     return ''
             except:
                 if(do_create):
                     self.unlock()
-                raise()
+                raise
 
             if(do_create):
                 self.unlock()
 
         return self.directory[rel_path]
 
-    def do_single_upload_from_io(self, rel_filepath, mime_type, iostream, file_metadata = {}, modified_time=None):
+    def do_single_upload_from_io(self, rel_filepath, mime_type, iostream, file_metadata = {}, modified_time=None,
+            fingerprint=None, progress=None):
+        # The metadata is copied, as it is filled in differently for each file
+        # and may be shared between threads
+        file_metadata = dict(file_metadata)
         (rel_path, filename) = os.path.split(rel_filepath)
         parent = self.make_path(rel_path)
 
         existing_file_id = self.get_id(rel_filepath)
 
-        media = googleapiclient.http.MediaIoBaseUpload(iostream, mimetype=mime_type) if iostream else None
+        media = None
+        session = None
+        if(iostream):
+            iostream.seek(0, io.SEEK_END)
+            size = iostream.tell()
+            iostream.seek(0)
+            resumable = size >= self.resumable_threshold
+            media = googleapiclient.http.MediaIoBaseUpload(iostream, mimetype=mime_type,
+                chunksize=self.chunk_size, resumable=resumable)
+            if(resumable and fingerprint is None):
+                fingerprint = self.stream_fingerprint(iostream)
+            session = '%s|%s|%s'%(rel_filepath, existing_file_id, fingerprint)
         if(existing_file_id):
             if(self.overwrite):
                 if(self.loud):
@@ -275,11 +942,11 @@ class GoogleDriveUploader(Uploader):
                 file_metadata['mimeType'] = mime_type
                 if(modified_time is not None):
                     file_metadata['modifiedTime'] = modified_time + "Z"
-                response = self.drive_service.files().update(\
+                response = self.execute_upload(self.drive_service.files().update(\
                     fileId     = existing_file_id,
                     body       = file_metadata,
                     media_body = media,
-                    fields     = 'id').execute()
+                    fields     = 'id'), rel_filepath, media, session, progress)
                 return response.get('id')
             else:
                 if(self.loud):
@@ -293,48 +960,155 @@ class GoogleDriveUploader(Uploader):
             file_metadata['parents'] = [ parent ]
             if(modified_time is not None):
                 file_metadata['modifiedTime'] = modified_time + "Z"
-            response = self.drive_service.files().create(\
+            response = self.execute_upload(self.drive_service.files().create(\
                 body=file_metadata,
                 media_body=media,
-                fields='id').execute()
+                fields='id'), rel_filepath, media, session, progress)
             if(response.get('id')):
                 self.directory[rel_filepath] = response.get('id')
+                self.files_absent.discard(rel_filepath)
             return response.get('id')
 
-    def upload_from_io(self, rel_filepaths, mime_type, iostream, modified_time=None, file_metadata = {}, max_try=5):
+    def stream_fingerprint(self, iostream):
+        # Identifies the contents of a stream, so that an upload session is
+        # only resumed with the same data
+        h = hashlib.sha256()
+        iostream.seek(0)
+        while(True):
+            block = iostream.read(1024*1024)
+            if(not block):
+                break
+            h.update(block if isinstance(block, bytes) else block.encode('utf-8'))
+        iostream.seek(0)
+        return h.hexdigest()
+
+    def get_upload_sessions(self):
+        # Must be called with the lock held. Sessions expire after a week, so
+        # older ones are dropped.
+        try:
+            with open(self.upload_session_file, 'r') as fp:
+                sessions = json.load(fp)
+        except (OSError, ValueError):
+            return dict()
+        return { key: sessions[key] for key in sessions
+            if time.time() - sessions[key]['time'] < self.upload_session_lifetime }
+
+    def set_upload_session(self, session, uri):
+        # Record (or forget, if uri is None) the URI of an upload session
+        self.lock()
+        try:
+            sessions = self.get_upload_sessions()
+            if(uri is None and session not in sessions):
+                return
+            if(uri is None):
+                del sessions[session]
+            else:
+                sessions[session] = dict(uri = uri, time = time.time())
+            with open(self.upload_session_file+'.tmp', 'w') as fp:
+                json.dump(sessions, fp, indent=1)
+            os.replace(self.upload_session_file+'.tmp', self.upload_session_file)
+        finally:
+            self.unlock()
+
+    def get_upload_session(self, session):
+        self.lock()
+        try:
+            return self.get_upload_sessions().get(session, dict()).get('uri')
+        finally:
+            self.unlock()
+
+    def report_progress(self, progress, rel_filepath, sent, size):
+        if(progress is not None):
+            progress(rel_filepath, sent, size)
+        elif(self.loud):
+            print("Uploaded: %s %d%% of %d bytes"%(rel_filepath, 100*sent//max(size,1), size))
+
+    def resume_upload(self, request, uri, size, http):
+        # Ask the server how much of an earlier session it has. Returns the
+        # response if the upload was completed, or None after setting the
+        # request to continue from where the session stopped, or to start
+        # again if the session has expired.
+        with self.api_calls_lock:
+            self.api_calls['upload_status'] += 1
+        resp, content = http.request(uri, 'PUT', headers={ 'Content-Range': 'bytes */%d'%size, 'Content-Length': '0' })
+        if(resp.status in (200, 201)):
+            return request.postproc(resp, content)
+        if(resp.status == 308):
+            request.resumable_uri = uri
+            request.resumable_progress = int(resp['range'].split('-')[1])+1 if 'range' in resp else 0
+            return None
+        if(resp.status in (404, 410)):
+            return None
+        raise googleapiclient.errors.HttpError(resp, content, uri=uri)
+
+    def execute_upload(self, request, rel_filepath, media, session, progress=None):
+        # Small uploads are sent in one request. Resumable ones are sent chunk
+        # by chunk, continuing the session of an earlier attempt if there is one
+        if(media is None or not media.resumable()):
+            return self.execute(request)
+        http = getattr(self.thread_local, 'http', None) or request.http
+        uri = self.get_upload_session(session)
+        if(uri):
+            response = self.resume_upload(request, uri, media.size(), http)
+            if(response is not None):
+                self.set_upload_session(session, None)
+                return response
+            if(request.resumable_uri and self.loud):
+                print("Resuming:",rel_filepath,"from byte",request.resumable_progress)
+            self.retry.progressed()
+        saved_uri = request.resumable_uri
+        response = None
+        try:
+            while(response is None):
+                with self.api_calls_lock:
+                    if(request.resumable_uri is None):
+                        self.api_calls[getattr(request, 'methodId', None) or 'unknown'] += 1
+                    self.api_calls['upload_chunk'] += 1
+                status, response = request.next_chunk(http=http)
+                if(request.resumable_uri != saved_uri):
+                    saved_uri = request.resumable_uri
+                    self.set_upload_session(session, saved_uri)
+                if(status is not None):
+                    self.retry.progressed()
+                    self.report_progress(progress, rel_filepath, status.resumable_progress, media.size())
+        finally:
+            # The session is kept if the upload failed, so that the next
+            # attempt can continue it
+            if(request.resumable_uri and request.resumable_uri != saved_uri):
+                self.set_upload_session(session, request.resumable_uri)
+        self.set_upload_session(session, None)
+        self.report_progress(progress, rel_filepath, media.size(), media.size())
+        return response
+
+    def upload_from_io(self, rel_filepaths, mime_type, iostream, modified_time=None, file_metadata = {}, max_try=5,
+            progress=None, fingerprint=None):
+        # "progress", if given, is called with (rel_filepath, bytes_sent, size)
+        # after each chunk of a resumable upload
         was_list = True
         uploaded_ids = []
         if(type(rel_filepaths) is not list):
             was_list = False
             rel_filepaths = [ rel_filepaths ]
         for rel_filepath in rel_filepaths:
-            ntry = 0
-            uploaded = False
-            uploaded_id = None
-            while(not uploaded):
-                ntry += 1
-                try:
-                    uploaded_id = self.do_single_upload_from_io(rel_filepath, mime_type, iostream, file_metadata=file_metadata, modified_time=modified_time)
-                    uploaded = True
-                except (googleapiclient.errors.HttpError, socket.timeout):
-                    if(ntry<max_try):
-                        if(ntry<len(self.ordinal)):
-                            print("Upload failed on %s attempt, trying again"%self.ordinal[ntry], file=sys.stderr)
-                        else:
-                            print("Upload failed on attempt %d, trying again"%ntry, file=sys.stderr)
-                        time.sleep(min(2**ntry,100))
-                    else:
-                        if(ntry<len(self.ordinal)):
-                            print("Upload failed on %s and final attempt"%self.ordinal[ntry], file=sys.stderr)
-                        else:
-                            print("Upload failed on final attempt %d"%ntry, file=sys.stderr)
-                        raise
-            uploaded_ids.append(uploaded_id)
+            uploaded_ids.append(self.retry.call('upload '+rel_filepath,
+                lambda: self.do_single_upload_from_io(rel_filepath, mime_type, iostream,
+                    file_metadata=file_metadata, modified_time=modified_time,
+                    fingerprint=fingerprint, progress=progress), max_try))
         if(was_list):
             return uploaded_ids
         else:
             return uploaded_ids[0]
 
+    def upload_from_path(self, rel_filepaths, mime_type, filename, modified_time=None, file_metadata = {}, max_try=5,
+            progress=None):
+        # The file is read in chunks as it is sent, and its name, size and
+        # modification time identify it for resuming an interrupted upload
+        stat = os.stat(filename)
+        with open(filename, 'rb') as iostream:
+            return self.upload_from_io(rel_filepaths, mime_type, iostream, modified_time=modified_time,
+                file_metadata=file_metadata, max_try=max_try, progress=progress,
+                fingerprint='%s:%d:%d'%(os.path.realpath(filename), stat.st_size, stat.st_mtime_ns))
+
     def get_sheet_id_and_tab_name(self, sheet_id_and_tab_name):
         bits = sheet_id_and_tab_name.split('#')
         if(len(bits) <= 1):
@@ -344,68 +1118,136 @@ class GoogleDriveUploader(Uploader):
         else:
             raise RuntimeError("Could not understand sheet and tab specification: "+sheet_id_and_tab_name)
 
-    def retrieve_sheet(self, sheet_id_and_tab_name, row_start=0, max_try=2):
+    def get_sheet_id_and_range(self, sheet_id_and_tab_name, row_start=0):
         sheet_id, range = self.get_sheet_id_and_tab_name(sheet_id_and_tab_name)
         if range:
             range = "'" + range + "'!"
         range += 'A%d:ZZZ'%(row_start+1)
-        ntry = 0
-        retrieved = False
-        while(not retrieved):
-            ntry += 1
-            try:
-                response = self.sheets_service.spreadsheets().values().get(
-                    spreadsheetId=sheet_id,range=range).execute()
-                retrieved = True
-            except googleapiclient.errors.HttpError:
-                if(ntry<max_try):
-                    if(ntry<len(self.ordinal)):
-                        print("Failed to retrieve sheet on %s attempt, trying again"%self.ordinal[ntry], file=sys.stderr)
-                    else:
-                        print("Failed to retrieve sheet on attempt %d, trying again"%ntry, file=sys.stderr)
-                    time.sleep(min(2**ntry,100))
-                else:
-                    if(ntry<len(self.ordinal)):
-                        print("Failed to retrieve sheet on %s and final attempt"%self.ordinal[ntry], file=sys.stderr)
-                    else:
-                        print("Failed to retrieve sheet on final attempt %d"%ntry, file=sys.stderr)
-                    raise
+        return sheet_id, range
+
+    def new_http(self):
+        # httplib2 is not thread safe, so each thread that makes API calls must
+        # pass its own authorized Http object to execute()
+        return google_auth_httplib2.AuthorizedHttp(self.creds, http=httplib2.Http())
+
+    def get_file_revision(self, file_id, http=None, max_try=2):
+        response = self.retry.call('get file revision', lambda: self.execute(self.drive_service.files().get(
+            fileId=file_id, fields='modifiedTime,version'), http=http), max_try)
+        return '%s/%s'%(response.get('version',''), response.get('modifiedTime',''))
+
+    def snapshot_filename(self, sheet_id, range):
+        key = hashlib.sha1((sheet_id + '\n' + range).encode('utf-8')).hexdigest()
+        return os.path.join(self.snapshot_directory, key + '.json')
+
+    def load_snapshot(self, sheet_id, range):
+        filename = self.snapshot_filename(sheet_id, range)
+        if(not os.path.exists(filename)):
+            return None
+        with open(filename, 'r') as fp:
+            return json.load(fp)
+
+    def save_snapshot(self, sheet_id, range, revision, values):
+        if(not os.path.isdir(self.snapshot_directory)):
+            os.makedirs(self.snapshot_directory)
+        filename = self.snapshot_filename(sheet_id, range)
+        tmp_filename = filename + '.%d.tmp'%os.getpid()
+        with open(tmp_filename, 'w') as fp:
+            json.dump(dict(sheet_id=sheet_id, range=range, revision=revision,
+                saved=time.strftime('%Y-%m-%dT%H:%M:%S'), values=values), fp)
+        os.replace(tmp_filename, filename)
+
+    def retrieve_snapshots(self, sheet_id, ranges, http=None):
+        # Returns the revision of the spreadsheet and the snapshot of each range,
+        # or None for ranges whose snapshot is missing or out of date. Offline
+        # all snapshots are used regardless of revision.
+        snapshots = [ self.load_snapshot(sheet_id, range) for range in ranges ]
+        if(self.offline):
+            for range, snapshot in zip(ranges, snapshots):
+                if(snapshot is None):
+                    raise RuntimeError('No snapshot available offline for sheet : '+sheet_id+' '+range)
+                if(self.loud):
+                    print("Using offline snapshot from %s : %s"%(snapshot.get('saved'),range), file=sys.stderr)
+            return None, [ snapshot['values'] for snapshot in snapshots ]
+        revision = self.get_file_revision(sheet_id, http=http)
+        return revision, [ snapshot['values'] if snapshot and snapshot.get('revision') == revision
+            else None for snapshot in snapshots ]
+
+    def retrieve_sheet(self, sheet_id_and_tab_name, row_start=0, max_try=2):
+        sheet_id, range = self.get_sheet_id_and_range(sheet_id_and_tab_name, row_start)
+        if(self.snapshot_directory):
+            revision, values = self.retrieve_snapshots(sheet_id, [ range ])
+            if(values[0] is not None):
+                return values[0]
+        response = self.retry.call('retrieve sheet', lambda: self.execute(
+            self.sheets_service.spreadsheets().values().get(spreadsheetId=sheet_id,range=range)), max_try)
+
+        values = response['values'] if response and 'values' in response else []
+        if(self.snapshot_directory):
+            self.save_snapshot(sheet_id, range, revision, values)
+        return values
+
+    def retrieve_sheet_ranges(self, sheet_id, ranges, http=None, max_try=2):
+        response = self.retry.call('retrieve sheets', lambda: self.execute(
+            self.sheets_service.spreadsheets().values().batchGet(spreadsheetId=sheet_id,ranges=ranges),
+            http=http), max_try)
+
+        value_ranges = response.get('valueRanges', []) if response else []
+        return [ vr.get('values', []) for vr in value_ranges ]
 
-        if response and 'values' in response:
-            return response['values']
+    def retrieve_sheets(self, sheet_ids_and_tab_names, row_starts=0, max_try=2, max_workers=4):
+        # Retrieve many tabs at once. All the tabs of one spreadsheet are fetched
+        # with a single batchGet, so they are mutually consistent. Different
+        # spreadsheets are fetched concurrently. Returns the rows of each tab in
+        # the order requested.
+        if(type(row_starts) is not list):
+            row_starts = [ row_starts ] * len(sheet_ids_and_tab_names)
+        sheet_requests = dict()
+        for isheet, (sheet_id_and_tab_name, row_start) in \
+                enumerate(zip(sheet_ids_and_tab_names, row_starts)):
+            sheet_id, range = self.get_sheet_id_and_range(sheet_id_and_tab_name, row_start)
+            sheet_requests.setdefault(sheet_id, []).append((isheet, range))
+
+        all_rows = [ None ] * len(sheet_ids_and_tab_names)
+        def retrieve(sheet_id, http):
+            if(self.snapshot_directory):
+                ranges = [ range for isheet, range in sheet_requests[sheet_id] ]
+                revision, values = self.retrieve_snapshots(sheet_id, ranges, http=http)
+                for (isheet, range), sheet_rows in zip(sheet_requests[sheet_id], values):
+                    all_rows[isheet] = sheet_rows
+            requests_needed = [ (isheet, range) for isheet, range in sheet_requests[sheet_id]
+                if all_rows[isheet] is None ]
+            if(not requests_needed):
+                return
+            ranges = [ range for isheet, range in requests_needed ]
+            rows = self.retrieve_sheet_ranges(sheet_id, ranges, http=http, max_try=max_try)
+            for (isheet, range), sheet_rows in zip(requests_needed, rows):
+                all_rows[isheet] = sheet_rows
+                if(self.snapshot_directory):
+                    self.save_snapshot(sheet_id, range, revision, sheet_rows)
+
+        if(len(sheet_requests) == 1 or self.offline):
+            for sheet_id in sheet_requests:
+                retrieve(sheet_id, None)
         else:
-            return []
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = [ executor.submit(retrieve, sheet_id, self.new_http())
+                    for sheet_id in sheet_requests ]
+                for future in futures:
+                    future.result()
+        return all_rows
 
     def append_rows_to_sheet(self, sheet_id_and_tab_name, rows, row_start=0, max_try=2):
         sheet_id, range = self.get_sheet_id_and_tab_name(sheet_id_and_tab_name)
         if range:
             range = "'" + range + "'!"
         range += 'A%d:ZZZ'%(row_start+1)
-        ntry = 0
-        added = False
-        while(not added):
-            ntry += 1
-            try:
-                body = {
-                    'values': rows
-                }
-                response = self.sheets_service.spreadsheets().values().append(
-                    spreadsheetId=sheet_id, range=range,
-                    valueInputOption='USER_ENTERED', body=body).execute()
-                added = True
-            except googleapiclient.errors.HttpError:
-                if(ntry<max_try):
-                    if(ntry<len(self.ordinal)):
-                        print("Failed to append to sheet on %s attempt, trying again"%self.ordinal[ntry], file=sys.stderr)
-                    else:
-                        print("Failed to append to sheet on attempt %d, trying again"%ntry, file=sys.stderr)
-                    time.sleep(min(2**ntry,100))
-                else:
-                    if(ntry<len(self.ordinal)):
-                        print("Failed to append to sheet on %s and final attempt"%self.ordinal[ntry], file=sys.stderr)
-                    else:
-                        print("Failed to append to sheet on final attempt %d"%ntry, file=sys.stderr)
-                    raise
+        body = {
+            'values': rows
+        }
+        response = self.retry.call('append to sheet', lambda: self.execute(
+            self.sheets_service.spreadsheets().values().append(
+                spreadsheetId=sheet_id, range=range,
+                valueInputOption='USER_ENTERED', body=body)), max_try)
 
         return response.get('updates').get('updatedCells')
 
@@ -415,6 +1257,8 @@ class GoogleDriveUploader(Uploader):
     def get_id(self, rel_filepath):
         if(rel_filepath in self.directory):
             return self.directory[rel_filepath]
+        elif(rel_filepath in self.files_absent):
+            return ''
         else:
             (rel_path, filename) = os.path.split(rel_filepath)
             parent = self.make_path(rel_path, do_create = False)
@@ -426,10 +1270,10 @@ class GoogleDriveUploader(Uploader):
                     elif(self.assume_atomic):
                         return ''
 
-                response = self.drive_service.files().list(\
+                response = self.execute(self.drive_service.files().list(\
                     spaces='drive',
                     fields='files(id)',
-                    q="name='%s' and '%s' in parents and trashed=false"%(esc(filename),parent)).execute()
+                    q="name='%s' and '%s' in parents and trashed=false"%(esc(filename),parent)))
                 files = response.get('files', [])
                 for file in response.get('files', []):
                     self.directory[rel_filepath] = file.get('id')
@@ -437,157 +1281,78 @@ class GoogleDriveUploader(Uploader):
         return ''
 
     def get_url(self, rel_filepath):
-        if(rel_filepath in self.directory):
+        if(rel_filepath in self.web_view_links):
+            return self.web_view_links[rel_filepath]
+        elif(rel_filepath in self.directory):
             id = self.directory[rel_filepath]
-            response = self.drive_service.files().get(fileId=id,
-                fields='webViewLink').execute()
+            response = self.execute(self.drive_service.files().get(fileId=id,
+                fields='webViewLink'))
             return response.get('webViewLink')
         else:
             (rel_path, filename) = os.path.split(rel_filepath)
             parent = self.make_path(rel_path, do_create = False)
             if parent:
-                response = self.drive_service.files().list(\
+                response = self.execute(self.drive_service.files().list(\
                     spaces='drive',
                     fields='files(webViewLink)',
-                    q="name='%s' and '%s' in parents and trashed=false"%(esc(filename),parent)).execute()
+                    q="name='%s' and '%s' in parents and trashed=false"%(esc(filename),parent)))
                 files = response.get('files', [])
                 for file in response.get('files', []):
                     return file.get('webViewLink')
         return ''
 
     def get_sheet_tab_dict(self, sheet_id, max_try=2):
-        done = False
+        sheet_metadata = self.retry.call('get sheet tabs', lambda: self.execute(
+            self.sheets_service.spreadsheets().get(spreadsheetId=sheet_id,
+                fields='sheets(properties(title,sheetId))')), max_try)
         tabs = dict()
-        ntry = 0
-        while(not done):
-            ntry += 1
-            try:
-                sheet_metadata = self.sheets_service.spreadsheets().get(spreadsheetId=sheet_id,
-                    fields='sheets(properties(title,sheetId))').execute()
-
-                for sheet in sheet_metadata.get('sheets'):
-                    tabs[sheet.get("properties").get('title')] = \
-                        sheet.get("properties").get('sheetId')
-                done = True
-            except googleapiclient.errors.HttpError:
-                if(ntry<max_try):
-                    if(ntry<len(self.ordinal)):
-                        print("Failed to get sheet tabs on %s attempt, trying again"%self.ordinal[ntry], file=sys.stderr)
-                    else:
-                        print("Failed to get sheet tabs on attempt %d, trying again"%ntry, file=sys.stderr)
-                    time.sleep(min(2**ntry,100))
-                else:
-                    if(ntry<len(self.ordinal)):
-                        print("Failed to get sheet tabs on %s and final attempt"%self.ordinal[ntry], file=sys.stderr)
-                    else:
-                        print("Failed to get sheet tabs on final attempt %d"%ntry, file=sys.stderr)
-                    raise
+        for sheet in sheet_metadata.get('sheets'):
+            tabs[sheet.get("properties").get('title')] = \
+                sheet.get("properties").get('sheetId')
         return tabs
 
     def get_sheet_tab_ids(self, sheet_id, max_try=2):
-        done = False
-        tabs = []
-        ntry = 0
-        while(not done):
-            ntry += 1
-            try:
-                sheet_metadata = self.sheets_service.spreadsheets().get(spreadsheetId=sheet_id,
-                    fields='sheets(properties(title,sheetId))').execute()
-
-                for sheet in sheet_metadata.get('sheets'):
-                    tabs.append(sheet.get("properties").get('sheetId'))
-                done = True
-            except googleapiclient.errors.HttpError:
-                if(ntry<max_try):
-                    if(ntry<len(self.ordinal)):
-                        print("Failed to get sheet tabs on %s attempt, trying again"%self.ordinal[ntry], file=sys.stderr)
-                    else:
-                        print("Failed to get sheet tabs on attempt %d, trying again"%ntry, file=sys.stderr)
-                    time.sleep(min(2**ntry,100))
-                else:
-                    if(ntry<len(self.ordinal)):
-                        print("Failed to get sheet tabs on %s and final attempt"%self.ordinal[ntry], file=sys.stderr)
-                    else:
-                        print("Failed to get sheet tabs on final attempt %d"%ntry, file=sys.stderr)
-                    raise
-        return tabs
+        sheet_metadata = self.retry.call('get sheet tabs', lambda: self.execute(
+            self.sheets_service.spreadsheets().get(spreadsheetId=sheet_id,
+                fields='sheets(properties(title,sheetId))')), max_try)
+        return [ sheet.get("properties").get('sheetId') for sheet in sheet_metadata.get('sheets') ]
 
     def clear_sheet(self, sheet_id_and_tab_name, row_start=0, max_try=2):
         sheet_id, range = self.get_sheet_id_and_tab_name(sheet_id_and_tab_name)
         if range:
             range = "'" + range + "'!"
         range += 'A%d:ZZZ'%(row_start+1)
-        ntry = 0
-        done = False
-        while(not done):
-            ntry += 1
-            try:
-                response = self.sheets_service.spreadsheets().values().clear(
-                    spreadsheetId=sheet_id, range=range).execute()
-                done = True
-            except googleapiclient.errors.HttpError:
-                if(ntry<max_try):
-                    if(ntry<len(self.ordinal)):
-                        print("Failed to clear sheet on %s attempt, trying again"%self.ordinal[ntry], file=sys.stderr)
-                    else:
-                        print("Failed to clear sheet on attempt %d, trying again"%ntry, file=sys.stderr)
-                    time.sleep(min(2**ntry,100))
-                else:
-                    if(ntry<len(self.ordinal)):
-                        print("Failed to clear sheet on %s and final attempt"%self.ordinal[ntry], file=sys.stderr)
-                    else:
-                        print("Failed to clear sheet on final attempt %d"%ntry, file=sys.stderr)
-                    raise
+        self.retry.call('clear sheet', lambda: self.execute(
+            self.sheets_service.spreadsheets().values().clear(spreadsheetId=sheet_id, range=range)), max_try)
 
     def sort_sheet(self, sheet_id_and_tab_name, sort_column, ascending_order = True,
             row_start=0, max_try=2):
         sheet_id, tab_name = self.get_sheet_id_and_tab_name(sheet_id_and_tab_name)
-        ntry = 0
-        done = False
-        tab_id = ''
-        while(not done):
-            ntry += 1
-            try:
-                if(tab_name):
-                    tabs = self.get_sheet_tab_dict(sheet_id)
-                    if(tab_name in tabs):
-                        tab_id = tabs[tab_name]
-                    else:
-                        raise RuntimeError('Sheet not found ' + tab_name)
-                else:
-                    tab_id = self.get_sheet_tab_ids(sheet_id)[0]
-
-                self.sheets_service.spreadsheets().batchUpdate(spreadsheetId=sheet_id,
-                    body={
-                        'requests' : [
-                            {
-                                'sortRange' : {
-                                    'range' : {
-                                        'sheetId' : tab_id,
-                                        'startRowIndex' : row_start
-                                    },
-                                    'sortSpecs' : [
-                                        {
-                                            "sortOrder" : "ASCENDING" if ascending_order else "DESCENDING",
-                                            "dimensionIndex": sort_column
-                                        }
-                                    ]
+        if(tab_name):
+            tabs = self.get_sheet_tab_dict(sheet_id, max_try)
+            if(tab_name in tabs):
+                tab_id = tabs[tab_name]
+            else:
+                raise RuntimeError('Sheet not found ' + tab_name)
+        else:
+            tab_id = self.get_sheet_tab_ids(sheet_id, max_try)[0]
+
+        self.retry.call('sort sheet', lambda: self.execute(self.sheets_service.spreadsheets().batchUpdate(spreadsheetId=sheet_id,
+            body={
+                'requests' : [
+                    {
+                        'sortRange' : {
+                            'range' : {
+                                'sheetId' : tab_id,
+                                'startRowIndex' : row_start
+                            },
+                            'sortSpecs' : [
+                                {
+                                    "sortOrder" : "ASCENDING" if ascending_order else "DESCENDING",
+                                    "dimensionIndex": sort_column
                                 }
-                            }
-                        ]
-                    }).execute()
-
-                done = True
-            except googleapiclient.errors.HttpError:
-                if(ntry<max_try):
-                    if(ntry<len(self.ordinal)):
-                        print("Failed to sort sheet on %s attempt, trying again"%self.ordinal[ntry], file=sys.stderr)
-                    else:
-                        print("Failed to sort sheet on attempt %d, trying again"%ntry, file=sys.stderr)
-                    time.sleep(min(2**ntry,100))
-                else:
-                    if(ntry<len(self.ordinal)):
-                        print("Failed to sort sheet on %s and final attempt"%self.ordinal[ntry], file=sys.stderr)
-                    else:
-                        print("Failed to sort sheet on final attempt %d"%ntry, file=sys.stderr)
-                    raise
+                            ]
+                        }
+                    }
+                ]
+            })), max_try)
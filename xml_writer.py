@@ -0,0 +1,222 @@
+# Streaming XML writer that escapes text and attribute values and, if given a
+# DTD, checks each element against it as it is written, so that an invalid
+# document fails at the first bad element rather than after it has all been
+# written and checked by a separate tool.
+#
+# Only the parts of the DTD language used by author.dtd are supported : element
+# content that is EMPTY, ANY, (#PCDATA), or a sequence of child elements each
+# with an optional ?, * or + ; and attributes that are CDATA, ID or IDREF with
+# #REQUIRED, #IMPLIED, #FIXED or default values. Content models in XML must be
+# deterministic, so a sequence can be matched one child at a time without
+# looking ahead. Memory use depends only on the depth of the document and the
+# number of IDs, not on its length.
+
+import os
+import re
+
+# Control characters other than tab and newlines cannot appear in XML 1.0, not
+# even as character references, so they are removed
+invalid_char_re = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+def remove_invalid(x):
+    return invalid_char_re.sub('', x)
+
+def escape_text(x):
+    return remove_invalid(x).replace('&','&amp;').replace('<','&lt;').replace('>','&gt;')
+
+def escape_attribute(x):
+    return escape_text(x).replace('"','&quot;')
+
+name_re = re.compile(r'[^\W\d][\w.:-]*$')
+
+class DTD:
+    def __init__(self, filename) -> None:
+        self.filename = filename
+        self.elements = dict()
+        self.attributes = dict()
+        with open(filename,'r') as fp:
+            text = re.sub(r'<!--.*?-->', '', fp.read(), flags=re.DOTALL)
+        for kind, name, body in re.findall(r'<!(ELEMENT|ATTLIST)\s+(\S+)\s+(.*?)>', text, flags=re.DOTALL):
+            if(kind == 'ELEMENT'):
+                self.elements[name] = self.parse_content(name, body.strip())
+            else:
+                self.attributes.setdefault(name, dict()).update(self.parse_attributes(name, body))
+
+    def parse_content(self, name, body):
+        # Returns "EMPTY", "ANY", "PCDATA" or a list of (child, min, max)
+        if(body in ('EMPTY', 'ANY')):
+            return body
+        if(re.fullmatch(r'\(\s*#PCDATA\s*\)', body)):
+            return 'PCDATA'
+        match = re.fullmatch(r'\((.*)\)', body, flags=re.DOTALL)
+        if(match is None or re.search(r'[()|]', match.group(1))):
+            raise RuntimeError('Unsupported content model in DTD : %s %s'%(name, body))
+        sequence = []
+        for particle in match.group(1).split(','):
+            particle = particle.strip()
+            occurrence = particle[-1] if particle[-1] in '?*+' else ''
+            sequence.append((particle.rstrip('?*+'),
+                0 if occurrence in '?*' else 1, 1 if occurrence in '?' else None))
+        return sequence
+
+    def parse_attributes(self, name, body):
+        # Returns dict of attribute : (type, default), where default is
+        # "#REQUIRED", "#IMPLIED", or a ("#FIXED" or "", value) pair
+        attributes = dict()
+        for attribute, type, default, fixed, value in re.findall(
+                r'(\S+)\s+(CDATA|ID|IDREF)\s+(?:(#REQUIRED|#IMPLIED)|(#FIXED\s+)?"([^"]*)")', body):
+            attributes[attribute] = (type, default if default else ('#FIXED' if fixed else '', value))
+        return attributes
+
+# DTDs are parsed once per process and kept for as long as the file is unchanged
+dtd_cache = dict()
+
+def load_dtd(filename):
+    filename = os.path.abspath(filename)
+    mtime = os.path.getmtime(filename)
+    if(filename not in dtd_cache or dtd_cache[filename][0] != mtime):
+        dtd_cache[filename] = (mtime, DTD(filename))
+    return dtd_cache[filename][1]
+
+class ElementState:
+    __slots__ = ('name', 'content', 'position', 'count', 'has_children')
+
+    def __init__(self, name, content) -> None:
+        self.name = name
+        self.content = content
+        self.position = 0
+        self.count = 0
+        self.has_children = False
+
+class XMLWriter:
+    def __init__(self, fp, dtd=None, indent='   ') -> None:
+        self.fp = fp
+        self.dtd = dtd
+        self.indent = indent
+        self.stack = []
+        self.ids = set()
+        self.idrefs = dict()
+        self.root = None
+
+    def error(self, message):
+        raise RuntimeError('Invalid XML : %s (in %s)'%(message, '/'.join(e.name for e in self.stack) or 'document'))
+
+    def write(self, x):
+        self.fp.write(x)
+
+    def blank(self):
+        self.write('\n')
+
+    def declaration(self):
+        self.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+
+    def doctype(self, root, system):
+        self.root = root
+        self.write('<!DOCTYPE %s SYSTEM "%s">\n'%(root, system))
+
+    def check_child(self, name):
+        if(self.dtd is None):
+            return
+        if(name not in self.dtd.elements):
+            self.error('element not declared in DTD : '+name)
+        if(not self.stack):
+            if(self.root is not None and name != self.root):
+                self.error('root element is not %s : %s'%(self.root, name))
+            return
+        parent = self.stack[-1]
+        parent.has_children = True
+        if(parent.content == 'ANY'):
+            return
+        if(parent.content in ('EMPTY', 'PCDATA')):
+            self.error('element %s not allowed in %s content'%(name, parent.content))
+        while(parent.position < len(parent.content)):
+            child, min, max = parent.content[parent.position]
+            if(child == name and (max is None or parent.count < max)):
+                parent.count += 1
+                return
+            if(parent.count < min):
+                break
+            parent.position += 1
+            parent.count = 0
+        self.error('element %s not allowed here'%name)
+
+    def check_complete(self, e):
+        if(self.dtd is None or not isinstance(e.content, list)):
+            return
+        for child, min, max in e.content[e.position:]:
+            if(e.count < min):
+                self.error('missing element %s'%child)
+            e.count = 0
+
+    def check_attributes(self, name, attrs):
+        if(self.dtd is None):
+            return
+        declared = self.dtd.attributes.get(name, dict())
+        for attribute in attrs:
+            if(attribute not in declared):
+                self.error('attribute %s not declared for %s'%(attribute, name))
+            type, default = declared[attribute]
+            value = attrs[attribute]
+            if(isinstance(default, tuple) and default[0] == '#FIXED' and value != default[1]):
+                self.error('attribute %s of %s must be "%s"'%(attribute, name, default[1]))
+            if(type in ('ID', 'IDREF') and not name_re.match(value)):
+                self.error('attribute %s of %s is not a valid name : %s'%(attribute, name, value))
+            if(type == 'ID'):
+                if(value in self.ids):
+                    self.error('duplicate ID : '+value)
+                self.ids.add(value)
+            elif(type == 'IDREF' and value not in self.ids):
+                self.idrefs.setdefault(value, name)
+        for attribute in declared:
+            if(declared[attribute][1] == '#REQUIRED' and attribute not in attrs):
+                self.error('missing attribute %s of %s'%(attribute, name))
+
+    def open_tag(self, name, attrs, multiline, close):
+        if(not attrs):
+            return '<%s%s>'%(name, close)
+        if(multiline):
+            pad = '\n' + self.indent*(len(self.stack)+1)
+            return '<%s%s%s>'%(name, ''.join('%s%s="%s"'%(pad, a, escape_attribute(attrs[a])) for a in attrs), close)
+        return '<%s%s%s>'%(name, ''.join(' %s="%s"'%(a, escape_attribute(attrs[a])) for a in attrs), close)
+
+    def start(self, name, attrs=None, multiline=False):
+        # Open an element that will contain other elements
+        attrs = attrs or dict()
+        self.check_child(name)
+        self.check_attributes(name, attrs)
+        self.write(self.indent*len(self.stack) + self.open_tag(name, attrs, multiline, '') + '\n')
+        self.stack.append(ElementState(name, self.dtd.elements[name] if self.dtd else None))
+
+    def end(self):
+        e = self.stack[-1]
+        self.check_complete(e)
+        self.stack.pop()
+        self.write(self.indent*len(self.stack) + '</%s>\n'%e.name)
+        if(not self.stack):
+            self.finish()
+
+    def element(self, name, text=None, attrs=None, escaped=False):
+        # Write an element with only text, or an empty one if "text" is None.
+        # Text that is already escaped, such as the "_xml" fields of the author
+        # list, must be flagged as such so that it is not escaped twice.
+        attrs = attrs or dict()
+        self.check_child(name)
+        self.check_attributes(name, attrs)
+        if(self.dtd is not None):
+            content = self.dtd.elements[name]
+            if(text is None and isinstance(content, list) and any(min for child, min, max in content)):
+                self.error('element %s cannot be empty'%name)
+            if(text is not None and content not in ('PCDATA', 'ANY')):
+                self.error('element %s cannot contain text'%name)
+        if(text is None):
+            self.write(self.indent*len(self.stack) + self.open_tag(name, attrs, False, ' /') + '\n')
+        else:
+            self.write(self.indent*len(self.stack) + self.open_tag(name, attrs, False, '')
+                + (remove_invalid(text) if escaped else escape_text(text)) + '</%s>\n'%name)
+
+    def finish(self):
+        # References to IDs can come before the IDs themselves, so they can
+        # only all be checked at the end of the document
+        for value in self.idrefs:
+            if(value not in self.ids):
+                self.error('reference to undefined ID %s in %s'%(value, self.idrefs[value]))
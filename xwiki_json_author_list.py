@@ -1,17 +1,50 @@
-import json
+import io
+import os
+import sys
+import glob
 import html
 import unicodedata
 import re
+import contextlib
+import concurrent.futures
 import pylatexenc.latexencode
+import pylatexenc.version
 import argparse
+import encoding_cache
+import author_records
+import profiler
+import json_backend
+import author_statistics
 
-def asciify(x):
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# Encodings are memoized in this cache, which the main block attaches to a file
+# on disk so that it persists between runs. Bump the versions below whenever the
+# corresponding encoding function changes.
+cache = encoding_cache.EncodingCache()
+asciify_version = '1/unicode-' + unicodedata.unidata_version
+htmlify_version = '1'
+latexify_version = '1/pylatexenc-' + pylatexenc.version.version_str
+
+def do_asciify(x):
     return unicodedata.normalize('NFKD', x).encode('ascii', 'ignore').decode('utf-8').strip()
 
-def htmlify(x):
+def do_htmlify(x):
     return html.escape(x).encode('ascii', 'xmlcharrefreplace').decode()
 #    return x.encode('ascii', 'xmlcharrefreplace').decode('utf8')
 
+def asciify(x):
+    return cache.encode('asciify', asciify_version, do_asciify, x)
+
+def htmlify(x):
+    return cache.encode('htmlify_escaped', htmlify_version, do_htmlify, x)
+
+def latexify(x):
+    return cache.encode('latexify', latexify_version, pylatexenc.latexencode.unicode_to_latex, x)
+
 def nbspify(x):
     return re.sub('\s+', '&nbsp;', x)
 
@@ -20,7 +53,7 @@ def sig_asciified(sig):
 
 def sig_latex(sig):
     sig = re.sub('\s+','\u00A0',sig)
-    return pylatexenc.latexencode.unicode_to_latex(sig)
+    return latexify(sig)
 
 def sig_html(sig):
     return nbspify(htmlify(sig))
@@ -45,175 +78,437 @@ def format_author_name(firstname, lastname):
             name += ' ' + fn
     return name
 
-# ================ #
-# Main entry point #
-# ================ #
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser()
+class Person(author_records.Person):
+    __slots__ = ()
 
-    parser.add_argument('--input', '-i', default='cta_authors.json', help='Input JSON file name (default: "%(default)s")')
-    parser.add_argument('--output', '-o', default='authors.json', help='Output JSON file name (default: "%(default)s")')
+    @author_records.memoized
+    def sortorder(self):
+        return asciify(self.signature).lower()
 
-    args = parser.parse_args()
+    @author_records.memoized
+    def lastname_asciified(self):
+        return asciify(self.lastname)
 
-    with open(args.input,'r') as fp:
-        paper = json.load(fp)
+    @author_records.memoized
+    def lastname_xml(self):
+        return htmlify(self.lastname)
 
-    print(paper['paper_title'])
+    @author_records.memoized
+    def lastname_latex(self):
+        return latexify(self.lastname)
+
+    @author_records.memoized
+    def firstname_asciified(self):
+        return asciify(self.firstname)
+
+    @author_records.memoized
+    def firstname_xml(self):
+        return htmlify(self.firstname)
+
+    @author_records.memoized
+    def firstname_latex(self):
+        return latexify(self.firstname)
+
+    @author_records.memoized
+    def author_asciified(self):
+        return sig_asciified(self.paper_name)
+
+    @author_records.memoized
+    def author_html(self):
+        return sig_html(self.paper_name)
+
+    @author_records.memoized
+    def author_xml(self):
+        return htmlify(self.paper_name)
+
+    @author_records.memoized
+    def author_latex(self):
+        return sig_latex(self.paper_name)
+
+class Place(author_records.Place):
+    __slots__ = ()
+
+    @author_records.memoized
+    def short_name_asciified(self):
+        return asciify(self.short_name)
+
+    @author_records.memoized
+    def short_name_xml(self):
+        return htmlify(self.short_name)
+
+    @author_records.memoized
+    def short_name_latex(self):
+        return latexify(self.short_name)
+
+    @author_records.memoized
+    def address_asciified(self):
+        return asciify(self.address)
+
+    @author_records.memoized
+    def address_xml(self):
+        return htmlify(self.address)
+
+    @author_records.memoized
+    def address_latex(self):
+        return latexify(self.address)
+
+author_list_comment = \
+    "CTA author list in JSON format. Contains an array of authors in order that\n" \
+    + "they should be included in the author list (element \"authors\"), and an array\n" \
+    + "of places to which the authors are affiliated (element \"affiliations\").\n\n" \
+    + "Array \"authors\" :\n" \
+    + "- author_id         : Unique identifier of author in SAPO database.\n" \
+    + "- lastname          : Last name(s) of author in unicode.\n" \
+    + "- firstname         : First name(s) of author in unicode.\n" \
+    + "- email             : Email addresses for all authors.\n" \
+    + "- corresponding     : Corresponding author.\n" \
+    + "- orcid             : ORCID identifier if available (optional).\n" \
+    + "- author_sortorder  : Sort key used to order authors names (ascii in format\n" \
+    + "                      \"lastname, f. i.\").\n" \
+    + "- author_asciified  : Ascii version of author's name (in format \n"\
+    + "                      \"F. I. Lastname\", with unicode removed).\n" \
+    + "- author_unicode    : Unicode version of author's name in format\n" \
+    + "                      \"F. I. Lastname\".\n" \
+    + "- author_html       : HTML version of author's name in format\n" \
+    + "                      \"F.&nbsp;I.&nbsp;Lastname\".\n" \
+    + "- author_latex      : LaTeX version of author's name in format\n" \
+    + "                      \"F.~I.~Lastname\".\n" \
+    + "- affil_nums        : Array listing positions of authors' affiliations in the\n" \
+    + "                      affiliation array (starting at zero).\n" \
+    + "- affil_num_strs    : Array listing positions of authors' affiliations in the\n" \
+    + "                      affiliation array as string (staring at one).\n" \
+    + "- affil_place_keys  : Array of text keys for authors affiliations. Can be used\n" \
+    + "                      as a unique but readble key for LaTeX \\ref/\\label pairing\n" \
+    + "                      to identify affiliations.\n" \
+    + "- affil_place_ids   : Array of numeric identifiers for authors affiliations\n" \
+    + "                      corresponding to identifier in the SAPO database \n" \
+    + "                      (not recommended for general use).\n\n" \
+    + "Array \"affiliations\" :\n" \
+    + "- affil_num         : Position of affiliation in the affiliation array\n" \
+    + "                      (starting at zero).\n" \
+    + "- affil_num_str     : Position of affiliation in the affiliation array as\n" \
+    + "                      string (staring at one).\n" \
+    + "- place_key         : Text key for affiliation. Can be used as a unique but\n" \
+    + "                      readble key for LaTeX \\ref/\\label pairing to identify\n" \
+    + "                      affiliations.\n" \
+    + "- place_id          : Numeric identifier for affiliation corresponding to \n" \
+    + "                      identifier in the SAPO database (not recommended for\n" \
+    + "                      general use).\n" \
+    + "- short_name_unicode: Short name of place in unicode.\n" \
+    + "- short_name_latex  : Short name of place in LaTeX format.\n" \
+    + "- country           : Country.\n" \
+    + "- address_asciified : Ascii version of address (with unicode removed).\n" \
+    + "- address_unicode   : Unicode version of address.\n" \
+    + "- address_html      : HTML version of address with unicode escaped.\n" \
+    + "- address_latex     : LaTeX version of address with unicode escaped.\n"
+
+def person_from_xwiki(author):
+    return Person.from_xwiki(author, format_author_name(author['firstName'], author['lastName']))
+
+def load_paper(filename, backend='json', stream=False):
+    if(stream and ijson is not None):
+        return load_paper_streaming(filename)
+    with open(filename,'r') as fp:
+        return json_backend.load(fp, backend)
+
+def load_paper_streaming(filename):
+    # Parse the export incrementally with ijson, turning each author into a
+    # compact record as soon as it has been read, so that the author dicts of
+    # a very large export are never all held in memory
+    paper = dict(corresponding_authors = [], addresses = dict(), authors = [])
+    builder = None
+    with open(filename,'rb') as fp:
+        # Numbers as float, as json.load gives them, rather than Decimal
+        for prefix, event, value in ijson.parse(fp, use_float=True):
+            if(builder is not None):
+                builder.event(event, value)
+                if(prefix == building and event == 'end_map'):
+                    if(building == 'addresses'):
+                        paper['addresses'] = builder.value
+                    else:
+                        paper['authors'].append(person_from_xwiki(builder.value))
+                    builder = None
+            elif(prefix in ('addresses', 'authors.item') and event == 'start_map'):
+                building = prefix
+                builder = ijson.ObjectBuilder()
+                builder.event(event, value)
+            elif(prefix in ('paper_title', 'date') and event == 'string'):
+                paper[prefix] = value
+            elif(prefix == 'corresponding_authors.item' and event == 'string'):
+                paper['corresponding_authors'].append(value)
+    return paper
+
+def check_authors(paper):
+    places = dict()
+    for place_id in paper['addresses']:
+        places[place_id] = Place.from_xwiki(place_id, paper['addresses'][place_id],
+            short_place_key(place_id))
 
+    people = []
     sig_map = {}
-    for p in paper['authors']:
-        pid = p['user']
-        
-        sig = p['signature']
-        fn = p['firstName']
-        ln = p['lastName']
+    for author in paper['authors']:
+        p = author if isinstance(author, Person) else person_from_xwiki(author)
+        people.append(p)
+        pid = p.id
+        sig = p.paper_name
 
         if(sig in sig_map):
-            print('WARNING duplicate signature : %s (ids : %s and %s)'%(sig,pid,sig_map[sig]['user']))
+            print('WARNING duplicate signature : %s (ids : %s and %s)'%(sig,pid,sig_map[sig].id))
         else:
             sig_map[sig] = p
     
-        if(not p['affiliations']):
+        if(not p.affiliation_ids):
             print('WARNING author has no affiliation :',pid)
         else:
-            for a in p['affiliations']:
-                if(a != "" and a not in paper['addresses']):
+            for a in p.affiliation_ids:
+                if(a != "" and a not in places):
                     print('WARNING author affiliation not found :',pid,a)
                 elif(a == ""):
                     print('INFO author affiliation empty :',pid)
 
-        p['alphaName'] = asciify(format_author_name(fn, ln)).lower()
+    return places, people
 
+def build_author_list(paper, places, people, stream=False, statistics=False):
     author_list = dict()
     affiliations_list = []
     author_affiliation_key = dict()
-    for p in sorted(paper['authors'], key=lambda x: x['alphaName']):
-        ai = p['alphaName']
-        sig = p['signature']
-        place_ids = []
-        place_keys = []
+    for p in sorted(people, key=lambda x: x.sortorder):
+        ai = p.sortorder
         affil_nums = []
-        affil_num_strs = []
-        for place_id in p['affiliations']:
-            if(place_id and place_id in paper['addresses']):
-                place_key = short_place_key(place_id)
-                place = paper['addresses'][place_id]
+        for place_id in p.place_ids:
+            if(place_id in places):
+                place = places[place_id]
                 if(place_id not in author_affiliation_key):
                     author_affiliation_key[place_id] = len(affiliations_list)
                     affiliations_list.append(dict(
                         affil_num            = len(affiliations_list),
                         affil_num_str        = str(len(affiliations_list)+1),
                         place_id             = place_id,
-                        place_key            = place_key,
-                        short_name_asciified = asciify(place['shortName']),
-                        short_name_unicode   = place['shortName'],
-                        short_name_xml       = htmlify(place['shortName']),
-                        short_name_latex     = pylatexenc.latexencode.unicode_to_latex(place['shortName']),
-                        country              = place['country'],
-                        address_asciified    = asciify(place['address']),
-                        address_unicode      = place['address'],
-                        address_xml          = htmlify(place['address']),
-                        address_latex        = pylatexenc.latexencode.unicode_to_latex(place['address'])
+                        place_key            = place.key,
+                        short_name_asciified = place.short_name_asciified,
+                        short_name_unicode   = place.short_name,
+                        short_name_xml       = place.short_name_xml,
+                        short_name_latex     = place.short_name_latex,
+                        country              = place.country,
+                        address_asciified    = place.address_asciified,
+                        address_unicode      = place.address,
+                        address_xml          = place.address_xml,
+                        address_latex        = place.address_latex
                     ))
-                place_ids.append(place_id)
-                place_keys.append(place_key)
                 affil_nums.append(author_affiliation_key[place_id])
-                affil_num_strs.append(str(author_affiliation_key[place_id]+1))
                 ai += ", %06d"%author_affiliation_key[place_id]
-        
-        author_list[ai] = dict(
-            author_id           = p['user'],
-            lastname_asciified  = asciify(p['lastName']),
-            lastname_unicode    = p['lastName'],
-            lastname_xml        = htmlify(p['lastName']),
-            lastname_latex      = pylatexenc.latexencode.unicode_to_latex(p['lastName']),
-            firstname_asciified = asciify(p['firstName']),
-            firstname_unicode   = p['firstName'],
-            firstname_xml       = htmlify(p['firstName']),
-            firstname_latex     = pylatexenc.latexencode.unicode_to_latex(p['firstName']),
-            email               = p['email'],
-            corresponding       = False,
-            orcid               = p['orcid'],
+
+        author_list[ai] = (p, affil_nums)
+        if p.id in paper['corresponding_authors']:
+            print("Info corresponding author :", p.paper_name)
+
+    def author_entry(p, affil_nums):
+        place_ids = [ place_id for place_id in p.place_ids if place_id in places ]
+        return dict(
+            author_id           = p.id,
+            lastname_asciified  = p.lastname_asciified,
+            lastname_unicode    = p.lastname,
+            lastname_xml        = p.lastname_xml,
+            lastname_latex      = p.lastname_latex,
+            firstname_asciified = p.firstname_asciified,
+            firstname_unicode   = p.firstname,
+            firstname_xml       = p.firstname_xml,
+            firstname_latex     = p.firstname_latex,
+            email               = p.email,
+            corresponding       = p.id in paper['corresponding_authors'],
+            orcid               = p.orcid,
             affil_place_ids     = place_ids,
-            affil_place_keys    = place_keys,
+            affil_place_keys    = [ places[place_id].key for place_id in place_ids ],
             affil_nums          = affil_nums,
-            affil_num_strs      = affil_num_strs,
-            author_sortorder    = p['alphaName'],
-            author_asciified    = sig_asciified(sig),
-            author_unicode      = sig,
-            author_html         = sig_html(sig),
-            author_xml          = htmlify(sig),
-            author_latex        = sig_latex(sig),
+            affil_num_strs      = [ str(x+1) for x in affil_nums ],
+            author_sortorder    = p.sortorder,
+            author_asciified    = p.author_asciified,
+            author_unicode      = p.paper_name,
+            author_html         = p.author_html,
+            author_xml          = p.author_xml,
+            author_latex        = p.author_latex,
         )
-        if p['user'] in paper['corresponding_authors']:
-            print("Info corresponding author :", sig)
-            author_list[ai]['corresponding'] = True
-
-    comment = \
-        "CTA author list in JSON format. Contains an array of authors in order that\n" \
-        + "they should be included in the author list (element \"authors\"), and an array\n" \
-        + "of places to which the authors are affiliated (element \"affiliations\").\n\n" \
-        + "Array \"authors\" :\n" \
-        + "- author_id         : Unique identifier of author in SAPO database.\n" \
-        + "- lastname          : Last name(s) of author in unicode.\n" \
-        + "- firstname         : First name(s) of author in unicode.\n" \
-        + "- email             : Email addresses for all authors.\n" \
-        + "- corresponding     : Corresponding author.\n" \
-        + "- orcid             : ORCID identifier if available (optional).\n" \
-        + "- author_sortorder  : Sort key used to order authors names (ascii in format\n" \
-        + "                      \"lastname, f. i.\").\n" \
-        + "- author_asciified  : Ascii version of author's name (in format \n"\
-        + "                      \"F. I. Lastname\", with unicode removed).\n" \
-        + "- author_unicode    : Unicode version of author's name in format\n" \
-        + "                      \"F. I. Lastname\".\n" \
-        + "- author_html       : HTML version of author's name in format\n" \
-        + "                      \"F.&nbsp;I.&nbsp;Lastname\".\n" \
-        + "- author_latex      : LaTeX version of author's name in format\n" \
-        + "                      \"F.~I.~Lastname\".\n" \
-        + "- affil_nums        : Array listing positions of authors' affiliations in the\n" \
-        + "                      affiliation array (starting at zero).\n" \
-        + "- affil_num_strs    : Array listing positions of authors' affiliations in the\n" \
-        + "                      affiliation array as string (staring at one).\n" \
-        + "- affil_place_keys  : Array of text keys for authors affiliations. Can be used\n" \
-        + "                      as a unique but readble key for LaTeX \\ref/\\label pairing\n" \
-        + "                      to identify affiliations.\n" \
-        + "- affil_place_ids   : Array of numeric identifiers for authors affiliations\n" \
-        + "                      corresponding to identifier in the SAPO database \n" \
-        + "                      (not recommended for general use).\n\n" \
-        + "Array \"affiliations\" :\n" \
-        + "- affil_num         : Position of affiliation in the affiliation array\n" \
-        + "                      (starting at zero).\n" \
-        + "- affil_num_str     : Position of affiliation in the affiliation array as\n" \
-        + "                      string (staring at one).\n" \
-        + "- place_key         : Text key for affiliation. Can be used as a unique but\n" \
-        + "                      readble key for LaTeX \\ref/\\label pairing to identify\n" \
-        + "                      affiliations.\n" \
-        + "- place_id          : Numeric identifier for affiliation corresponding to \n" \
-        + "                      identifier in the SAPO database (not recommended for\n" \
-        + "                      general use).\n" \
-        + "- short_name_unicode: Short name of place in unicode.\n" \
-        + "- short_name_latex  : Short name of place in LaTeX format.\n" \
-        + "- country           : Country.\n" \
-        + "- address_asciified : Ascii version of address (with unicode removed).\n" \
-        + "- address_unicode   : Unicode version of address.\n" \
-        + "- address_html      : HTML version of address with unicode escaped.\n" \
-        + "- address_latex     : LaTeX version of address with unicode escaped.\n"
 
+    author_entries = json_backend.LazyArray(author_entry, [author_list[x] for x in sorted(author_list)])
     author_affiliation_list = dict(
-        _comment        = comment,
+        _comment        = author_list_comment,
         title_unicode   = paper['paper_title'],
         title_xml       = htmlify(paper['paper_title']),
-        title_latex     = pylatexenc.latexencode.unicode_to_latex(paper['paper_title']),
+        title_latex     = latexify(paper['paper_title']),
         title_asciified = asciify(paper['paper_title']),
         date            = paper['date'],
-        authors         = [author_list[x] for x in sorted(author_list)],
-        affiliations    = affiliations_list
+        authors         = author_entries if stream else list(author_entries),
+        affiliations    = affiliations_list,
     )
+    if(statistics):
+        author_affiliation_list['statistics'] = author_statistics.compute(
+            [ author_list[x][1] for x in sorted(author_list) ], affiliations_list)
+    return author_affiliation_list
+
+def make_author_list(paper, statistics=False):
+    # Validate the XWiki export "paper" and build its author list in memory
+    places, people = check_authors(paper)
+    return build_author_list(paper, places, people, statistics=statistics)
 
-    with open(args.output,'w') as fp:
-        json.dump(author_affiliation_list,fp,indent=4)
+def process_paper(input, output, args, prof):
+    # Build the author list for one XWiki export and write it to "output".
+    # Returns a summary of the paper.
+    with prof.stage('read_json'):
+        paper = load_paper(input, args.json_backend, args.stream_input)
+
+    print(paper['paper_title'])
+
+    with prof.stage('validate'):
+        places, people = check_authors(paper)
+
+    with prof.stage('build_author_list'):
+        author_affiliation_list = build_author_list(paper, places, people, args.json_stream, args.statistics)
+
+    with prof.stage('write_json'):
+        with open(output,'w') as fp:
+            if(args.json_stream):
+                json_backend.dump_streaming(author_affiliation_list,fp,args.json_backend,args.json_compact)
+            else:
+                json_backend.dump(author_affiliation_list,fp,args.json_backend,args.json_compact)
 
     print('')
-    print("Number of authors:",len(author_list))
-    print("Number of affiliations:",len(affiliations_list))
\ No newline at end of file
+    print("Number of authors:",len(author_affiliation_list['authors']))
+    print("Number of affiliations:",len(author_affiliation_list['affiliations']))
+
+    return dict(input = input, output = output, title = paper['paper_title'],
+        authors = len(author_affiliation_list['authors']),
+        affiliations = len(author_affiliation_list['affiliations']))
+
+def batch_jobs(args):
+    # (input, output) pairs from the input directory and the manifest, which is
+    # a JSON list of input file names, or of objects with "input" and
+    # optionally "output" file names
+    jobs = []
+    if(args.input_dir):
+        for input in sorted(glob.glob(os.path.join(args.input_dir, '*.json'))):
+            jobs.append((input, None))
+    if(args.manifest):
+        with open(args.manifest,'r') as fp:
+            manifest = json_backend.load(fp)
+        base = os.path.dirname(args.manifest)
+        for entry in manifest:
+            if(isinstance(entry, str)):
+                entry = dict(input = entry)
+            jobs.append((os.path.join(base, entry['input']), entry.get('output')))
+    jobs = [ (input, output or os.path.join(args.output_dir,
+        os.path.splitext(os.path.basename(input))[0] + '_authors.json')) for input, output in jobs ]
+    # The output directory may be the input directory, in which case the
+    # outputs and summary of an earlier run must not be taken as exports
+    outputs = set(os.path.abspath(output) for input, output in jobs)
+    if(args.summary):
+        outputs.add(os.path.abspath(args.summary))
+    return [ (input, output) for input, output in jobs if os.path.abspath(input) not in outputs ]
+
+# Options of the worker processes of a parallel batch
+batch_args = None
+
+def batch_worker_init(args):
+    global batch_args
+    batch_args = args
+    # Forked workers inherit the cache of the parent, others must load it
+    if(cache.filename is None):
+        cache.open(args.encoding_cache, args.encoding_cache_size)
+    cache.track_added()
+
+def batch_worker(job):
+    # Build one paper, returning its summary with the warnings it produced and
+    # its log rather than printing it, so that the logs of the papers are not
+    # interleaved, and the new encodings so that the parent can save them
+    input, output = job
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        try:
+            summary = process_paper(input, output, batch_args, profiler.Profiler())
+        except Exception as e:
+            print('ERROR could not process paper :',input,':',e)
+            summary = dict(input = input, output = None, error = str(e))
+    summary['warnings'] = [ l for l in log.getvalue().splitlines()
+        if l.startswith(('ERROR','WARNING','INFO')) ]
+    return summary, log.getvalue(), cache.take_added()
+
+# ================ #
+# Main entry point #
+# ================ #
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--input', '-i', default='cta_authors.json', help='Input JSON file name (default: "%(default)s")')
+    parser.add_argument('--output', '-o', default='authors.json', help='Output JSON file name (default: "%(default)s")')
+    parser.add_argument('--encoding_cache', default=encoding_cache.default_filename, help='File in which to cache LaTeX, HTML and ASCII encodings between runs, or empty to disable (default: "%(default)s")')
+    parser.add_argument('--encoding_cache_size', type=int, default=100000, help='Maximum number of entries in the encoding cache (default: %(default)s)')
+    parser.add_argument('--input_dir', default=None, help='Build an author list for each XWiki export (*.json) in this directory')
+    parser.add_argument('--manifest', default=None, help='Build an author list for each XWiki export listed in this JSON file, as file names or objects with "input" and "output" file names')
+    parser.add_argument('--output_dir', default='.', help='Directory for author lists of a batch, named INPUT_authors.json unless given in the manifest (default: "%(default)s")')
+    parser.add_argument('--summary', default=None, help='Write the number of authors and the warnings of each paper of a batch to this JSON file')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes over which to spread the papers of a batch (default: %(default)s)')
+    parser.add_argument('--stream_input', action='store_true', help='Parse the input incrementally with ijson, if it is installed, rather than loading it all at once')
+    parser.add_argument('--statistics', action='store_true', help='Add the number of authors per country and per affiliation to the output')
+    json_backend.add_arguments(parser)
+    profiler.add_arguments(parser)
+
+    args = parser.parse_args()
+
+    prof = profiler.from_args(args)
+
+    if(args.stream_input and ijson is None):
+        print("WARNING ijson is not installed, reading input without streaming")
+
+    with prof.stage('encoding_cache_load'):
+        cache.open(args.encoding_cache, args.encoding_cache_size)
+
+    failed = False
+    if(args.input_dir or args.manifest):
+        jobs = batch_jobs(args)
+        if(not jobs):
+            print("ERROR no XWiki exports found for batch")
+            sys.exit(1)
+        if(not os.path.isdir(args.output_dir)):
+            os.makedirs(args.output_dir)
+        summaries = []
+        with prof.stage('batch'):
+            if(args.workers > 1 and len(jobs) > 1):
+                pool = concurrent.futures.ProcessPoolExecutor(min(args.workers, len(jobs)),
+                    initializer=batch_worker_init, initargs=(args,))
+                results = pool.map(batch_worker, jobs)
+            else:
+                pool = None
+                batch_worker_init(args)
+                results = map(batch_worker, jobs)
+            for summary, log, added in results:
+                print('')
+                print("Info paper :",summary['input'])
+                sys.stdout.write(log)
+                cache.merge(added)
+                summaries.append(summary)
+            if(pool is not None):
+                pool.shutdown()
+
+        print('')
+        for summary in summaries:
+            if(summary.get('error')):
+                failed = True
+                print('ERROR %s : %s'%(summary['input'],summary['error']))
+            else:
+                print('Info %s : %d authors, %d affiliations, %d warnings -> %s'%(summary['input'],
+                    summary['authors'],summary['affiliations'],len(summary['warnings']),summary['output']))
+        if(args.summary):
+            with open(args.summary,'w') as fp:
+                json_backend.dump(summaries,fp)
+    else:
+        process_paper(args.input, args.output, args, prof)
+
+    with prof.stage('encoding_cache_save'):
+        cache.save()
+
+    cache.print_stats()
+
+    prof.add_counters('encoding_cache.', cache.stats())
+    prof.finish()
+
+    if(failed):
+        sys.exit(1)